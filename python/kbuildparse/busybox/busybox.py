@@ -130,7 +130,7 @@ class _02_BusyboxObjects(BaseClasses.DuringPass):
             matches = [x for x in re.split("\t| ", rhs) if x]
             for match in matches:
                 fullpath = basepath + "/" + match
-                if os.path.isdir(fullpath):
+                if Tools.dircache.isdir(fullpath):
                     parser.local_vars["dir_cond_collection"][fullpath].\
                         add_alternative(parser.local_vars["ifdef_condition"][:])
                 else:
@@ -153,7 +153,7 @@ class _02_BusyboxObjects(BaseClasses.DuringPass):
 
             for match in matches:
                 fullpath = basepath + "/" + match
-                if os.path.isdir(fullpath):
+                if Tools.dircache.isdir(fullpath):
                     parser.local_vars["dir_cond_collection"][fullpath].\
                         add_alternative(parser.local_vars["ifdef_condition"][:])
                 else:
@@ -253,7 +253,7 @@ class _01_BusyboxExpandMacros(BaseClasses.AfterPass):
                 if config_in_composite:
                     passdown_condition.append(condition_comp)
 
-                if os.path.isdir(fullpath):
+                if Tools.dircache.isdir(fullpath):
                     parser.local_vars["dir_cond_collection"]\
                         [fullpath].add_alternative(passdown_condition[:])
                 else:
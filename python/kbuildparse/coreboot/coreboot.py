@@ -65,11 +65,11 @@ class CorebootInit(BaseClasses.InitClass):
 
         for vendor in os.listdir("src/mainboard"):
             directory = "src/mainboard/" + vendor
-            if not os.path.isdir(directory):
+            if not Tools.dircache.isdir(directory):
                 continue
             for mainboard in os.listdir(directory):
                 f = directory + "/" + mainboard
-                if not os.path.isdir(f):
+                if not Tools.dircache.isdir(f):
                     continue
 
                 parser.global_vars["mainboard_dirs"].append(vendor + "/" + \
@@ -99,7 +99,7 @@ class CorebootInit(BaseClasses.InitClass):
                         for mainboard_dir in parser.global_vars["mainboard_dirs"]:
                             subdir = re.sub(r"\$\(MAINBOARDDIR\)",
                                             mainboard_dir, item)
-                            if os.path.isdir(subdir):
+                            if Tools.dircache.isdir(subdir):
                                 dirs_to_process[subdir] = DataStructures.Precondition()
 
                     elif r"$(ARCHDIR-y)" in line:
@@ -111,7 +111,7 @@ class CorebootInit(BaseClasses.InitClass):
                             add_alternative(precond)
                         dirs_to_process[item] = precond
 
-                    elif os.path.isdir(item):
+                    elif Tools.dircache.isdir(item):
                         dirs_to_process[item] = DataStructures.Precondition()
 
         # User provided directories have no precondition
@@ -213,7 +213,7 @@ class _02_CorebootObjects(BaseClasses.DuringPass):
                 if not subdir.group(1) == "y":
                     tmp_condition.add_condition("CONFIG_" + subdir.group(2))
 
-                if os.path.isdir(fullpath):
+                if Tools.dircache.isdir(fullpath):
                     additional_condition = []
                     # See below, this is not really Kbuild, but approximation to
                     # golem formulae
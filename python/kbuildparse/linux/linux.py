@@ -181,7 +181,7 @@ class LinuxInit(BaseClasses.InitClass):
         matches = [x for x in re.split("\t| ", rhs) if x]
 
         for match in matches:
-            if not os.path.isdir(match):
+            if not Tools.dircache.isdir(match):
                 continue
 
             if match[-1] != '/':
@@ -220,7 +220,7 @@ class LinuxInit(BaseClasses.InitClass):
                 fullpath = "arch/arm/mach-" + match
             else:
                 fullpath = "arch/arm/plat-" + match
-            if not os.path.isdir(fullpath):
+            if not Tools.dircache.isdir(fullpath):
                 continue
 
             if fullpath[-1] != '/':
@@ -259,13 +259,13 @@ class LinuxInit(BaseClasses.InitClass):
                 continue
 
             fullpath = "arch/blackfin/mach-" + match
-            if os.path.isdir(fullpath):
+            if Tools.dircache.isdir(fullpath):
                 if fullpath[-1] != '/':
                     fullpath += '/'
                 local_arch_dirs[fullpath].append(current_precondition[:])
 
             fullpath = "arch/blackfin/mach-" + match + "/boards/"
-            if os.path.isdir(fullpath):
+            if Tools.dircache.isdir(fullpath):
                 if fullpath[-1] != '/':
                     fullpath += '/'
                 local_arch_dirs[fullpath].append(current_precondition[:])
@@ -288,7 +288,7 @@ class LinuxInit(BaseClasses.InitClass):
                 config = "CONFIG_" + regex_match.group(1)
                 rhs = regex_match.group(2)
                 fulldir = "arch/mips/" + rhs
-                if os.path.isdir(fulldir):
+                if Tools.dircache.isdir(fulldir):
                     current_precondition = DataStructures.Precondition()
                     current_precondition.add_condition(config)
                     local_arch_dirs[fulldir].append(current_precondition)
@@ -318,7 +318,7 @@ class LinuxInit(BaseClasses.InitClass):
         depending on the architecture, which is why other helper
         routines are called for processing them."""
 
-        if not os.path.isfile(path):
+        if not Tools.dircache.isfile(path):
             logging.debug("arch/ parsing: no such file: " + path)
             return
 
@@ -357,7 +357,7 @@ class LinuxInit(BaseClasses.InitClass):
         if not directory.endswith('/'):
             directory += '/'
         descend = directory + "Kbuild"
-        if not os.path.isfile(descend):
+        if not Tools.dircache.isfile(descend):
             descend = directory + "Makefile"
         return descend
 
@@ -511,7 +511,7 @@ class _02_LinuxObjects(BaseClasses.DuringPass):
                 matches = [x for x in re.split("\t| ", rhs) if x]
                 for match in matches:
                     fullpath = basepath + "/" + match
-                    if os.path.isdir(fullpath):
+                    if Tools.dircache.isdir(fullpath):
                         parser.local_vars["dir_cond_collection"][fullpath].\
                             add_alternative(
                                 parser.local_vars["ifdef_condition"][:]
@@ -540,7 +540,7 @@ class _02_LinuxObjects(BaseClasses.DuringPass):
 
                 for match in matches:
                     fullpath = basepath + "/" + match
-                    if os.path.isdir(fullpath):
+                    if Tools.dircache.isdir(fullpath):
                         # Has this directory been picked up via subdir-XY?
                         if parser.local_vars["ifdef_condition"] in \
                                 parser.local_vars["dir_cond_collection"][fullpath]:
@@ -579,7 +579,7 @@ class _02_LinuxObjects(BaseClasses.DuringPass):
             rhs_matches = [x.rstrip("/") for x in re.split("\t| ", rhs) if x]
             for m in rhs_matches:
                 fullpath = basepath + "/" + m + "/"
-                if not os.path.isdir(fullpath):
+                if not Tools.dircache.isdir(fullpath):
                     continue
 
                 # Has this directory been picked up via obj-XY?
@@ -696,7 +696,7 @@ class _01_LinuxExpandMacros(BaseClasses.AfterPass):
                 if config_in_composite:
                     passdown_condition.append(condition_comp)
 
-                if os.path.isdir(fullpath):
+                if Tools.dircache.isdir(fullpath):
                     parser.local_vars["dir_cond_collection"]\
                         [fullpath].add_alternative(passdown_condition[:])
                 else:
@@ -21,6 +21,9 @@ import os
 
 import unittest2 as t
 
+# the tests change the working directory
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
 class Testcase(t.TestCase):
 
     def test_minigolem(self):
@@ -40,6 +43,16 @@ class Testcase(t.TestCase):
                 sys.exit(1)
 #            assert(line == fd.readline())
 
+    def test_parallel(self):
+        # subdirectories are parsed by workers, the output is unchanged
+        p = subprocess.Popen([os.path.join(DIRECTORY, "..", "minigolem"),
+                              "--check", "-j", "2", "--split-depth", "1", "."],
+                             stdout=subprocess.PIPE, cwd=DIRECTORY)
+        (output, _) = p.communicate()
+        self.assertEqual(p.returncode, 0)
+        with open(os.path.join(DIRECTORY, "preconditions.ref")) as fd:
+            self.assertEqual(output, fd.read())
+
 if __name__ == "__main__":
     t.main()
 
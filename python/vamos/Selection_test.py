@@ -14,8 +14,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest as t
+import copy
+import pickle
 
-from vamos.selection import Selection
+from vamos.selection import Selection, SelectionIndex, unique
 
 
 class testSelection(t.TestCase):
@@ -76,13 +78,24 @@ class testSelection(t.TestCase):
         self.assertTrue(self.two_item.feature_in_selection("CONFIG_ACPI"))
         self.assertTrue(self.two_item_module.feature_in_selection("CONFIG_ACPI"))
 
-    def test_alternatives(self):
-        newitem = Selection(self.one_item)
-        newitem.add_alternative("CONFIG_NUMA", "y")
-        self.assertEqual(str(newitem), "(CONFIG_NUMA=y || CONFIG_PM=y)")
-        newitem.push_down()
-        newitem.add_alternative("CONFIG_ACPI", "y")
-        self.assertEqual(str(newitem), "(CONFIG_NUMA=y || CONFIG_PM=y) && CONFIG_ACPI=y")
+    def test_extend(self):
+        newitem = self.one_item.extend([("CONFIG_NUMA", "y"), ("CONFIG_SMP", "y")])
+        self.assertEqual(str(newitem), "(CONFIG_NUMA=y || CONFIG_SMP=y) && CONFIG_PM=y")
+        newitem = newitem.extend([("CONFIG_ACPI", "y")], [("CONFIG_PM", "y")])
+        self.assertEqual(str(newitem),
+                         "(CONFIG_NUMA=y || CONFIG_SMP=y) && CONFIG_ACPI=y && CONFIG_PM=y")
+        # selections are immutable
+        self.assertEqual(str(self.one_item), "CONFIG_PM=y")
+        with self.assertRaises(AttributeError):
+            self.one_item.expr = frozenset()
+
+    def test_hash(self):
+        a = Selection([[("CONFIG_PM", "y")], [("CONFIG_SOUND", "y"), ("CONFIG_ACPI", "y")]])
+        self.assertEqual(a, self.alternative)
+        self.assertEqual(hash(a), hash(self.alternative))
+        self.assertEqual(len(set([a, self.alternative, self.one_item])), 2)
+        self.assertEqual(pickle.loads(pickle.dumps(a)), a)
+        self.assertEqual(copy.deepcopy(a), a)
 
     def test_selection_invariance(self):
         a = Selection([[("CONFIG_BARFOO", "y")]])
@@ -90,6 +103,45 @@ class testSelection(t.TestCase):
 
         self.assertEqual(self.two_item_module.symbols, set(["CONFIG_PM", "CONFIG_ACPI"]))
 
+    def test_unique(self):
+        self.assertEqual(unique([self.two_item, self.one_item, Selection(self.two_item)]),
+                         [self.two_item, self.one_item])
+
+
+class testSelectionIndex(t.TestCase):
+    def setUp(self):
+        self.pm = Selection([[("CONFIG_PM", "y")]])
+        self.pm_acpi = Selection([[("CONFIG_PM", "y")], [("CONFIG_ACPI", "y")]])
+        self.pm_acpi_m = Selection([[("CONFIG_PM", "y")], [("CONFIG_ACPI", "m")]])
+        self.x86_sound = Selection([[("CONFIG_X86", "y")], [("CONFIG_SOUND", "y")]])
+        self.all = [self.pm, self.pm_acpi, self.pm_acpi_m, self.x86_sound]
+
+    def test_worse_than(self):
+        index = SelectionIndex(self.all)
+        for a in self.all + [Selection()]:
+            self.assertEqual(index.worse_than(a),
+                             set([b for b in self.all if a.better_than(b)]))
+
+    def test_has_better(self):
+        index = SelectionIndex([self.pm, self.x86_sound])
+        self.assertTrue(index.has_better(self.pm_acpi))
+        self.assertFalse(index.has_better(self.pm))
+        self.assertFalse(index.has_better(Selection([[("CONFIG_X86", "y")]])))
+        index.remove(self.pm)
+        self.assertFalse(index.has_better(self.pm_acpi))
+        index.add(Selection())
+        self.assertTrue(index.has_better(self.pm))
+        self.assertFalse(index.has_better(Selection()))
+
+    def test_mergeable(self):
+        index = SelectionIndex(self.all)
+        self.assertEqual(index.mergeable(self.pm_acpi), set([self.pm_acpi_m]))
+        self.assertEqual(index.mergeable(self.x86_sound), set())
+        self.assertEqual(index.mergeable(self.pm), set())
+        index.remove(self.pm_acpi_m)
+        self.assertEqual(index.mergeable(self.pm_acpi), set())
+        self.assertEqual(len(index), 3)
+
 
 if __name__ == '__main__':
     t.main()
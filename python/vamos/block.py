@@ -105,6 +105,7 @@ class Block(object):
                                         failok=False)
         except tools.CommandFailed:
             return blocks
+        conditional = []
         for out in output:
             block = Block(path)
             split = out.split(":")
@@ -112,15 +113,20 @@ class Block(object):
             block.range = (int(split[2]), int(split[3]))
             block.new_range = block.range
             if block.range[0] != 0:
-                (precond, _) = tools.execute("undertaker -j blockpc %s:%i:1" %
-                                             (path, block.range[0]+1))
-                block.precondition = precond
-                for pre in precond:
-                    block.ref_items.update(tools.get_kconfig_items(pre))
+                conditional.append(block)
             # Add the file variable to the list of referenced items in order to
             #  make it visible to block.get_transitive_items()
             block.ref_items.add("FILE_" + kbuild.normalize_filename(block.srcfile))
             blocks[block.bid] = block
+
+        # The preconditions of all blocks are independent of each other
+        preconds = tools.execute_parallel(["undertaker -j blockpc %s:%i:1" %
+                                           (path, block.range[0]+1)
+                                           for block in conditional])
+        for (block, (precond, _)) in zip(conditional, preconds):
+            block.precondition = precond
+            for pre in precond:
+                block.ref_items.update(tools.get_kconfig_items(pre))
         return blocks
 
     @staticmethod
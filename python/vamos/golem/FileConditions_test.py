@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+#   golem - analyzes feature dependencies in Linux makefiles
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest2 as t
+import os
+
+from vamos.golem.file_conditions import FileConditions
+
+
+class testFileConditions(t.TestCase):
+    def setUp(self):
+        ref = os.path.join(os.path.dirname(__file__), "..", "..",
+                           "validation-minigolem", "preconditions.ref")
+        self.fc = FileConditions.from_file(ref)
+
+    def test_parse(self):
+        self.assertEqual(self.fc.conditions["FILE_a.c"], "")
+        self.assertEqual(self.fc.conditions["FILE_c.c"], "CONFIG_XY")
+        self.assertEqual(self.fc.file_variable("./subdir/s1.c"), "FILE_subdir_s1.c")
+
+    def test_enabled_symbols(self):
+        config = {"CONFIG_XY": "y", "CONFIG_Z": "m", "CONFIG_FOO": "n",
+                  "CONFIG_NAME": '"foo"'}
+        self.assertEqual(FileConditions.enabled_symbols(config),
+                         set(["CONFIG_XY", "CONFIG_Z_MODULE", "CONFIG_NAME"]))
+
+    def test_compiled_files(self):
+        files = self.fc.compiled_files({"CONFIG_XY": "y"})
+        self.assertEqual(files, set(["FILE_a.c", "FILE_b.c", "FILE_c.c",
+                                     "FILE_e.c", "FILE_g.c", "FILE_m.c"]))
+
+        files = self.fc.compiled_files({"CONFIG_DE": "y", "CONFIG_Z": "m"})
+        self.assertIn("FILE_subdir_s2.c", files)
+        self.assertIn("FILE_z.c", files)
+        self.assertIn("FILE_x.c", files)
+        self.assertNotIn("FILE_subdir_s1.c", files)
+        self.assertNotIn("FILE_y.c", files)
+
+        self.assertTrue(self.fc.is_compiled("subdir/s3.c", {"CONFIG_DE": "y"}))
+        self.assertFalse(self.fc.is_compiled("i.c", {"CONFIG_DE": "y"}))
+        self.assertEqual(self.fc.is_compiled("unknown.c", {}), None)
+
+    def test_file_status(self):
+        status = self.fc.file_status(["i.c", "subdir/s2.c", "c.c", "unknown.c"],
+                                     {"CONFIG_DE": "y", "CONFIG_Z": "m",
+                                      "CONFIG_ABC": "y"})
+        self.assertEqual(status, {"i.c": "y", "subdir/s2.c": "m",
+                                  "c.c": "n", "unknown.c": "n"})
+
+    def test_translate(self):
+        self.assertEqual(self.fc.translate(""), "True")
+        with self.assertRaises(ValueError):
+            self.fc.translate("CONFIG_A & CONFIG_B")
+
+
+if __name__ == '__main__':
+    t.main()
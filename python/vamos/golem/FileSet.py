@@ -19,21 +19,63 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import cPickle
+import hashlib
 import logging
+import os
+import threading
 
-class FileSet:
-    """ A FileSet is a list of files and directories, compiled by a given selection. """
+import vamos.golem
+from vamos.golem.tree_state import tree_revision
 
-    def __init__(self, atoms, selection):
+class FileSet(object):
+    """ A FileSet is a list of files and directories, compiled by a given selection.
+
+    If a @baseline FileSet (usually the one of the empty selection) is
+    given, only the differences to it are kept, which are much smaller
+    than the complete lists. """
+
+    def __init__(self, atoms, selection, result=None, baseline=None):
+        """ @result may be a (var_impl, pov) tuple from a previous run """
         self.selection = selection
         self.atoms = atoms
-        try:
-            (self.var_impl, self.pov) = self.atoms.OP_list(selection)
-        except RuntimeError as e:
-            logging.error("Failed to determine fileset, continuing anyways: %s", e)
-            self.var_impl = set()
-            self.pov = set()
-            return
+        self.valid = True
+        self.baseline = None
+        if not result:
+            try:
+                result = self.atoms.OP_list(selection)
+            except RuntimeError as e:
+                logging.error("Failed to determine fileset, continuing anyways: %s", e)
+                result = (set(), set())
+                self.valid = False
+        (var_impl, pov) = result
+        if baseline is not None and baseline.valid and self.valid:
+            self.baseline = baseline
+            # (added, deleted) compared to the baseline
+            self.var_impl_delta = (var_impl - baseline.var_impl, baseline.var_impl - var_impl)
+            self.pov_delta = (pov - baseline.pov, baseline.pov - pov)
+        else:
+            self.var_impl_delta = (set(var_impl), set())
+            self.pov_delta = (set(pov), set())
+
+    @staticmethod
+    def expand(delta, base):
+        (added, deleted) = delta
+        if not deleted:
+            return base | added
+        return (base - deleted) | added
+
+    @property
+    def var_impl(self):
+        if self.baseline is None:
+            return self.var_impl_delta[0]
+        return self.expand(self.var_impl_delta, self.baseline.var_impl)
+
+    @property
+    def pov(self):
+        if self.baseline is None:
+            return self.pov_delta[0]
+        return self.expand(self.pov_delta, self.baseline.pov)
 
     def compare_to_base(self, other):
         """ Compare the filesets to a other selection.
@@ -41,6 +83,18 @@ class FileSet:
         @return ((f_added, f_deleted), (d_added, d_deleted))
         """
 
+        if self.baseline is not None and self.baseline is other:
+            return (self.var_impl_delta, self.pov_delta)
+
+        if self.baseline is not None and self.baseline is other.baseline:
+            # only the differences to the common baseline need to be compared
+            def compare(delta, other_delta):
+                ((added, deleted), (other_added, other_deleted)) = (delta, other_delta)
+                return ((added - other_added) | (other_deleted - deleted),
+                        (other_added - added) | (deleted - other_deleted))
+            return (compare(self.var_impl_delta, other.var_impl_delta),
+                    compare(self.pov_delta, other.pov_delta))
+
         var_impl_added = self.var_impl - other.var_impl
         var_impl_deleted = other.var_impl - self.var_impl
         pov_added = self.pov - other.pov
@@ -49,16 +103,181 @@ class FileSet:
         return ((var_impl_added, var_impl_deleted), (pov_added, pov_deleted))
 
 
+class FileSetStore(object):
+    """
+    Keeps the results of OP_list on disk, so that repeated or interrupted
+    inference runs on the same tree reuse them
+
+    The results are appended to a journal file as soon as they are known.
+    When the store is opened or closed, the journal is rewritten if it
+    holds more than @max_entries results (the least recently used ones
+    are evicted) or many duplicates.
+    """
+
+    def __init__(self, path, max_entries=None):
+        if max_entries is None:
+            max_entries = vamos.golem.fileset_cache_size
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # normalized selection -> (var_impl, pov)
+        self.entries = {}
+        # normalized selection -> time of last use, for eviction
+        self.used = {}
+        self.clock = 0
+        self.records = 0
+        self.evicted = 0
+        self.fd = None
+
+        self.load()
+        if self.records > 2 * len(self.entries) or len(self.entries) > self.max_entries:
+            self.compact()
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.fd = open(self.path, "ab")
+
+    def load(self):
+        try:
+            fd = open(self.path, "rb")
+        except IOError:
+            return
+        with fd:
+            end = 0
+            while True:
+                try:
+                    (key, var_impl, pov) = cPickle.load(fd)
+                except EOFError:
+                    break
+                except (ValueError, TypeError, cPickle.UnpicklingError) as e:
+                    logging.warning("Ignoring broken fileset cache record in %s: %s",
+                                    self.path, e)
+                    break
+                end = fd.tell()
+                self.entries[key] = (var_impl, pov)
+                self.touch(key)
+                self.records += 1
+        # the last record of an interrupted run may be truncated, drop it
+        # so that new records are appended to a readable journal
+        if os.path.getsize(self.path) > end:
+            with open(self.path, "r+b") as fd:
+                fd.truncate(end)
+        logging.info("Loaded %d cached filesets from %s", len(self.entries), self.path)
+
+    def touch(self, key):
+        self.clock += 1
+        self.used[key] = self.clock
+
+    def get(self, key):
+        """ returns the (var_impl, pov) tuple for @key, or None """
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.touch(key)
+            return result
+
+    def put(self, key, var_impl, pov):
+        with self.lock:
+            self.entries[key] = (var_impl, pov)
+            self.touch(key)
+            if self.fd:
+                cPickle.dump((key, var_impl, pov), self.fd, cPickle.HIGHEST_PROTOCOL)
+                self.fd.flush()
+                self.records += 1
+
+    def compact(self):
+        """ rewrites the journal, keeps the @max_entries most recently used
+        results in order of their last use """
+        keys = sorted(self.entries, key=lambda k: self.used[k])
+        if len(keys) > self.max_entries:
+            evict = keys[:len(keys) - self.max_entries]
+            keys = keys[len(evict):]
+            for key in evict:
+                del self.entries[key]
+                del self.used[key]
+            self.evicted += len(evict)
+        tmp = "%s.%d" % (self.path, os.getpid())
+        with open(tmp, "wb") as fd:
+            for key in keys:
+                (var_impl, pov) = self.entries[key]
+                cPickle.dump((key, var_impl, pov), fd, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+        self.records = len(keys)
+
+    def close(self):
+        with self.lock:
+            if not self.fd:
+                return
+            self.fd.close()
+            self.fd = None
+            if len(self.entries) > self.max_entries:
+                self.compact()
+
+
+def open_fileset_store(atoms):
+    """ returns the FileSetStore for @atoms and the current tree and
+    revision in vamos.golem.cache_dir, or None if @atoms cannot be cached """
+    namespace = atoms.cache_namespace()
+    if not vamos.golem.cache_dir or namespace is None:
+        return None
+    h = hashlib.sha1()
+    for part in (os.getcwd(), tree_revision()) + tuple(namespace):
+        h.update(str(part) + "\0")
+    path = os.path.join(vamos.golem.cache_dir, "filesets",
+                        "%s.journal" % h.hexdigest())
+    return FileSetStore(path)
+
+
 class FileSetCache(dict):
-    def __init__(self, atoms):
+    def __init__(self, atoms, store=None):
         dict.__init__(self)
         self.atoms = atoms
+        self.store = store
+        # the fileset of the empty selection, others are kept as
+        # differences to it
+        self.baseline = None
+        self.hits = 0
+        self.stored_hits = 0
+        self.misses = 0
 
     def get_fileset(self, selection):
         if not selection in self:
-            self[selection] = [FileSet(self.atoms, selection), 1]
+            key = str(selection)
+            result = self.store.get(key) if self.store else None
+            if result is not None:
+                self.stored_hits += 1
+            else:
+                self.misses += 1
+            if len(selection) == 0:
+                fileset = FileSet(self.atoms, selection, result)
+                self.baseline = fileset
+            else:
+                fileset = FileSet(self.atoms, selection, result, self.baseline)
+            if result is None and self.store and fileset.valid:
+                self.store.put(key, fileset.var_impl, fileset.pov)
+            self[selection] = [fileset, 1]
         else:
             # hit
             # logging.info("HIT " + str(sys.getsizeof(self)) + " " + str(len(self)))
+            self.hits += 1
             self[selection][1] += 1
         return self[selection][0]
+
+    def known(self, selection):
+        """ tests if the fileset of @selection is cached in memory or in
+        the store, i.e., does not need a call of OP_list """
+        if selection in self:
+            return True
+        return bool(self.store) and self.store.get(str(selection)) is not None
+
+    def log_statistics(self):
+        total = self.hits + self.stored_hits + self.misses
+        logging.info("Fileset cache: %d lookups, %d hits, %d hits from previous runs, "
+                     "%d computed", total, self.hits, self.stored_hits, self.misses)
+        if self.store:
+            logging.info("Fileset cache: %d results stored in %s, %d evicted",
+                         len(self.store.entries), self.store.path, self.store.evicted)
+
+    def close(self):
+        if self.store:
+            self.store.close()
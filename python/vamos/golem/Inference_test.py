@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+#
+#   golem - analyzes feature dependencies in Linux makefiles
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest2 as t
+import StringIO
+import os
+import random
+import shutil
+import signal
+import sys
+import tempfile
+
+from vamos.golem.FileSet import FileSetCache, FileSetStore
+from vamos.golem.inference import Inferencer, cleanup_selections
+from vamos.selection import Selection, unique
+from vamos.golem.inference_atoms import InferenceAtoms
+
+
+class FakeAtoms(InferenceAtoms):
+    """ base.o is always compiled, a.o with A, the directory 'sub' with A,
+    and sub/b.o with A and B """
+
+    def __init__(self):
+        InferenceAtoms.__init__(self)
+        self.calls = 0
+
+    def OP_list(self, selection):
+        self.calls += 1
+        values = selection.to_dict()
+        var_impl = set(["base.o"])
+        pov = set(["."])
+        if values.get("A") == "y":
+            var_impl.add("a.o")
+            pov.add("sub")
+            if values.get("B") == "y":
+                var_impl.add("sub/b.o")
+        return (var_impl, pov)
+
+    def OP_features_in_pov(self, point_of_variability):
+        if point_of_variability == ".":
+            return [["A"]]
+        return [["B"]]
+
+    def OP_domain_of_variability_intention(self, var_int):
+        return set(["n", "y"])
+
+
+class FailingAtoms(FakeAtoms):
+    def OP_list(self, selection):
+        if selection.to_dict().get("A") == "y":
+            raise KeyError("broken")
+        return FakeAtoms.OP_list(self, selection)
+
+
+class TerminatedAtoms(FakeAtoms):
+    """ the process receives SIGTERM while B is tested """
+
+    def OP_list(self, selection):
+        if selection.to_dict().get("B") == "y":
+            os.kill(os.getpid(), signal.SIGTERM)
+        return FakeAtoms.OP_list(self, selection)
+
+
+class BoardAtoms(FakeAtoms):
+    """ like coreboot, varies BOARD together with each other symbol """
+
+    def OP_features_in_pov(self, point_of_variability):
+        return [["BOARD", "A"], ["A"], ["C"]]
+
+    def OP_domain_of_variability_intention(self, var_int):
+        if var_int == "BOARD":
+            return set(["n", "x", "y", "z"])
+        return FakeAtoms.OP_domain_of_variability_intention(self, var_int)
+
+
+class SharedAtoms(FakeAtoms):
+    """ A enables the directories 'x' and 'y', y/c.o needs C (found in 'y')
+    or D (found in 'x') """
+
+    def OP_list(self, selection):
+        self.calls += 1
+        values = selection.to_dict()
+        var_impl = set(["base.o"])
+        pov = set(["."])
+        if values.get("A") == "y":
+            pov.update(["x", "y"])
+            if values.get("C") == "y" or values.get("D") == "y":
+                var_impl.add("y/c.o")
+        return (var_impl, pov)
+
+    def OP_features_in_pov(self, point_of_variability):
+        return {".": [["A"]], "x": [["D"]], "y": [["C"]]}[point_of_variability]
+
+
+class testInferencer(t.TestCase):
+    def setUp(self):
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def test_calculate(self):
+        inferencer = Inferencer(FakeAtoms(), workers=4)
+        inferencer.calculate()
+        selections = inferencer.var_impl_selections
+        self.assertEqual(selections["base.o"], [])
+        self.assertEqual([str(x) for x in selections["a.o"]], ["A=y"])
+        self.assertEqual([str(x) for x in selections["sub/b.o"]], ["A=y && B=y"])
+        self.assertEqual(inferencer.pending, 0)
+        self.assertIn('sub/b.o "A=y && B=y"', sys.stdout.getvalue())
+
+    def test_generate_variations(self):
+        inferencer = Inferencer(BoardAtoms(), workers=1)
+        variations = inferencer.generate_variations(Selection(), ".")
+        self.assertEqual(next(variations), [("BOARD", "x"), ("A", "y")])
+        self.assertEqual(list(variations), [[("BOARD", "y"), ("A", "y")],
+                                            [("BOARD", "z"), ("A", "y")],
+                                            [("A", "y")], [("C", "y")]])
+
+        # compatible symbols of the base selection are left out,
+        # variations that contradict it are skipped
+        base = Selection([[("A", "y")], [("BOARD", "y")]])
+        self.assertEqual(list(inferencer.generate_variations(base, ".")),
+                         [[], [("C", "y")]])
+
+        inferencer = Inferencer(BoardAtoms(), workers=1, order="smallest")
+        self.assertEqual(list(inferencer.generate_variations(Selection(), "."))[:2],
+                         [[("A", "y")], [("C", "y")]])
+
+    def test_max_variations(self):
+        atoms = BoardAtoms()
+        inferencer = Inferencer(atoms, workers=2, max_variations=2)
+        inferencer.calculate()
+        # the base selection, two variations of '.', which both enable
+        # 'sub', and for each of them only C=y is a new selection in 'sub'
+        self.assertEqual(atoms.calls, 1 + 2 + 2)
+        self.assertEqual(len(inferencer.visited_povs["sub"]), 2)
+
+    def test_make_budget(self):
+        atoms = BoardAtoms()
+        inferencer = Inferencer(atoms, workers=2, make_budget=3)
+        inferencer.calculate()
+        self.assertEqual(atoms.calls, 3)
+        self.assertTrue(inferencer.exhausted)
+        # the partial results are printed
+        self.assertIn('a.o "(BOARD=x || BOARD=y) && A=y"', sys.stdout.getvalue())
+
+    def test_time_budget(self):
+        atoms = BoardAtoms()
+        inferencer = Inferencer(atoms, workers=2, time_budget=0)
+        inferencer.calculate()
+        self.assertEqual(atoms.calls, 1)
+        self.assertEqual(sys.stdout.getvalue().split("\n"), ["base.o", ""])
+
+    def test_checkpoint(self):
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, "checkpoint")
+        try:
+            inferencer = Inferencer(BoardAtoms(), workers=2, make_budget=3, checkpoint=path)
+            inferencer.calculate()
+            self.assertTrue(os.path.exists(path))
+            self.assertNotIn('a.o "A=y"', sys.stdout.getvalue())
+
+            sys.stdout = StringIO.StringIO()
+            atoms = BoardAtoms()
+            inferencer = Inferencer(atoms, workers=2, checkpoint=path)
+            inferencer.resume()
+            inferencer.calculate()
+            # finished, so the checkpoint is removed
+            self.assertFalse(os.path.exists(path))
+            resumed = sys.stdout.getvalue().splitlines()
+
+            sys.stdout = StringIO.StringIO()
+            Inferencer(BoardAtoms(), workers=2).calculate()
+            self.assertEqual(sorted(resumed), sorted(sys.stdout.getvalue().splitlines()))
+            self.assertIn('a.o "A=y"', resumed)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_sigterm(self):
+        def interrupt(signum, frame):
+            # pylint: disable=W0613
+            raise KeyboardInterrupt()
+
+        def killed():
+            raise SystemExit("killed")
+
+        handler = signal.signal(signal.SIGTERM, interrupt)
+        try:
+            inferencer = Inferencer(TerminatedAtoms(), workers=1)
+            # the process is killed while the checkpoint is written
+            inferencer.checkpoint = killed
+            with self.assertRaises(SystemExit):
+                inferencer.calculate()
+        finally:
+            signal.signal(signal.SIGTERM, handler)
+        self.assertEqual(sorted(sys.stdout.getvalue().splitlines()),
+                         ['a.o "A=y"', "base.o"])
+
+    def test_priority(self):
+        with self.assertRaises(ValueError):
+            Inferencer(FakeAtoms(), priority="random")
+        inferencer = Inferencer(FakeAtoms(), workers=2, priority="uncovered")
+        inferencer.calculate()
+        # each result is printed once
+        lines = sys.stdout.getvalue().splitlines()
+        self.assertEqual(sorted(lines), ['a.o "A=y"', 'base.o', 'sub/b.o "A=y && B=y"'])
+
+    def test_shared_symbol(self):
+        # a POV in another directory adds to y/c.o, which is printed once
+        # when the inference has finished
+        for workers in (1, 2):
+            sys.stdout = StringIO.StringIO()
+            Inferencer(SharedAtoms(), workers=workers).calculate()
+            lines = sys.stdout.getvalue().splitlines()
+            self.assertEqual([x for x in lines if x.startswith("y/c.o")],
+                             ['y/c.o "(C=y || D=y) && A=y"'])
+
+    def test_cleanup(self):
+        inferencer = Inferencer(FakeAtoms(), workers=1)
+        a = Selection([[("A", "y")]])
+        ab = Selection([[("A", "y")], [("B", "y")]])
+        c = Selection([[("C", "y")]])
+        cd = Selection([[("C", "y")], [("D", "y")]])
+        cd_m = Selection([[("C", "y")], [("D", "m")]])
+        self.assertEqual(inferencer.cleanup([ab, a, Selection(), a]), [a])
+        self.assertEqual([str(x) for x in inferencer.cleanup([cd, ab, cd_m])],
+                         ["(D=m || D=y) && C=y", "A=y && B=y"])
+        self.assertEqual(inferencer.cleanup([cd, c, cd_m]), [c])
+        self.assertGreater(inferencer.comparisons, 0)
+
+    @staticmethod
+    def pairwise_cleanup(selection):
+        """ the cleanup of golem before the subsumption index """
+        selection = [x for x in unique(selection) if x]
+        for i in range(0, len(selection)):
+            for x in range(0, len(selection)):
+                if x != i and selection[i] and selection[x] \
+                        and selection[i].better_than(selection[x]):
+                    selection[x] = None
+
+        again = True
+        while again:
+            again = False
+            for i in range(0, len(selection)):
+                for x in range(0, len(selection)):
+                    if x != i and selection[i] and selection[x]:
+                        m = selection[i].merge(selection[x])
+                        if m:
+                            again = True
+                            selection[i] = m
+                            selection[x] = None
+        return [x for x in selection if x]
+
+    def test_cleanup_order(self):
+        ab = Selection([[("A", "y")], [("B", "y")]])
+        ac = Selection([[("A", "y")], [("C", "y")]])
+        dc = Selection([[("D", "y")], [("C", "y")]])
+        self.assertEqual([str(x) for x in cleanup_selections([ab, ac, dc])[0]],
+                         ["(B=y || C=y) && A=y", "C=y && D=y"])
+
+        # overlapping merges give the same result as comparing all pairs
+        rand = random.Random(42)
+        symbols = [(s, v) for s in "ABCD" for v in "ym"]
+        for _ in range(300):
+            selections = []
+            for _ in range(rand.randint(1, 8)):
+                selections.append(Selection([[rand.choice(symbols)]
+                                             for _ in range(rand.randint(1, 3))]))
+            self.assertEqual(cleanup_selections(selections)[0],
+                             self.pairwise_cleanup(list(selections)))
+
+    def test_baseline_delta(self):
+        cache = FileSetCache(FakeAtoms())
+        baseline = cache.get_fileset(Selection())
+        a = cache.get_fileset(Selection([[("A", "y")]]))
+        ab = cache.get_fileset(Selection([[("A", "y")], [("B", "y")]]))
+        # only the differences to the empty selection are kept
+        self.assertIs(a.baseline, baseline)
+        self.assertEqual(ab.var_impl_delta, (set(["a.o", "sub/b.o"]), set()))
+        self.assertEqual(ab.var_impl, set(["base.o", "a.o", "sub/b.o"]))
+        self.assertEqual(ab.compare_to_base(a), ((set(["sub/b.o"]), set()), (set(), set())))
+        self.assertEqual(a.compare_to_base(ab), ((set(), set(["sub/b.o"])), (set(), set())))
+        self.assertEqual(a.compare_to_base(baseline),
+                         ((set(["a.o"]), set()), (set(["sub"]), set())))
+
+    def test_worker_exception(self):
+        inferencer = Inferencer(FailingAtoms(), workers=2)
+        with self.assertRaises(KeyError):
+            inferencer.calculate()
+
+
+class testFileSetStore(t.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "filesets", "test.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_reuse(self):
+        atoms = FakeAtoms()
+        selection = Selection([[("A", "y")]])
+        cache = FileSetCache(atoms, FileSetStore(self.path))
+        cache.get_fileset(selection)
+        cache.get_fileset(selection)
+        cache.close()
+        self.assertEqual((cache.hits, cache.stored_hits, cache.misses), (1, 0, 1))
+
+        # a new run reads the result from disk instead of calling OP_list
+        cache = FileSetCache(atoms, FileSetStore(self.path))
+        fileset = cache.get_fileset(Selection([[("A", "y")]]))
+        cache.close()
+        self.assertEqual(atoms.calls, 1)
+        self.assertEqual(cache.stored_hits, 1)
+        self.assertEqual(fileset.var_impl, set(["base.o", "a.o"]))
+        self.assertEqual(fileset.pov, set([".", "sub"]))
+
+    def test_truncated_journal(self):
+        store = FileSetStore(self.path)
+        store.put("A=y", set(["a.o"]), set())
+        store.put("B=y", set(["b.o"]), set())
+        store.close()
+        with open(self.path, "r+b") as fd:
+            fd.truncate(os.path.getsize(self.path) - 3)
+
+        store = FileSetStore(self.path)
+        self.assertEqual(store.get("A=y"), (set(["a.o"]), set()))
+        self.assertIsNone(store.get("B=y"))
+        store.put("C=y", set(["c.o"]), set())
+        store.close()
+
+        store = FileSetStore(self.path)
+        self.assertEqual(sorted(store.entries), ["A=y", "C=y"])
+        store.close()
+
+    def test_eviction(self):
+        store = FileSetStore(self.path, max_entries=2)
+        store.put("A=y", set(["a.o"]), set())
+        store.put("B=y", set(["b.o"]), set())
+        store.get("A=y")
+        store.put("C=y", set(["c.o"]), set())
+        store.close()
+        self.assertEqual(store.evicted, 1)
+
+        store = FileSetStore(self.path, max_entries=2)
+        self.assertEqual(sorted(store.entries), ["A=y", "C=y"])
+        self.assertEqual(store.records, 2)
+        store.close()
+
+
+if __name__ == '__main__':
+    t.main()
@@ -15,11 +15,26 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest2 as t
+import os
+import json
+import select
+import shutil
+import sys
+import tempfile
 
 import vamos
 
-from vamos.tools import execute, CommandFailed
+from vamos.tools import execute, execute_streaming, execute_parallel, JobRunner
+from vamos.tools import CommandFailed, CommandTimedOut, CommandAccounting
+from vamos.tools import DirectoryCache, ThreadPool
+import vamos.tools
 from vamos.golem.kbuild import *
+from vamos.golem.makefile_scanner import MakefileScanner
+from vamos.golem.make_jobs import MakeJobTuner, Jobserver, inherited_jobserver
+from vamos.golem.tree_state import TreeState, ResultCache, tree_revision
+import vamos.golem.tree_state
+from vamos.golem.coreboot_cache import MakeDatabase
+import vamos.golem
 
 
 class testTools(t.TestCase):
@@ -34,6 +49,287 @@ class testTools(t.TestCase):
         with self.assertRaises(CommandFailed):
             execute("false", failok=False)
 
+    def test_execute_streaming(self):
+        run = execute_streaming(["printf", "a\\nbb\\nccc"], env={'FOO': 'x'})
+        self.assertEqual(list(run), ["a", "bb", "ccc"])
+        self.assertEqual(run.returncode, 0)
+        self.assertEqual(run.output_size, 8)
+        self.assertTrue(run.peak_output_size <= 8)
+        self.assertTrue(run.duration >= 0)
+
+        run = execute_streaming("echo $FOO $LC_ALL; false", env={'FOO': 'x'})
+        self.assertEqual(list(run), ["x C"])
+        self.assertEqual(run.returncode, 1)
+        self.assertNotEqual(os.environ.get('FOO'), 'x')
+
+        with self.assertRaises(CommandFailed):
+            list(execute_streaming(["false"], failok=False))
+
+        with self.assertRaises(CommandTimedOut):
+            list(execute_streaming(["sleep", "10"], timeout=0.2))
+
+    def test_execute_parallel(self):
+        results = execute_parallel(["sleep 0.2; echo a", "echo b", "false"], jobs=2)
+        self.assertEqual(results, [(["a"], 0), (["b"], 0), ([""], 1)])
+
+        with self.assertRaises(CommandFailed):
+            execute_parallel(["true", "false"], failok=False)
+
+        runner = JobRunner(1)
+        jobs = runner.run(["echo a", "true", "echo b"])
+        self.assertEqual([x.output for x in jobs], [["a"], [""], ["b"]])
+        self.assertTrue(all([x.duration >= 0 and not x.cancelled for x in jobs]))
+
+        jobs = runner.run(["false", "echo a"], failok=True)
+        self.assertEqual([x.returncode for x in jobs], [1, 0])
+        self.assertFalse(jobs[1].cancelled)
+
+        # with failok=False, the failed job cancels all remaining jobs
+        with self.assertRaises(CommandFailed):
+            runner.run(["false", "echo a"], failok=False)
+        self.assertTrue(runner.cancelled.is_set())
+
+    def test_accounting(self):
+        self.assertEqual(CommandAccounting.command_class("env LC_ALL=C /usr/bin/make -C foo"),
+                         "make")
+        self.assertEqual(CommandAccounting.command_class(["undertaker", "-j", "blockpc"]),
+                         "undertaker")
+
+        saved = vamos.tools.accounting
+        vamos.tools.accounting = CommandAccounting()
+        try:
+            execute("echo foo")
+            execute("false", failok=True)
+            execute_parallel(["echo a", "echo b"], jobs=2)
+            list(execute_streaming(["echo", "bar"]))
+            accounting = vamos.tools.accounting
+        finally:
+            vamos.tools.accounting = saved
+
+        self.assertEqual(len(accounting.records), 5)
+        self.assertEqual([r['returncode'] for r in accounting.records[:2]], [0, 1])
+        self.assertEqual(accounting.records[0]['output_size'], 4)
+        summary = accounting.summary()
+        # the rows are sorted by wall time, which varies between runs
+        self.assertEqual(set(line.split()[0] for line in summary[1:]),
+                         set(["echo", "false"]))
+
+        (fd, path) = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            accounting.write_trace(path)
+            with open(path) as f:
+                events = json.load(f)['traceEvents']
+        finally:
+            os.unlink(path)
+        self.assertEqual(len(events), 5)
+        self.assertEqual(events[1]['name'], "false")
+        self.assertEqual(events[1]['ph'], "X")
+
+    def test_thread_pool(self):
+        done = []
+        with ThreadPool(3) as pool:
+            futures = [pool.submit(lambda x: x * 2, i) for i in range(10)]
+            for future in futures:
+                future.add_done_callback(done.append)
+            failed = pool.submit(int, "no number")
+        self.assertEqual([f.result() for f in futures], range(0, 20, 2))
+        self.assertEqual(len(done), 10)
+        self.assertIsInstance(failed.exception(), ValueError)
+        with self.assertRaises(ValueError):
+            failed.result()
+
+        # callbacks of completed futures are called immediately
+        failed.add_done_callback(done.append)
+        self.assertIs(done[-1], failed)
+
+    def test_directory_cache(self):
+        tree = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(tree, "drivers", "net"))
+            open(os.path.join(tree, "drivers", "foo.c"), "w").close()
+
+            cache = DirectoryCache()
+            self.assertTrue(cache.isdir(os.path.join(tree, "drivers", "net") + "/"))
+            self.assertTrue(cache.isfile(os.path.join(tree, "drivers", "foo.c")))
+            self.assertFalse(cache.isdir(os.path.join(tree, "drivers", "foo.c")))
+            self.assertFalse(cache.exists(os.path.join(tree, "drivers", "bar.c")))
+            self.assertFalse(cache.isfile(os.path.join(tree, "missing", "bar.c")))
+            self.assertTrue(cache.hits > 0)
+            # files and directories are answered from the listing of
+            # their parent directory
+            self.assertEqual(sorted(cache.listings),
+                             [os.path.join(tree, "drivers"), os.path.join(tree, "missing")])
+            # only the entries asked for their kind are stat'ed
+            self.assertEqual(sorted(cache.kinds),
+                             [os.path.join(tree, "drivers", "foo.c"),
+                              os.path.join(tree, "drivers", "net")])
+            self.assertEqual(cache.listdir(os.path.join(tree, "drivers")),
+                             frozenset(["foo.c", "net"]))
+
+            # new files are only visible after invalidating the directory
+            open(os.path.join(tree, "drivers", "bar.c"), "w").close()
+            self.assertFalse(cache.exists(os.path.join(tree, "drivers", "bar.c")))
+            cache.invalidate(tree)
+            self.assertTrue(cache.exists(os.path.join(tree, "drivers", "bar.c")))
+        finally:
+            shutil.rmtree(tree)
+
+    def test_makefile_scanner(self):
+        tree = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        saved = vamos.golem.cache_dir
+        vamos.golem.cache_dir = os.path.join(tree, "cache")
+        try:
+            os.chdir(tree)
+            for (path, content) in (("Makefile", "obj-$(CONFIG_A) += a.o\n"),
+                                    ("drivers/Kbuild", "obj-$(CONFIG_B) += b/\n"),
+                                    ("arch/x86/Makefile", "obj-$(CONFIG_X86_FOO) += foo.o\n"),
+                                    ("arch/arm/Makefile", "obj-$(CONFIG_ARM_FOO) += foo.o\n"),
+                                    ("arch/x86/kernel/Makefile", "obj-$(CONFIG_X86_K) += k.o\n"),
+                                    ("arch/arm/kernel/Makefile", "obj-$(CONFIG_ARM_K) += k.o\n"),
+                                    ("drivers/b/Makefile", "foo_CFLAGS += -DCONFIG=foo.h\n")):
+                if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, "w") as fd:
+                    fd.write(content)
+
+            self.assertEqual(determine_buildsystem_variables(),
+                             set(["A", "B", "X86_FOO", "ARM_FOO", "X86_K", "ARM_K"]))
+            # subdirectories of the architecture are scanned, too
+            self.assertEqual(determine_buildsystem_variables("x86"),
+                             set(["A", "B", "X86_FOO", "X86_K"]))
+            self.assertEqual(determine_buildsystem_variables_in_directory("drivers"),
+                             set(["CONFIG_B"]))
+
+            # a fresh scanner reads the persistent cache
+            scanner = MakefileScanner(tree)
+            self.assertEqual(len(scanner.files), 7)
+            self.assertEqual(scanner.variables(["drivers/Kbuild"]), set(["B"]))
+            self.assertFalse(scanner.dirty)
+
+            # modified files are rescanned
+            with open("drivers/Kbuild", "w") as fd:
+                fd.write("obj-$(CONFIG_C) += c.o\n")
+            self.assertEqual(scanner.variables(["drivers/Kbuild"]), set(["C"]))
+            self.assertTrue(scanner.dirty)
+        finally:
+            os.chdir(cwd)
+            vamos.golem.cache_dir = saved
+            shutil.rmtree(tree)
+
+    def test_tree_state(self):
+        tree = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        saved = vamos.golem.cache_dir
+        vamos.golem.cache_dir = tempfile.mkdtemp()
+        try:
+            os.chdir(tree)
+            os.makedirs("arch/x86")
+            os.makedirs("arch/arm")
+            for f in ("Makefile", "arch/x86/Kconfig", "arch/arm/Kconfig"):
+                open(f, "w").close()
+
+            self.assertTrue(is_linux())
+            self.assertFalse(is_busybox())
+            self.assertEqual(get_architectures(), ["arm", "x86"])
+
+            calls = []
+            state = TreeState(tree)
+            self.assertEqual(state.values["buildsystem"], "linux")
+            self.assertEqual(state.get("buildsystem", lambda: calls.append(1)), "linux")
+            self.assertEqual(calls, [])
+
+            # the state is kept in the cache directory, not in the tree
+            self.assertTrue(state.path.startswith(vamos.golem.cache_dir))
+            self.assertTrue(os.path.exists(state.path))
+            self.assertEqual(sorted(os.listdir(tree)), ["Makefile", "arch"])
+
+            # changing a top-level makefile discards the state
+            os.utime("Makefile", (0, 0))
+            self.assertEqual(TreeState(tree).values, {})
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tree)
+            shutil.rmtree(vamos.golem.cache_dir)
+            vamos.golem.cache_dir = saved
+
+    def test_tree_revision(self):
+        tree = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        saved = dict(vamos.golem.tree_state.revisions)
+        try:
+            os.chdir(tree)
+            os.makedirs("drivers")
+            for f in ("Makefile", "drivers/Makefile", "drivers/a.c"):
+                open(f, "w").close()
+            vamos.golem.tree_state.revisions.clear()
+            revision = tree_revision()
+
+            # the revision is determined per working directory
+            os.chdir("drivers")
+            self.assertNotEqual(tree_revision(), revision)
+            os.chdir(tree)
+            self.assertEqual(tree_revision(), revision)
+
+            # changes of a source file do not matter
+            with open("drivers/a.c", "w") as fd:
+                fd.write("int a;\n")
+            vamos.golem.tree_state.revisions.clear()
+            self.assertEqual(tree_revision(), revision)
+
+            # but those of makefiles in subdirectories do
+            with open("drivers/Makefile", "w") as fd:
+                fd.write("obj-y += a.o\n")
+            vamos.golem.tree_state.revisions.clear()
+            self.assertNotEqual(tree_revision(), revision)
+        finally:
+            vamos.golem.tree_state.revisions.clear()
+            vamos.golem.tree_state.revisions.update(saved)
+            os.chdir(cwd)
+            shutil.rmtree(tree)
+
+    def test_make_database(self):
+        db = MakeDatabase(["# Variables",
+                           "MAKEFILE_LIST := Makefile src/Makefile.inc",
+                           "ramstage-objs := src/a.o src/b.o",
+                           "romstage-objs := src/c.o",
+                           "CC = gcc",
+                           "# Files",
+                           "build/ramstage.elf: src/a.o src/b.o | build",
+                           "\t$(CC) -o $@ $^",
+                           "printall:"])
+        self.assertEqual(db.objects(), set(["src/a.o", "src/b.o", "src/c.o"]))
+        self.assertEqual(db.makefiles(), ["Makefile", "src/Makefile.inc"])
+        self.assertEqual(db.variable("CC"), "gcc")
+        self.assertEqual(db.prerequisites("build/ramstage.elf"),
+                         ["src/a.o", "src/b.o", "build"])
+        self.assertEqual(db.prerequisites("printall"), [])
+        self.assertIn("printall", db.rules)
+
+    def test_result_cache(self):
+        saved = vamos.golem.cache_dir
+        vamos.golem.cache_dir = tempfile.mkdtemp()
+        try:
+            cache = ResultCache("results", size=2)
+            for key in ("a", "b", "c"):
+                cache.put(key, key.upper())
+            # only the most recently used results are kept in memory
+            self.assertEqual(list(cache.results), ["b", "c"])
+            self.assertEqual(cache.get("a"), "A")
+            self.assertEqual(list(cache.results), ["c", "a"])
+            self.assertEqual(cache.get("d"), None)
+
+            # failing to write the cache directory is not fatal
+            blocked = os.path.join(vamos.golem.cache_dir, "results", "b.pickle")
+            cache = ResultCache(os.path.join("results", "b.pickle"))
+            cache.put("e", "E")
+            self.assertEqual(cache.get("e"), "E")
+            self.assertTrue(os.path.isfile(blocked))
+        finally:
+            shutil.rmtree(vamos.golem.cache_dir)
+            vamos.golem.cache_dir = saved
+
     def test_guessfilename(self):
         vamos.prefer_32bit = False
 
@@ -128,5 +424,136 @@ class testTools(t.TestCase):
         for needle in ('make', ' ARCH=h8300', 'SUBARCH=h8300', 'C=2', 'tpu.o'):
             self.assertIn(needle, cmd)
 
+        (cmd, rc) = call_linux_makefile('allnoconfig', outdir='/tmp/O1', dryrun=True)
+        self.assertEqual(rc, 0)
+        for needle in ('make', 'allnoconfig', 'O=/tmp/O1'):
+            self.assertIn(needle, cmd)
+
+    def test_list_outdir(self):
+        tree = tempfile.mkdtemp()
+        outdir = os.path.join(tree, "O")
+        cwd = os.getcwd()
+        saved = (vamos.golem.cache_dir, sys.argv[0])
+        vamos.golem.cache_dir = os.path.join(tree, "cache")
+        # Makefile.list is located relative to the test
+        sys.argv[0] = os.path.abspath(sys.argv[0])
+        try:
+            os.chdir(tree)
+            for (path, content) in (("Makefile",
+                                     "MAKEFLAGS += --no-print-directory\n"
+                                     "export Q := @\n"
+                                     "export srctree := .\n"
+                                     "vmlinux-dirs := kernel drivers\n"
+                                     "silentoldconfig:\n"
+                                     "\tmkdir -p $(O)/include/config\n"
+                                     "\tcp $(O)/.config $(O)/include/config/auto.conf\n"),
+                                    ("scripts/Makefile.lib",
+                                     "subdir-ym := $(addprefix $(obj)/,$(subdir-ym))\n"
+                                     "real-objs-y := $(addprefix $(obj)/,"
+                                     "$(filter-out %/,$(obj-y)))\n"
+                                     "real-objs-m := $(addprefix $(obj)/,"
+                                     "$(filter-out %/,$(obj-m)))\n"),
+                                    ("kernel/Makefile",
+                                     "obj-y += a.o\nobj-$(CONFIG_B) += b.o\n"),
+                                    ("drivers/Makefile", "obj-$(CONFIG_C) += c/\n"),
+                                    ("drivers/c/Makefile", "obj-m += c.o\n"),
+                                    ("O/.config", "CONFIG_B=y\nCONFIG_C=y\n")):
+                if not os.path.isdir(os.path.dirname(path) or "."):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, "w") as fd:
+                    fd.write(content)
+
+            # the source tree itself is not configured
+            self.assertEqual(linux_files_for_current_configuration("x86", how=True,
+                                                                   outdir=outdir),
+                             set(["kernel/a.o y", "kernel/b.o y", "drivers/c/c.o m"]))
+            self.assertEqual(file_in_current_configuration("kernel/b.c", "x86",
+                                                           outdir=outdir), "y")
+            self.assertEqual(file_in_current_configuration("drivers/c/c.c", "x86",
+                                                           outdir=outdir), "m")
+            self.assertEqual(files_in_current_configuration(["kernel/b.c", "./drivers/c/c.c",
+                                                             "kernel/d.c"], "x86",
+                                                            outdir=outdir),
+                             {"kernel/b.c": "y", "drivers/c/c.c": "m", "kernel/d.c": "n"})
+
+            with open("O/.config", "w") as fd:
+                fd.write("CONFIG_C=y\n")
+            self.assertEqual(linux_files_for_current_configuration("x86", how=True,
+                                                                   outdir=outdir),
+                             set(["kernel/a.o y", "drivers/c/c.o m"]))
+            self.assertEqual(file_in_current_configuration("kernel/b.c", "x86",
+                                                           outdir=outdir), "n")
+            self.assertFalse(os.path.exists("include"))
+            self.assertFalse(os.path.exists(".config"))
+        finally:
+            os.chdir(cwd)
+            (vamos.golem.cache_dir, sys.argv[0]) = saved
+            shutil.rmtree(tree)
+
+    def test_make_job_tuner(self):
+        tuner = MakeJobTuner(processors=8)
+        tuner.idle_processors = lambda: 8
+        self.assertEqual(tuner.call_type("list"), "list")
+        self.assertEqual(tuner.call_type("kernel/fork.o"), "object")
+        self.assertEqual(tuner.candidates(), [10, 4, 1])
+
+        # all candidates are tried first, then the fastest one is kept
+        for (njobs, duration) in ((10, 3.0), (4, 1.0), (1, 2.0)):
+            self.assertEqual(tuner.choose("list"), njobs)
+            tuner.record("list", njobs, duration)
+        self.assertEqual(tuner.choose("list"), 4)
+        self.assertEqual(tuner.choose("kernel/fork.o"), 10)
+
+    def test_concurrent_make_job_tuners(self):
+        tuner = MakeJobTuner(processors=8)
+        # the load average includes our own make jobs
+        tuner.load_average = lambda: float(tuner.running)
+        with ThreadPool(16) as pool:
+            futures = [pool.submit(tuner.choose, "list") for _ in range(16)]
+        chosen = [f.result() for f in futures]
+        # the first caller gets the idle processors, all others one job
+        self.assertEqual(sorted(chosen), [1] * 15 + [10])
+        self.assertEqual(tuner.running, 25)
+        for njobs in chosen:
+            tuner.finished(njobs)
+        self.assertEqual(tuner.running, 0)
+        self.assertEqual(tuner.idle_processors(), 8)
+
+    def test_jobserver(self):
+        saved = os.environ.get('MAKEFLAGS')
+        (rfd, wfd) = os.pipe()
+        try:
+            os.environ['MAKEFLAGS'] = "-j --jobserver-fds=%d,%d" % (rfd, wfd)
+            (cmd, _) = call_linux_makefile('allnoconfig', dryrun=True)
+            self.assertNotIn("-j", cmd)
+            (cmd, _) = call_linux_makefile('allnoconfig', dryrun=True, njobs=2)
+            self.assertIn("-j2", cmd)
+
+            # file descriptors that were not inherited are not used
+            os.environ['MAKEFLAGS'] = "-j --jobserver-auth=%d,%d" % (wfd + 100, wfd + 101)
+            self.assertFalse(inherited_jobserver())
+            (cmd, _) = call_linux_makefile('allnoconfig', dryrun=True)
+            self.assertIn("-j", cmd)
+        finally:
+            os.close(rfd)
+            os.close(wfd)
+            if saved is None:
+                del os.environ['MAKEFLAGS']
+            else:
+                os.environ['MAKEFLAGS'] = saved
+
+        jobserver = Jobserver(2)
+        try:
+            self.assertIn("--jobserver-auth=%d,%d" % (jobserver.rfd, jobserver.wfd),
+                          jobserver.makeflags())
+            # the pipe holds a token for each slot, including the implicit
+            # slots of the make processes
+            tokens = [jobserver.acquire(), jobserver.acquire()]
+            self.assertEqual(select.select([jobserver.rfd], [], [], 0)[0], [])
+            jobserver.release(tokens.pop())
+            self.assertEqual(jobserver.acquire(), "+")
+        finally:
+            jobserver.close()
+
 if __name__ == '__main__':
     t.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+#   golem - analyzes feature dependencies in Linux makefiles
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest2 as t
+import os
+import shutil
+import tempfile
+
+import vamos.golem
+import vamos.golem.tree_state
+from vamos.golem import snapshots
+
+
+class testSnapshots(t.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tree = tempfile.mkdtemp()
+        self.saved_dir = vamos.golem.snapshot_dir
+        vamos.golem.snapshot_dir = os.path.join(self.tree, ".snapshots")
+        os.chdir(self.tree)
+        vamos.golem.tree_state.revisions.clear()
+        os.makedirs("include/config")
+        os.makedirs("include/generated")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        vamos.golem.snapshot_dir = self.saved_dir
+        vamos.golem.tree_state.revisions.clear()
+        shutil.rmtree(self.tree)
+
+    def apply(self, config):
+        """ emulates 'make silentoldconfig' """
+        with open(".config", "w") as fd:
+            fd.write(config)
+        with open(snapshots.AUTO_CONF, "w") as fd:
+            fd.write(config)
+        with open("include/generated/autoconf.h", "w") as fd:
+            fd.write("/* %s */" % config)
+
+    def test_snapshot_restore(self):
+        self.apply("CONFIG_A=y\n")
+        key_a = snapshots.snapshot_key("x86", "x86_64")
+        self.assertFalse(snapshots.restore_snapshot(key_a))
+        snapshots.save_snapshot(key_a, "include/generated/autoconf.h")
+
+        self.apply("CONFIG_B=y\n")
+        key_b = snapshots.snapshot_key("x86", "x86_64")
+        self.assertNotEqual(key_a, key_b)
+        self.assertNotEqual(key_a, snapshots.snapshot_key("arm", "arm"))
+
+        self.assertTrue(snapshots.restore_snapshot(key_a))
+        with open("include/generated/autoconf.h") as fd:
+            self.assertEqual(fd.read(), "/* CONFIG_A=y\n */")
+        self.assertEqual(snapshots.read_auto_conf(snapshots.AUTO_CONF),
+                         {"CONFIG_A": "y"})
+        # both symbols changed their value
+        self.assertTrue(os.path.exists("include/config/a.h"))
+        self.assertTrue(os.path.exists("include/config/b.h"))
+
+    def test_tree_revision(self):
+        with open("Kconfig", "w") as fd:
+            fd.write("config A\n")
+        vamos.golem.tree_state.revisions.clear()
+        self.apply("CONFIG_A=y\n")
+        key = snapshots.snapshot_key("x86", "x86_64")
+        snapshots.save_snapshot(key, "include/generated/autoconf.h")
+        self.assertTrue(snapshots.restore_snapshot(snapshots.snapshot_key("x86", "x86_64")))
+
+        # the snapshot was generated from different Kconfig files
+        with open("Kconfig", "w") as fd:
+            fd.write("config A\n\tdefault y\n")
+        vamos.golem.tree_state.revisions.clear()
+        self.assertNotEqual(snapshots.snapshot_key("x86", "x86_64"), key)
+        self.assertFalse(snapshots.restore_snapshot(snapshots.snapshot_key("x86", "x86_64")))
+
+    def test_disabled(self):
+        vamos.golem.snapshot_dir = None
+        self.assertEqual(snapshots.snapshot_path("abcd"), None)
+        self.assertFalse(snapshots.restore_snapshot("abcd"))
+
+
+if __name__ == '__main__':
+    t.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#
+#   golem - analyzes feature dependencies in Linux makefiles
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest2 as t
+import StringIO
+import os
+import shutil
+import sys
+import tempfile
+
+import vamos
+import vamos.golem.tree_state
+from vamos.golem.file_conditions import FileConditions
+from vamos.golem.inference import Inferencer
+from vamos.golem.inference_atoms import LinuxInferenceAtoms, kconfig_expression
+from vamos.golem.static_inference import StaticInference, parse_condition, to_dnf
+from vamos.golem.static_inference import ConditionTooComplex
+
+
+class testStaticInference(t.TestCase):
+    def setUp(self):
+        ref = os.path.join(os.path.dirname(__file__), "..", "..",
+                           "validation-minigolem", "preconditions.ref")
+        self.fc = FileConditions.from_file(ref)
+
+    def test_parse_condition(self):
+        self.assertEqual(parse_condition(""), ("and", []))
+        self.assertEqual(parse_condition("!(A || B_MODULE) && C"),
+                         ("and", [("not", ("or", [("symbol", "A"), ("symbol", "B_MODULE")])),
+                                  ("symbol", "C")]))
+        with self.assertRaises(ValueError):
+            parse_condition("A && (B")
+        with self.assertRaises(ValueError):
+            parse_condition("A B")
+
+    def test_to_dnf(self):
+        self.assertEqual(to_dnf(parse_condition("!(A && B)")),
+                         set([(frozenset(), frozenset(["A"])),
+                              (frozenset(), frozenset(["B"]))]))
+        self.assertEqual(to_dnf(parse_condition("A && !A")), set())
+        with self.assertRaises(ConditionTooComplex):
+            to_dnf(parse_condition("(A || B) && (C || D) && (E || F)"), max_terms=4)
+
+    def test_calculate(self):
+        static = StaticInference(self.fc)
+        static.calculate()
+        results = dict((var, kconfig_expression(x)) for (var, x) in static.selections.items())
+        self.assertEqual(results["FILE_a.c"], "")
+        self.assertEqual(results["FILE_d.c"], "")
+        self.assertEqual(results["FILE_m.c"], "")
+        self.assertEqual(results["FILE_subdir_s1.c"], "CONFIG_DE && CONFIG_XY")
+        self.assertEqual(results["FILE_subdir_s2.c"],
+                         "(CONFIG_Z_MODULE || CONFIG_Z) && CONFIG_DE")
+        self.assertEqual(results["FILE_j.S"],
+                         "(CONFIG_ABC_MODULE || CONFIG_ABC) && CONFIG_XY")
+        self.assertEqual(static.unsatisfiable, set(["FILE_f.c"]))
+        self.assertEqual(static.incomplete, set())
+
+    def test_incomplete(self):
+        self.fc.conditions["FILE_broken.c"] = "CONFIG_A &&"
+        static = StaticInference(self.fc, max_terms=2, directory="./subdir/")
+        static.calculate()
+        # FILE_subdir_s4.S has four terms
+        self.assertEqual(static.incomplete, set(["FILE_subdir_s4.S"]))
+        self.assertEqual(len(static.selections), 5)
+
+        static = StaticInference(self.fc, directory=".")
+        static.calculate()
+        self.assertEqual(static.incomplete, set(["FILE_broken.c"]))
+
+    def test_directory(self):
+        self.fc.conditions["FILE_subdirectory_x.c"] = ""
+        static = StaticInference(self.fc, directory="subdir")
+        static.calculate()
+        self.assertEqual(len(static.selections), 6)
+        self.assertNotIn("FILE_subdirectory_x.c", static.selections)
+
+    def test_tristates(self):
+        # only CONFIG_ABC may be 'm'
+        static = StaticInference(self.fc, tristates=frozenset(["CONFIG_ABC"]))
+        static.calculate()
+        results = dict((var, kconfig_expression(x)) for (var, x) in static.selections.items())
+        self.assertEqual(results["FILE_j.S"],
+                         "(CONFIG_ABC_MODULE || CONFIG_ABC) && CONFIG_XY")
+        self.assertEqual(results["FILE_subdir_s2.c"], "CONFIG_DE && CONFIG_Z")
+
+    def test_same_as_make(self):
+        tree = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        saved = (vamos.golem.cache_dir, vamos.golem.snapshot_dir, sys.argv[0], sys.stdout)
+        vamos.golem.cache_dir = os.path.join(tree, "cache")
+        vamos.golem.snapshot_dir = None
+        # Makefile.list is located relative to the test
+        sys.argv[0] = os.path.abspath(sys.argv[0])
+        try:
+            os.chdir(tree)
+            vamos.golem.tree_state.revisions.clear()
+            # allnoconfig enables CONFIG_DEF, which defaults to 'y'
+            for (path, content) in (("Makefile",
+                                     "MAKEFLAGS += --no-print-directory\n"
+                                     "export Q := @\n"
+                                     "export srctree := .\n"
+                                     "vmlinux-dirs := kernel\n"
+                                     "allnoconfig:\n"
+                                     "\techo CONFIG_DEF=y > .config\n"
+                                     "silentoldconfig:\n"
+                                     "\tmkdir -p include/config\n"
+                                     "\tcp .config include/config/auto.conf\n"),
+                                    ("scripts/Makefile.lib",
+                                     "real-objs-y := $(addprefix $(obj)/,"
+                                     "$(filter-out %/,$(obj-y)))\n"
+                                     "real-objs-m := $(addprefix $(obj)/,"
+                                     "$(filter-out %/,$(obj-m)))\n"),
+                                    ("kernel/Makefile",
+                                     "obj-$(CONFIG_DEF) += def.o\n"
+                                     "obj-$(CONFIG_B) += b.o\n"
+                                     "obj-$(CONFIG_T) += t.o\n"),
+                                    ("kernel/def.c", ""),
+                                    ("kernel/b.c", ""),
+                                    ("kernel/t.c", ""),
+                                    ("models/x86.model",
+                                     "I: Items-Count: 3\nCONFIG_DEF\nCONFIG_B\n"
+                                     "CONFIG_T\nCONFIG_T_MODULE\n")):
+                if not os.path.isdir(os.path.dirname(path) or "."):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, "w") as fd:
+                    fd.write(content)
+
+            fc = FileConditions()
+            fc.parse(['FILE_kernel_def.c "CONFIG_DEF"',
+                      'FILE_kernel_b.c "(CONFIG_B || CONFIG_B_MODULE)"',
+                      'FILE_kernel_t.c "(CONFIG_T || CONFIG_T_MODULE)"'])
+
+            sys.stdout = StringIO.StringIO()
+            atoms = LinuxInferenceAtoms("x86", None)
+            inferencer = Inferencer(atoms, workers=1)
+            inferencer.calculate()
+            make = dict((atoms.format_var_impl(var),
+                         sorted(str(x) for x in selections))
+                        for (var, selections) in inferencer.var_impl_selections.items())
+
+            static = StaticInference(fc, tristates=atoms.tristates)
+            static.calculate()
+            self.assertEqual(static.incomplete, set())
+            self.assertEqual(dict((var, sorted(str(x) for x in selections))
+                                  for (var, selections) in static.selections.items()),
+                             make)
+            self.assertEqual(make["FILE_kernel_def.c"], ["CONFIG_DEF=y"])
+            self.assertEqual(make["FILE_kernel_b.c"], ["CONFIG_B=y"])
+        finally:
+            os.chdir(cwd)
+            (vamos.golem.cache_dir, vamos.golem.snapshot_dir, sys.argv[0], sys.stdout) = saved
+            vamos.golem.tree_state.revisions.clear()
+            shutil.rmtree(tree)
+
+
+if __name__ == '__main__':
+    t.main()
@@ -17,4 +17,20 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import os
+
 autoconf_h = None
+
+# directory to store snapshots of applied configurations in, cf.
+# vamos.golem.snapshots. Disabled if None.
+snapshot_dir = os.environ.get("VAMOS_SNAPSHOT_DIR", None)
+
+# directory for caches that are kept across runs (e.g., of the makefile
+# scanner). Set VAMOS_CACHE_DIR to an empty value (or use golem --no-cache)
+# to disable.
+cache_dir = os.environ.get("VAMOS_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache", "vamos"))
+
+# maximum number of results of the inference (golem -i) that are kept in
+# the cache directory per tree, architecture and revision
+fileset_cache_size = int(os.environ.get("VAMOS_FILESET_CACHE_SIZE", 200000))
@@ -0,0 +1,106 @@
+"""golem - caches for the slow coreboot buildsystem queries"""
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import hashlib
+import re
+
+from vamos.golem.tree_state import ResultCache, cache_key
+
+VARIABLE_REGEX = re.compile(r'^([^\s:#=]+)\s*(:=|::=|\?=|\+=|=)\s*(.*)$')
+RULE_REGEX = re.compile(r'^([^\s#:=][^:=]*?)\s*::?(?!=)\s*(.*)$')
+
+
+class MakeDatabase(object):
+    """
+    The parsed output of 'make --print-data-base'
+
+    Holds all variables and an index that maps each target to its
+    prerequisites, so that the (huge) dump only has to be parsed once.
+    """
+
+    def __init__(self, lines=None):
+        self.variables = {}
+        self.rules = {}
+        if lines:
+            self.parse(lines)
+
+    def parse(self, lines):
+        for line in lines:
+            if not line or line[0] in "#\t":
+                continue
+            m = VARIABLE_REGEX.match(line)
+            if m:
+                self.variables[m.group(1)] = m.group(3)
+                continue
+            m = RULE_REGEX.match(line)
+            if m:
+                prerequisites = m.group(2).replace("|", " ").split()
+                for target in m.group(1).split():
+                    self.rules.setdefault(target, []).extend(prerequisites)
+
+    def variable(self, name, default=""):
+        return self.variables.get(name, default)
+
+    def prerequisites(self, target):
+        """ returns the prerequisites of @target """
+        return self.rules.get(target, [])
+
+    def objects(self):
+        """ returns all objects in the '*-objs' variables """
+        objects = set()
+        for (name, value) in self.variables.items():
+            if name.endswith("-objs"):
+                objects.update(value.split())
+        return objects
+
+    def makefiles(self):
+        """ returns the included makefiles (MAKEFILE_LIST) """
+        return self.variable("MAKEFILE_LIST").split()
+
+
+def file_hash(path):
+    with open(path) as fd:
+        return hashlib.sha1(fd.read()).hexdigest()
+
+
+class CorebootCache(ResultCache):
+    """
+    Caches results per (mainboard or configuration, tree revision)
+
+    Results are kept in memory and, if vamos.golem.cache_dir is set, in
+    its 'coreboot' subdirectory.
+    """
+
+    def __init__(self):
+        ResultCache.__init__(self, "coreboot")
+
+    def get_config(self, mainboard):
+        """ copies the cached abuild configuration for @mainboard to
+        '.config', returns False if there is none """
+        config = self.get(cache_key("abuild", mainboard))
+        if config is None:
+            return False
+        with open(".config", "w") as fd:
+            fd.write(config)
+        return True
+
+    def put_config(self, mainboard, path):
+        """ stores the abuild configuration in @path for @mainboard """
+        with open(path) as fd:
+            self.put(cache_key("abuild", mainboard), fd.read())
+
+
+cache = CorebootCache()
@@ -0,0 +1,215 @@
+"""golem - evaluates minigolem file presence conditions in-process"""
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import itertools
+import logging
+import os
+import re
+
+from vamos.Config import Config
+from vamos.tools import execute
+from vamos.golem.kbuild import normalize_filename, files_for_selected_features
+
+
+class FileConditions(object):
+    """
+    The presence conditions of all source files, as derived by minigolem
+
+    minigolem prints one line per source file, e.g.:
+
+        FILE_drivers_net_foo.c "CONFIG_NET && (CONFIG_FOO || CONFIG_FOO_MODULE)"
+
+    Instead of asking make which files a configuration compiles, these
+    conditions are compiled into a single Python function that evaluates
+    all of them against a configuration at once. Files that share a
+    presence condition are grouped, so each distinct condition is only
+    evaluated once per configuration.
+    """
+
+    token_re = re.compile(r'\s*(&&|\|\||!|\(|\)|[A-Za-z0-9_]+)')
+
+    def __init__(self):
+        # FILE_ variable -> condition string ("" for unconditional files)
+        self.conditions = {}
+        self.groups = None
+        self.evaluator = None
+
+    @classmethod
+    def from_file(cls, path):
+        """ reads minigolem output (or a model containing FILE_ lines) """
+        fc = cls()
+        with open(path) as fd:
+            fc.parse(fd)
+        return fc
+
+    @classmethod
+    def from_tree(cls, arch):
+        """ runs minigolem for @arch in the current source tree """
+        (output, _) = execute("minigolem -a %s ." % arch, failok=False)
+        fc = cls()
+        fc.parse(output)
+        return fc
+
+    def parse(self, lines):
+        """ adds all FILE_ lines of the iterable @lines """
+        for line in lines:
+            line = line.strip()
+            if not line.startswith("FILE_"):
+                continue
+            parts = line.split(" ", 1)
+            cond = ""
+            if len(parts) == 2:
+                cond = parts[1].strip().strip('"')
+            self.conditions[parts[0]] = cond
+        self.evaluator = None
+
+    @staticmethod
+    def file_variable(filename):
+        """ returns the FILE_ variable for the path @filename """
+        return "FILE_" + normalize_filename(os.path.relpath(filename))
+
+    def translate(self, condition):
+        """ translates a minigolem @condition into a Python expression over
+        the set 's' of enabled symbols """
+        if not condition:
+            return "True"
+        expr = []
+        pos = 0
+        condition = condition.rstrip()
+        while pos < len(condition):
+            m = self.token_re.match(condition, pos)
+            if not m:
+                raise ValueError("cannot parse condition '%s'" % condition)
+            token = m.group(1)
+            pos = m.end()
+            if token == "&&":
+                expr.append(" and ")
+            elif token == "||":
+                expr.append(" or ")
+            elif token == "!":
+                expr.append(" not ")
+            elif token in ("(", ")"):
+                expr.append(token)
+            else:
+                expr.append("(%r in s)" % token)
+        return "".join(expr)
+
+    def compile(self):
+        """ compiles all conditions into one function returning a tuple of
+        truth values, one for each group of files """
+        groups = {}
+        for (var, cond) in self.conditions.items():
+            groups.setdefault(cond, []).append(var)
+        self.groups = groups.items()
+
+        source = "lambda s: (%s,)" % \
+            ", ".join([self.translate(cond) for (cond, _) in self.groups])
+        self.evaluator = eval(compile(source, "<file conditions>", "eval"))
+        logging.debug("compiled %d file conditions (%d distinct)",
+                      len(self.conditions), len(self.groups))
+
+    @staticmethod
+    def enabled_symbols(config):
+        """
+        returns the set of symbols that are true in @config
+
+        @config may be a path to a .config file or a dict like
+        vamos.Config, mapping CONFIG_ symbols to their values. Tristate
+        symbols set to 'm' enable the corresponding _MODULE symbol,
+        non-boolean symbols are enabled by having any value.
+        """
+        if isinstance(config, basestring):
+            config = Config(config)
+        enabled = set()
+        for (key, value) in config.items():
+            value = value.strip('"') if value.startswith('"') else value
+            if value == 'y':
+                enabled.add(key)
+            elif value == 'm':
+                enabled.add(key + "_MODULE")
+            elif value not in ('n', ''):
+                enabled.add(key)
+        return enabled
+
+    def compiled_files(self, config):
+        """ returns the set of FILE_ variables compiled in @config """
+        if not self.evaluator:
+            self.compile()
+        if not isinstance(config, (set, frozenset)):
+            config = self.enabled_symbols(config)
+        result = self.evaluator(config)
+        return set(itertools.chain.from_iterable(
+            var for ((_, var), value) in itertools.izip(self.groups, result)
+            if value))
+
+    def is_compiled(self, filename, config):
+        """ returns True if the source file @filename is compiled in
+        @config, None if its presence condition is unknown """
+        var = self.file_variable(filename)
+        if var not in self.conditions:
+            return None
+        return var in self.compiled_files(config)
+
+    def file_status(self, filenames, config):
+        """
+        returns a dict that maps each of @filenames to the mode it is
+        compiled in @config, like kbuild.file_in_current_configuration():
+        "y" if the file is selected without considering modules, "m" if
+        it needs a module, and "n" otherwise (including unknown files).
+        """
+        enabled = self.enabled_symbols(config)
+        static = set(s for s in enabled if not s.endswith("_MODULE"))
+        compiled_y = self.compiled_files(static)
+        compiled = self.compiled_files(enabled)
+
+        status = {}
+        for filename in filenames:
+            var = self.file_variable(filename)
+            if var in compiled_y:
+                status[filename] = "y"
+            elif var in compiled:
+                status[filename] = "m"
+            else:
+                status[filename] = "n"
+        return status
+
+    def cross_check(self, features, arch, subarch=None):
+        """
+        compares the files selected for @features with the result of
+        asking make (cf. files_for_selected_features()).
+
+        Only files known to minigolem are compared. Objects reported by
+        make are matched by their path without extension.
+
+        returns (only_conditions, only_make), the sets of FILE_ variables
+        where the evaluator and make disagree
+        """
+        def stem(var):
+            return var.rsplit(".", 1)[0]
+
+        ours = set(stem(var) for var in self.compiled_files(features))
+        known = set(stem(var) for var in self.conditions)
+
+        (files, _) = files_for_selected_features(features, arch, subarch)
+        theirs = set(stem(self.file_variable(f)) for f in files)
+        theirs &= known
+
+        only_conditions = ours - theirs
+        only_make = theirs - ours
+        if only_conditions or only_make:
+            logging.warning("file conditions disagree with make: %d only in conditions, "
+                            "%d only in make", len(only_conditions), len(only_make))
+        return (only_conditions, only_make)
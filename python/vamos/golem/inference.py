@@ -19,17 +19,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from vamos.selection import Selection
-from vamos.tools import get_online_processors
-from vamos.golem.FileSet import FileSetCache
+from vamos.selection import Selection, SelectionIndex, unique
+from vamos.tools import get_online_processors, ThreadPool
+from vamos.golem.FileSet import FileSetCache, open_fileset_store
+from vamos.golem.tree_state import tree_revision
 from vamos.golem.inference_atoms import *
 
+import cPickle
+import heapq
+import itertools
 import logging
 import os
-import copy
 import Queue
-import threading
-import thread
+import sys
 import time
 
 
@@ -48,79 +50,189 @@ def objects_in_dir(directory):
             ret[0].add(name)
     return ret
 
-def all_variations(seq_SEQ):
-    if len(seq_SEQ) == 0:
-        return [[]]
-    rest = all_variations(seq_SEQ[1:])
-    ret = []
-    for i in seq_SEQ[0]:
-        for r in rest:
-            ret.append([i] + r)
+def combinations(group):
+    """ returns the number of variations of a group of variability intentions """
+    ret = 1
+    for values in group:
+        ret *= len(values)
     return ret
 
-def unique(seq):
-    # order preserving
-    noDupes = []
-    for i in seq:
-        if not i in noDupes:
-            noDupes.append(i)
-    return noDupes
-
-class Counter:
-    def __init__(self):
-        self.lock = threading.Lock()
-        self.int = 0
-    def inc(self):
-        with self.lock:
-            self.int += 1
-    def dec(self):
-        with self.lock:
-            self.int -= 1
-    def isZero(self):
-        with self.lock:
-            return self.int == 0
-
+def cleanup_selections(selections):
+    """ removes selections that are worse than others (or empty), and
+    merges the remaining ones that differ only in one or-expression
+
+    The merges are done in the same order as by comparing all pairs of
+    selections: each selection is merged with the following mergeable
+    ones in the order they were given, until no more merges are possible.
+
+    returns the remaining selections and the number of comparisons """
+    selections = [x for x in unique(selections) if x]
+    index = SelectionIndex(selections)
+    for selection in selections:
+        if selection in index:
+            for worse in index.worse_than(selection):
+                index.remove(worse)
+
+    slots = [x for x in selections if x in index]
+    # selection -> positions in slots, merges may produce duplicates
+    positions = dict((x, set([i])) for (i, x) in enumerate(slots))
+
+    def remove(i):
+        selection = slots[i]
+        positions[selection].discard(i)
+        if not positions[selection]:
+            del positions[selection]
+            index.remove(selection)
+        slots[i] = None
+
+    again = True
+    while again:
+        again = False
+        for i in range(len(slots)):
+            last = -1
+            while slots[i] is not None:
+                selection = slots[i]
+                candidates = [x for other in index.mergeable(selection)
+                              for x in positions[other] if x > last]
+                candidates += [x for x in positions[selection] if x > last and x != i]
+                if not candidates:
+                    break
+                last = min(candidates)
+                merged = selection.merge(slots[last])
+                remove(i)
+                remove(last)
+                slots[i] = merged
+                positions.setdefault(merged, set()).add(i)
+                index.add(merged)
+                again = True
+
+    return ([x for x in slots if x is not None], index.comparisons)
+
+# orders in which the groups of variability intentions of a POV are varied
+VARIATION_ORDERS = ("given", "smallest")
+
+# orders in which visited POVs are worked on: in the order they were
+# found, or the directories with the most source files without results first
+PRIORITIES = ("fifo", "uncovered")
+
+def pov_directory(pov):
+    """ returns the directory of a POV, which may be a directory or a
+    makefile (e.g., coreboot's Makefile.inc) """
+    if os.path.isfile(pov):
+        pov = os.path.dirname(pov)
+    return os.path.normpath(pov)
+
+class Visit(object):
+    """ A visit of a POV with a base selection, whose variations are
+    still to be tested """
+
+    def __init__(self, pov, base_select, base_var_impl):
+        self.pov = pov
+        self.directory = pov_directory(pov)
+        self.base_select = base_select
+        self.base_var_impl = base_var_impl
+        # number of variations that were already submitted
+        self.consumed = 0
+        # generator of the remaining selections
+        self.selections = None
+
+
+def write_checkpoint(path, state):
+    """ writes @state to @path atomically """
+    tmp = "%s.%d" % (path, os.getpid())
+    with open(tmp, "wb") as fd:
+        cPickle.dump(state, fd, cPickle.HIGHEST_PROTOCOL)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.rename(tmp, path)
+
+
+def read_checkpoint(path):
+    """ returns the state stored in the checkpoint @path """
+    with open(path, "rb") as fd:
+        state = cPickle.load(fd)
+    if not isinstance(state, dict) or state.get("version") != CHECKPOINT_VERSION:
+        raise RuntimeError("%s is not a checkpoint of this version of golem" % path)
+    return state
+
+
+# format of the checkpoints, bump on incompatible changes
+CHECKPOINT_VERSION = 2
 
 class Inferencer:
-    def __init__(self, atoms):
+    def __init__(self, atoms, workers=None, max_variations=None, order="given",
+                 priority="fifo", time_budget=None, make_budget=None,
+                 checkpoint=None, checkpoint_interval=300):
+        """ @max_variations limits the number of variations tested per
+        visit of a POV, @order is one of VARIATION_ORDERS, @priority one
+        of PRIORITIES.
+
+        The inference stops testing new selections after @time_budget
+        seconds or @make_budget calls of OP_list, and prints the partial
+        results.
+
+        If @checkpoint is set, the state of the inference is written to
+        this file every @checkpoint_interval seconds and when the
+        inference is interrupted, cf. resume(). The filesets themselves
+        are kept by the FileSetStore. """
         # The atom
         self.atoms = atoms
-        self.cache = FileSetCache(self.atoms)
-        self.lock = threading.Lock()
+        self.cache = FileSetCache(self.atoms, open_fileset_store(self.atoms))
 
         self.visited_povs = {}
         self.var_impl_selections = {}
 
-        self.pov_queue = Queue.Queue()
-        self.work_queue = Queue.Queue()
-
-        self.on_the_run = Counter()
-        self.running = True
-
-    def observer(self):
-        while not self.on_the_run.isZero():
-            time.sleep(0.2)
-        with self.lock:
-            self.running = False
-
-
-    def work_queue_worker(self):
-        while self.running:
-            try:
-                args = self.work_queue.get(True, 1)
-                self.__test_selection(*args)
-                self.on_the_run.dec()
-            except Queue.Empty:
-                pass
-            except Exception as e:
-                self.running = False
-                logging.error(str(e))
-                raise
+        if workers is None:
+            workers = int(get_online_processors() * 1.5)
+        self.pool = ThreadPool(workers)
+        # heap of (priority, sequence number, Visit) of POV visits whose
+        # variations are still to be tested
+        self.sources = []
+        # futures of selections that are submitted but not yet recorded
+        self.in_flight = set()
+        self.sequence = itertools.count()
+        # keep the workers busy, but generate selections only on demand
+        self.max_pending = 2 * workers
+        if order not in VARIATION_ORDERS:
+            raise ValueError("Unknown variation order '%s'" % order)
+        self.order = order
+        if priority not in PRIORITIES:
+            raise ValueError("Unknown priority '%s'" % priority)
+        self.priority = priority
+        self.max_variations = max_variations
+        self.deadline = None
+        if time_budget is not None:
+            self.deadline = time.time() + time_budget
+        self.make_budget = make_budget
+        # selections submitted that are not cached yet
+        self.make_calls = 0
+        self.exhausted = False
+
+        self.skip = ()
+
+        self.checkpoint_path = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.time()
+        # state read by resume()
+        self.resumed = None
+
+        # futures of tested selections, in order of completion
+        self.completed = Queue.Queue()
+        self.pending = 0
+        self.tested = 0
+        # selections compared by the subsumption indexes
+        self.comparisons = 0
+        self.last_progress = time.time()
 
     def generate_variations(self, base_select, pov):
-        var_ints = self.atoms.OP_features_in_pov(pov)
-        ret = []
-        for var_group in var_ints:
+        """ yields the variations of the variability intentions in @pov
+        that are compatible with @base_select, each a list of (var_int,
+        value) tuples, without duplicates
+
+        The variations are enumerated lazily, group by group in the order
+        selected by self.order. """
+        groups = []
+        for var_group in self.atoms.OP_features_in_pov(pov):
             group = []
             for var_int in var_group:
                 if type(var_int) == tuple:
@@ -128,10 +240,16 @@ class Inferencer:
                 else:
                     values = self.atoms.OP_domain_of_variability_intention(var_int) \
                         - set([self.atoms.OP_default_value_of_variability_intention(var_int)])
-                    group.append([(var_int, value) for value in values])
+                    group.append([(var_int, value) for value in sorted(values)])
+            groups.append(group)
+
+        if self.order == "smallest":
+            groups.sort(key=combinations)
 
-            base_select_dict = base_select.to_dict()
-            for variation in all_variations(group):
+        base_select_dict = base_select.to_dict()
+        seen = set()
+        for group in groups:
+            for variation in itertools.product(*group):
                 d = dict(variation)
                 skip = False
                 delete_from_var = []
@@ -143,101 +261,269 @@ class Inferencer:
                         else:
                             delete_from_var.append(i)
 
-                variation = [(var_int, value) for (var_int, value) in variation if not var_int in delete_from_var]
-
-                if not skip:
-                    ret.append(variation)
-        return unique(ret)
-
-    def calculate(self):
-        # pylint: disable=R0912
+                if skip:
+                    continue
 
+                variation = [(var_int, value) for (var_int, value) in variation if not var_int in delete_from_var]
+                key = tuple(variation)
+                if not key in seen:
+                    seen.add(key)
+                    yield variation
+
+    def calculate(self, skip=()):
+        """ infers and prints the selections that enable each variability
+        implementation, except for those whose formatted name is in @skip
+
+        The results are printed when the inference has finished, as any
+        selection that is tested later may still add to them. If the
+        budget is exhausted or the inference is interrupted, the partial
+        results are printed. """
+        self.skip = skip
         empty_selection = Selection()
-        base_var_impl = self.cache.get_fileset(empty_selection)
-        empty_var_impl = copy.deepcopy(base_var_impl)
-        empty_var_impl.var_impl = set()
-        for var_impl in base_var_impl.var_impl:
-            self.var_impl_selections[var_impl] = [empty_selection]
-
-        for pov in empty_var_impl.pov:
-            self.on_the_run.inc()
-            self.pov_queue.put(tuple([empty_selection, base_var_impl, pov]))
-
-        thread.start_new_thread(self.observer, tuple())
+        if not self.cache.known(empty_selection):
+            self.make_calls += 1
 
-        for i in range(0, int(get_online_processors() * 1.5)):
-            thread.start_new_thread(self.work_queue_worker, tuple())
+        interrupted = False
+        try:
+            base_var_impl = self.cache.get_fileset(empty_selection)
+            for var_impl in base_var_impl.var_impl:
+                self.var_impl_selections[var_impl] = [empty_selection]
 
-        while self.running:
+            if self.resumed:
+                self.__restore(self.resumed)
+            else:
+                for pov in base_var_impl.pov:
+                    self.__visit_pov(empty_selection, base_var_impl, pov)
+            self.__feed()
+
+            while self.pending > 0:
+                try:
+                    # with a timeout, otherwise Ctrl-C is not delivered
+                    future = self.completed.get(True, 1)
+                except Queue.Empty:
+                    self.__feed()
+                    continue
+                self.pending -= 1
+                self.tested += 1
+                # reraises the exception of a failed worker
+                (selection, new_var_impl, var_impl_added, pov_added) = future.result()
+                self.__record(selection, new_var_impl, var_impl_added, pov_added)
+                self.in_flight.discard(future)
+                self.__feed()
+                self.__report_progress()
+                if time.time() - self.last_checkpoint >= self.checkpoint_interval:
+                    self.checkpoint()
+        except KeyboardInterrupt:
+            logging.warning("Inference interrupted, printing partial results")
+            interrupted = True
+            self.pool.shutdown(cancel=True)
+            # a terminated process may be killed soon, so the results
+            # are printed before anything else is written
+            self.__emit_all()
+            self.checkpoint()
+        except BaseException:
+            self.pool.shutdown(cancel=True)
+            raise
+        finally:
+            self.cache.close()
+        if not interrupted:
+            self.pool.shutdown()
+            if self.exhausted:
+                # allows to continue with another budget
+                self.checkpoint()
+            elif self.checkpoint_path and os.path.exists(self.checkpoint_path):
+                os.unlink(self.checkpoint_path)
+        if self.sources or interrupted:
+            logging.warning("Inference stopped with %d POV visits left, the results are partial",
+                            len(self.sources))
+        logging.info("Inference finished: %d selections tested", self.tested)
+        self.cache.log_statistics()
+        if interrupted:
+            raise KeyboardInterrupt()
+        self.__emit_all()
+
+    def cleanup(self, selections):
+        """ removes selections that are worse than others, and merges the
+        remaining ones that differ only in one or-expression """
+        (ret, comparisons) = cleanup_selections(selections)
+        self.comparisons += comparisons
+        return ret
+
+    def checkpoint(self):
+        """ writes the state of the inference to the checkpoint file """
+        if not self.checkpoint_path:
+            return
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "namespace": self.atoms.cache_namespace(),
+            "revision": tree_revision(),
+            "var_impl_selections": self.var_impl_selections,
+            "visited_povs": dict((pov, list(index))
+                                 for (pov, index) in self.visited_povs.items()),
+            # the base filesets are looked up again in the FileSetCache
+            "visits": [(visit.pov, visit.base_select, visit.consumed)
+                       for (_, _, visit) in sorted(self.sources)],
+            # selections that were submitted, but not yet recorded
+            "pending": [(f.args[0], f.args[1].selection) for f in self.in_flight],
+            "tested": self.tested,
+        }
+        write_checkpoint(self.checkpoint_path, state)
+        self.last_checkpoint = time.time()
+        logging.info("Wrote checkpoint %s (%d visits queued, %d selections pending)",
+                     self.checkpoint_path, len(state["visits"]), len(state["pending"]))
+
+    def resume(self):
+        """ continues from the checkpoint file in the next calculate() """
+        state = read_checkpoint(self.checkpoint_path)
+        if state["namespace"] != self.atoms.cache_namespace() or \
+                state["revision"] != tree_revision():
+            raise RuntimeError("Checkpoint %s was written for another tree, revision "
+                               "or architecture" % self.checkpoint_path)
+        self.resumed = state
+
+    def __restore(self, state):
+        """ restores the queues and results of a checkpoint """
+        self.var_impl_selections.update(state["var_impl_selections"])
+        for (pov, selections) in state["visited_povs"].items():
+            self.visited_povs[pov] = SelectionIndex(selections)
+        self.tested = state["tested"]
+        for (pov, base_select, consumed) in state["visits"]:
+            visit = Visit(pov, base_select, self.cache.get_fileset(base_select))
+            visit.consumed = consumed
+            self.__queue(visit)
+        for (selection, base_select) in state["pending"]:
+            self.__submit(selection, self.cache.get_fileset(base_select))
+        logging.info("Resumed inference with %d selections tested, %d visits queued "
+                     "and %d selections pending", self.tested, len(state["visits"]),
+                     len(state["pending"]))
+
+    def __visit_pov(self, base_select, base_var_impl, pov):
+        visited = self.visited_povs.get(pov)
+        if visited is not None:
+            before = visited.comparisons
+            base_select_is_superset = visited.has_better(base_select)
+            self.comparisons += visited.comparisons - before
+        else:
+            base_select_is_superset = False
+
+        if base_select_is_superset or not self.atoms.pov_worth_working_on(pov):
+            return
+
+        if not pov in self.visited_povs:
+            self.visited_povs[pov] = SelectionIndex()
+        self.visited_povs[pov].add(base_select)
+        logging.info("Visiting POV: %s", pov)
+
+        self.__queue(Visit(pov, base_select, base_var_impl))
+
+    def __queue(self, visit):
+        # skip the variations that were submitted before a checkpoint
+        visit.selections = itertools.islice(self.__selections(visit.base_select, visit.pov),
+                                            visit.consumed, None)
+        heapq.heappush(self.sources, (self.__priority(visit.directory), next(self.sequence),
+                                      visit))
+
+    def __priority(self, directory):
+        """ returns the priority of a POV in @directory, lower is earlier """
+        if self.priority == "uncovered":
+            try:
+                (objects, _) = objects_in_dir(directory)
+            except OSError:
+                return 0
+            return -len([x for x in objects
+                         if os.path.normpath(x) not in self.var_impl_selections])
+        return 0
+
+    def __selections(self, base_select, pov):
+        for (n, variation) in enumerate(self.generate_variations(base_select, pov)):
+            if self.max_variations is not None and n >= self.max_variations:
+                logging.warning("Skipping further variations of POV %s with '%s', "
+                                "limit of %d reached", pov, base_select, self.max_variations)
+                return
+            assert all([not var_int in base_select.symbols
+                        for (var_int, value) in variation])
+            yield base_select.extend(*[[x] for x in variation])
+
+    def __budget_exhausted(self):
+        if self.exhausted:
+            return True
+        if self.deadline is not None and time.time() >= self.deadline:
+            logging.warning("Time budget exhausted, not testing further selections")
+            self.exhausted = True
+        elif self.make_budget is not None and self.make_calls >= self.make_budget:
+            logging.warning("Budget of %d make calls exhausted, not testing further selections",
+                            self.make_budget)
+            self.exhausted = True
+        return self.exhausted
+
+    def __feed(self):
+        """ submits selections until enough are pending """
+        while self.sources and self.pending < self.max_pending:
+            if self.__budget_exhausted():
+                return
+            (_, _, visit) = self.sources[0]
             try:
-                (base_select, base_var_impl, pov) = self.pov_queue.get(True, 1)
-            except Queue.Empty:
+                new_selection = next(visit.selections)
+            except StopIteration:
+                heapq.heappop(self.sources)
                 continue
-
-            base_select_is_superset = any([x.better_than(base_select) for x in self.visited_povs.get(pov, [])])
-
-            if not base_select_is_superset and self.atoms.pov_worth_working_on(pov):
-                if not pov in self.visited_povs:
-                    self.visited_povs[pov] = []
-                self.visited_povs[pov].append(base_select)
-                logging.info("Visiting POV: %s", pov)
-
-                for variation in self.generate_variations(base_select, pov):
-                    new_selection = Selection(base_select)
-                    assert all([not var_int in new_selection.symbols
-                                for (var_int, value) in variation])
-                    for (var_int, value) in variation:
-                        new_selection.push_down()
-                        new_selection.add_alternative(var_int, value)
-
-                    self.on_the_run.inc()
-                    self.work_queue.put(tuple([pov, new_selection, base_var_impl]))
-
-            self.on_the_run.dec()
-
-        # Cleanup bad alternatives
+            visit.consumed += 1
+            if not self.cache.known(new_selection):
+                self.make_calls += 1
+            self.__submit(new_selection, visit.base_var_impl)
+
+    def __submit(self, selection, base_var_impl):
+        self.pending += 1
+        future = self.pool.submit(self.__test_selection, selection, base_var_impl)
+        self.in_flight.add(future)
+        future.add_done_callback(self.completed.put)
+
+    def __report_progress(self):
+        now = time.time()
+        if now - self.last_progress < 5 and self.pending > 0:
+            return
+        self.last_progress = now
+        logging.info("Inference: %d selections tested, %d pending, %d POVs visited, "
+                     "%d visits queued", self.tested, self.pending,
+                     len(self.visited_povs), len(self.sources))
+
+    def __emit_all(self):
+        """ cleans up and prints the selections of all variability
+        implementations """
         for var_impl in self.var_impl_selections:
-            selection = self.var_impl_selections[var_impl]
-            i = 0
-            for i in range(0, len(selection)):
-                for x in range(0, len(selection)):
-                    if x != i and selection[i] and selection[x] \
-                            and selection[i].better_than(selection[x]):
-                        selection[x] = None
-
-            again = True
-            while again:
-                again = False
-                for i in range(0, len(selection)):
-                    for x in range(0, len(selection)):
-                        if x != i and selection[i] and selection[x]:
-                            m = selection[i].merge(selection[x])
-                            if m:
-                                again = True
-                                selection[i] = m
-                                selection[x] = None
-
-            self.var_impl_selections[var_impl] = [x for x in selection if x]
-
-        for i in self.var_impl_selections:
-            if len(self.var_impl_selections[i]) > 0:
-                print '%s "%s"' % (self.atoms.format_var_impl(i),
-                                   self.atoms.format_selections(self.var_impl_selections[i]))
+            self.__emit(var_impl)
+        logging.info("Subsumption index: %d selections compared", self.comparisons)
+
+    def __emit(self, var_impl):
+        """ cleans up and prints the selections of @var_impl """
+        selections = self.cleanup(self.var_impl_selections[var_impl])
+        self.var_impl_selections[var_impl] = selections
+
+        formatted = self.atoms.format_var_impl(var_impl)
+        if formatted in self.skip:
+            return
+        if len(selections) > 0:
+            print '%s "%s"' % (formatted, self.atoms.format_selections(selections))
+        else:
+            print formatted
+        sys.stdout.flush()
+
+    def __record(self, current_selection, new_var_impl, var_impl_added, pov_added):
+        """ called in the main thread for each tested selection """
+        for var_impl in var_impl_added:
+            if not var_impl in self.var_impl_selections:
+                self.var_impl_selections[var_impl] = [current_selection]
             else:
-                print self.atoms.format_var_impl(i)
+                self.var_impl_selections[var_impl].append(current_selection)
+
+        for pov in pov_added:
+            self.__visit_pov(current_selection, new_var_impl, pov)
 
-    def __test_selection(self, pov, current_selection, base_var_impl):
+    def __test_selection(self, current_selection, base_var_impl):
+        """ runs in a worker thread, returns the changes of
+        @current_selection compared to @base_var_impl """
         new_var_impl = self.cache.get_fileset(current_selection)
 
         ((var_impl_added, _), (pov_added, _)) = new_var_impl.compare_to_base(base_var_impl)
 
-        with self.lock:
-            for var_impl in var_impl_added:
-                if not var_impl in self.var_impl_selections:
-                    self.var_impl_selections[var_impl] = [current_selection]
-                else:
-                    self.var_impl_selections[var_impl].append(current_selection)
-
-        for pov in pov_added:
-            self.on_the_run.inc()
-            self.pov_queue.put(tuple([current_selection, new_var_impl, pov]))
+        return (current_selection, new_var_impl, var_impl_added, pov_added)
@@ -22,6 +22,8 @@ import vamos.golem.kbuild as kbuild
 import vamos.tools as tools
 import vamos.model as Model
 
+from vamos.golem.tree_state import ResultCache, cache_key
+
 from tempfile import NamedTemporaryFile
 
 import glob
@@ -29,6 +31,30 @@ import logging
 import os
 import re
 import sys
+import threading
+
+
+# allnoconfig configurations, their files and the tristate symbols of
+# the models, per architecture and tree revision
+baselines = ResultCache("baseline")
+
+
+def disjunction(selections):
+    """ formats a list of selections as a disjunction """
+    if len(selections) == 0:
+        return ""
+    if len(selections) == 1:
+        return str(selections[0])
+    return "((" + ") || (".join([str(x) for x in selections]) + "))"
+
+
+def kconfig_expression(selections):
+    """ formats a list of selections of CONFIG_ symbols like minigolem
+    does, i.e., SYMBOL=y as SYMBOL and SYMBOL=m as SYMBOL_MODULE """
+    string = disjunction(selections)
+    string = string.replace("=y", "")
+    string = string.replace("=m", "_MODULE")
+    return string
 
 
 class InferenceAtoms:
@@ -54,16 +80,17 @@ class InferenceAtoms:
         return var_impl
 
     def format_selections(self, selections):
-        if len(selections) == 0:
-            return ""
-        if len(selections) == 1:
-            return str(selections[0])
-        return "((" + ") || (".join([str(x) for x in selections]) + "))"
+        return disjunction(selections)
 
     def pov_worth_working_on(self, point_of_variability):
         # pylint: disable=W0613
         return True
 
+    def cache_namespace(self):
+        """ returns a tuple that identifies the results of OP_list in the
+        current tree, or None if they must not be cached across runs """
+        return None
+
 class FiascoInferenceAtoms(InferenceAtoms):
     """ Project specific information to create inferences for Fiasco """
     BSP_dict = {"arm": ["imx", "integrator", "kirkwood", "omap3", "pxa", "realview", "s3c", "sa1100",
@@ -185,6 +212,7 @@ class LinuxInferenceAtoms(InferenceAtoms):
         self.arch = arch
         self.subarch = subarch
         self.directory_prefix = directory_prefix
+        self.file_scope = None
 
         if arch:
             modelfile = Model.get_model_for_arch(arch)
@@ -192,20 +220,76 @@ class LinuxInferenceAtoms(InferenceAtoms):
             modelfile = None
 
         if modelfile:
-            logging.info("loading model %s", modelfile)
-            self.model = Model.parse_model(modelfile)
+            self.tristates = self.load_tristates(modelfile)
         else:
             sys.exit("No model for '%s' found, please generate models using undertaker-kconfigdump" \
                     % arch)
 
-        kbuild.call_linux_makefile('allnoconfig', arch=self.arch, subarch=self.subarch)
+        # allnoconfig and its files of a previous run on this tree revision
+        self.baseline_lock = threading.Lock()
+        self.baseline_key = cache_key("allnoconfig", arch, subarch)
+        self.baseline = dict(baselines.get(self.baseline_key) or {})
+
+        self.configure_baseline()
+
+    @staticmethod
+    def load_tristates(modelfile):
+        """ returns the tristate symbols of @modelfile, parses the model
+        only if they are not cached """
+        stat = os.stat(modelfile)
+        key = cache_key("tristates", os.path.abspath(modelfile), stat.st_mtime, stat.st_size)
+        tristates = baselines.get(key)
+        if tristates is None:
+            logging.info("loading model %s", modelfile)
+            model = Model.parse_model(modelfile)
+            tristates = frozenset(x for x in model if x + "_MODULE" in model)
+            baselines.put(key, tristates)
+        return tristates
+
+    def update_baseline(self, **values):
+        with self.baseline_lock:
+            self.baseline.update(values)
+            baselines.put(self.baseline_key, dict(self.baseline))
+
+    def configure_baseline(self):
+        """ configures allnoconfig in the tree, reusing the configuration
+        of a previous run """
+        config = ".config"
+        auto_conf = "include/config/auto.conf"
+        known = self.baseline.get("config")
+        if known is None:
+            kbuild.call_linux_makefile('allnoconfig', arch=self.arch, subarch=self.subarch)
+        else:
+            try:
+                with open(config) as fd:
+                    applied = fd.read() == known and \
+                        os.path.getmtime(auto_conf) >= os.path.getmtime(config)
+            except (IOError, OSError):
+                applied = False
+            if applied:
+                logging.info("Reusing the applied allnoconfig for %s", self.arch)
+                return
+            with open(config, "w") as fd:
+                fd.write(known)
         kbuild.apply_configuration(arch=self.arch, subarch=self.subarch)
+        if known is None:
+            with open(config) as fd:
+                self.update_baseline(config=fd.read())
 
     def OP_list(self, selection):
         features = selection.to_dict()
-        (files, dirs) = kbuild.files_for_selected_features(features, self.arch, self.subarch)
+        if not features and "files" in self.baseline:
+            (files, dirs) = self.baseline["files"]
+            return (set(files), set(dirs))
+        (files, dirs) = kbuild.files_for_selected_features(features, self.arch,
+                                                           self.subarch)
+        if not features:
+            self.update_baseline(files=(files, dirs))
         return (files, dirs)
 
+    def cache_namespace(self):
+        return (self.__class__.__name__, self.arch, self.subarch)
+
     def OP_features_in_pov(self, point_of_variability):
         variables = kbuild.determine_buildsystem_variables_in_directory(point_of_variability)
         return [[x] for x in variables]
@@ -214,14 +298,30 @@ class LinuxInferenceAtoms(InferenceAtoms):
         return "n"
 
     def OP_domain_of_variability_intention(self, var_int):
-        if var_int + "_MODULE" in self.model:
+        if var_int in self.tristates:
             return set(["y", "n", "m"])
         return set(["n", "y"])
 
+    def restrict_to(self, file_variables):
+        """ only work on POVs that may lead to the given FILE_ variables """
+        self.file_scope = [x[len("FILE_"):] for x in file_variables]
+
     def pov_worth_working_on(self, point_of_variability):
         if not point_of_variability.startswith(self.directory_prefix):
             logging.info("Skipping %s, not in scope", point_of_variability)
             return False
+        if self.file_scope is not None:
+            directory = point_of_variability
+            if os.path.isfile(directory):
+                directory = os.path.dirname(directory)
+            directory = os.path.normpath(directory)
+            # the normalized path of each parent directory is a prefix
+            # of the FILE_ variable
+            prefix = kbuild.normalize_filename(directory + "/")
+            if directory != "." and \
+                    not any(x.startswith(prefix) for x in self.file_scope):
+                logging.debug("Skipping %s, no files of interest", point_of_variability)
+                return False
         return True
 
     def format_var_impl(self, var_impl):
@@ -233,10 +333,7 @@ class LinuxInferenceAtoms(InferenceAtoms):
         return "FILE_" + var_impl
 
     def format_selections(self, selections):
-        string = InferenceAtoms.format_selections(self, selections)
-        string = string.replace("=y", "")
-        string = string.replace("=m", "_MODULE")
-        return string
+        return kconfig_expression(selections)
 
 
 class BusyboxInferenceAtoms(LinuxInferenceAtoms):
@@ -22,7 +22,9 @@
 #
 
 from vamos.Config import Config
-from vamos.tools import execute, CommandFailed
+from vamos.tools import execute, CommandFailed, dircache
+from vamos.golem import snapshots, make_jobs, coreboot_cache
+from vamos.golem.tree_state import get_tree_state
 
 from tempfile import mkstemp, NamedTemporaryFile
 from glob import glob
@@ -32,16 +34,10 @@ import os
 import re
 import shutil
 import sys
+import time
 
 import vamos
-
-# matches lines like:
-# obj-$(CONFIG_MODULES)           += microblaze_ksyms.o module.o
-# must not match lines like:
-# foo_CFLAGS += -DCONFIG=foo.h
-
-BUILDSYSTEM_VARIABLE_REGEX = \
-    r'(^CONFIG_|[^A-Za-z0-9_]CONFIG_)(?P<feature>[A-Za-z0-9_]+)'
+from vamos.golem.makefile_scanner import get_scanner
 
 
 class TreeNotConfigured(RuntimeError):
@@ -55,24 +51,33 @@ def normalize_filename(filename):
     return re.sub('[-+:,/]', '_', filename)
 
 
-def find_autoconf():
+def find_autoconf(outdir=None):
     """ returns the path to the autoconf.h file in this linux tree
+
+    If @outdir is given, the autoconf.h file in this output directory
+    (cf. make O=) is returned instead.
     """
 
-    if vamos.golem.autoconf_h:
+    if vamos.golem.autoconf_h and not outdir:
         return vamos.golem.autoconf_h
 
-    (autoconf, _) = execute("find include -name autoconf.h", failok=False)
-    autoconf = [x for x in autoconf if len(x) > 0]
-    if len(autoconf) != 1:
-        logging.error("Found %d autoconf.h files (%s)",
-                      len(autoconf), ", ".join(autoconf))
-        raise RuntimeError("Not exactly one autoconf.h was found")
-    vamos.golem.autoconf_h = autoconf[0]
+    def find():
+        include = os.path.join(outdir, "include") if outdir else "include"
+        (autoconf, _) = execute("find '%s' -name autoconf.h" % include, failok=False)
+        autoconf = [x for x in autoconf if len(x) > 0]
+        if len(autoconf) != 1:
+            logging.error("Found %d autoconf.h files (%s)",
+                          len(autoconf), ", ".join(autoconf))
+            raise RuntimeError("Not exactly one autoconf.h was found")
+        return autoconf[0]
+
+    if outdir:
+        return find()
+    vamos.golem.autoconf_h = get_tree_state().get("autoconf_h", find, os.path.isfile)
     return vamos.golem.autoconf_h
 
 
-def apply_configuration(arch=None, subarch=None, filename=None):
+def apply_configuration(arch=None, subarch=None, filename=None, outdir=None):
     """
     Applies the current configuration
 
@@ -88,6 +93,13 @@ def apply_configuration(arch=None, subarch=None, filename=None):
     guessed using the guess_arch_from_filename() function. Overriding
     either arch or subarch remains possible by explicitly setting arch
     or subarch.
+
+    If @outdir is given, the configuration in '@outdir/.config' is
+    applied to this output directory (cf. make O=).
+
+    If vamos.golem.snapshot_dir (environment variable VAMOS_SNAPSHOT_DIR)
+    is set, configurations that have been applied before are restored
+    from a snapshot instead of calling 'make silentoldconfig'.
     """
 
     if filename:
@@ -101,22 +113,38 @@ def apply_configuration(arch=None, subarch=None, filename=None):
         logging.warning("No architecture selected. Defaulting to x86")
         arch = 'x86'
 
-    if not os.path.exists(".config"):
-        call_linux_makefile("allyesconfig", arch=arch, subarch=subarch)
+    # the tree is about to change, drop all cached directory listings
+    dircache.invalidate()
+
+    config = os.path.join(outdir, ".config") if outdir else ".config"
+    if not os.path.exists(config):
+        call_linux_makefile("allyesconfig", arch=arch, subarch=subarch,
+                            outdir=outdir)
 
     # this catches unset defaults. Since boolean and tristate have
     # implicit defaults, this can effectively only happen for integer
     # and hex items. Both are fine with a setting of '0'
-    execute('sed -i s,=$,=0,g .config', failok=False)
+    execute("sed -i s,=$,=0,g '%s'" % config, failok=False)
+
+    # switching back to a known configuration only restores its snapshot
+    key = None
+    if vamos.golem.snapshot_dir and not outdir:
+        key = snapshots.snapshot_key(arch, subarch)
+        if snapshots.restore_snapshot(key):
+            return
+
     try:
         call_linux_makefile('silentoldconfig', arch=arch, subarch=subarch,
-                            failok=False)
+                            failok=False, outdir=outdir)
     except CommandFailed as e:
         if e.returncode == 2:
             raise TreeNotConfigured("target 'silentoldconfig' failed")
         else:
             raise
 
+    if key:
+        snapshots.save_snapshot(key, find_autoconf())
+
 def guess_source_for_target(target, arch=None):
     """
     for the given target, try to determine its source file.
@@ -137,7 +165,7 @@ def guess_source_for_target_generic(target):
     """
     for suffix in ('.c', '.S', '.s', '.l', '.y', '.ppm'):
         sourcefile = target[:-2] + suffix
-        if os.path.exists(sourcefile):
+        if dircache.exists(sourcefile):
             return sourcefile
     return None
 
@@ -160,7 +188,8 @@ def guess_source_for_target_coreboot(target):
         return None
 
 
-def linux_files_for_current_configuration(arch=None, subarch=None, how=False):
+def linux_files_for_current_configuration(arch=None, subarch=None, how=False,
+                                          outdir=None):
     """
     Returns a list of files that are compiled with the current
     configuration.
@@ -169,15 +198,17 @@ def linux_files_for_current_configuration(arch=None, subarch=None, how=False):
 
     NB: If not working for the default architecture 'x86', the optional
     parameters "arch" (and possibly "subarch") need to be specified!
+
+    If @outdir is given, the configuration of this output directory
+    (cf. make O=) is listed.
     """
     # locate directory for supplemental makefiles
     scriptsdir = find_scripts_basedir()
     assert os.path.exists(os.path.join(scriptsdir, 'Makefile.list_recursion'))
 
-    apply_configuration(arch=arch, subarch=subarch)
+    apply_configuration(arch=arch, subarch=subarch, outdir=outdir)
 
-    make_args="-f %(basedir)s/Makefile.list UNDERTAKER_SCRIPTS=%(basedir)s" % \
-        { 'basedir' : scriptsdir }
+    make_args = list_makefile_args(scriptsdir, outdir)
 
     (output, _) = call_linux_makefile('list',
                                       arch=arch,
@@ -218,6 +249,11 @@ def coreboot_get_config_for(subarch=None):
             mainboard = m.group(2)
             logging.debug("Using Vendor '%s', Mainboard '%s'", vendor, mainboard)
 
+            # abuild results are cached per mainboard and tree revision
+            if coreboot_cache.cache.get_config(subarch):
+                logging.debug("Using cached configuration for %s", subarch)
+                return
+
             cmd = './util/abuild/abuild -B -C -t %s/%s' % (vendor, mainboard)
             if not os.path.isdir('./coreboot-builds/%s_%s' % (vendor, mainboard)):
                 execute(cmd, failok=True)
@@ -231,6 +267,7 @@ def coreboot_get_config_for(subarch=None):
 
         shutil.copy('./coreboot-builds/%s_%s/config.build' % (vendor, mainboard),
                     '.config')
+        coreboot_cache.cache.put_config(subarch, '.config')
 
 def coreboot_files_for_current_configuration(subarch=None, how=False):
     """
@@ -251,13 +288,18 @@ def coreboot_files_for_current_configuration(subarch=None, how=False):
         subarch = "emulation/qemu-x86"
 
     coreboot_get_config_for(subarch)
-    (output, _) = call_makefile_generic('printall', failok=False)
 
-    objects = set()
-    for line in output:
-        if '-objs:=' in line:                               # obj files
-            for f in line[line.find('=')+1:].split():       # skip description
-                objects.add(f + " y")
+    key = coreboot_cache.cache_key("printall", coreboot_cache.file_hash('.config'))
+    objects = coreboot_cache.cache.get(key)
+    if objects is None:
+        (output, _) = call_makefile_generic('printall', failok=False)
+
+        objects = set()
+        for line in output:
+            if '-objs:=' in line:                               # obj files
+                for f in line[line.find('=')+1:].split():       # skip description
+                    objects.add(f + " y")
+        coreboot_cache.cache.put(key, objects)
 
     if not how:
         new = set()
@@ -271,7 +313,24 @@ def coreboot_files_for_current_configuration(subarch=None, how=False):
 
     return objects
 
-def files_for_current_configuration(arch, subarch, how=False):
+def list_makefile_args(scriptsdir, outdir=None):
+    """
+    Returns the make arguments to list the compiled files with
+    'Makefile.list' in @scriptsdir.
+
+    'Makefile.list' has to run in the source tree without make O=, as it
+    includes the top-level Makefile. For an output directory @outdir, it
+    reads '@outdir/include/config/auto.conf' instead of the tree's.
+    """
+    make_args = "-f %(basedir)s/Makefile.list UNDERTAKER_SCRIPTS=%(basedir)s" % \
+        { 'basedir' : scriptsdir }
+    if outdir:
+        make_args += " auto_conf=%s" % \
+            os.path.join(os.path.abspath(outdir), "include/config/auto.conf")
+    return make_args
+
+
+def files_for_current_configuration(arch, subarch, how=False, outdir=None):
     """
     Returns a list of files that are compiled with the current
     configuration.
@@ -287,14 +346,17 @@ def files_for_current_configuration(arch, subarch, how=False):
     Distinguishes if current tree is linux or coreboot and then
     returns a list of files that are compiled with the current
     configuration.
+
+    For Linux, the optional parameter 'outdir' selects the output
+    directory (make O=) that holds the current configuration.
     """
     if arch == 'coreboot':
         return coreboot_files_for_current_configuration(subarch, how)
     else:
-        return linux_files_for_current_configuration(arch, subarch, how)
+        return linux_files_for_current_configuration(arch, subarch, how, outdir)
 
 
-def file_in_current_configuration(filename, arch=None, subarch=None):
+def file_in_current_configuration(filename, arch=None, subarch=None, outdir=None):
     """
     to be run in a Linux source tree.
 
@@ -308,6 +370,8 @@ def file_in_current_configuration(filename, arch=None, subarch=None):
     NB: this function expects the current configuration to be already
         applied with the apply_configuration() function
 
+    If @outdir is given, the configuration of this output directory
+    (cf. make O=) is used.
     """
 
     # locate directory for supplemental makefiles
@@ -320,9 +384,8 @@ def file_in_current_configuration(filename, arch=None, subarch=None):
     basename = filename.rsplit(".", 1)[0]
     logging.debug("checking file %s", basename)
 
-    make_args = "-f %(basedir)s/Makefile.list UNDERTAKER_SCRIPTS=%(basedir)s compiled='%(filename)s'" % \
-        { 'basedir' : scriptsdir,
-          'filename': filename.replace("'", "\'")}
+    make_args = list_makefile_args(scriptsdir, outdir) + " compiled='%s'" % \
+        filename.replace("'", "\'")
 
     try:
         if arch == 'busybox':
@@ -363,27 +426,97 @@ def file_in_current_configuration(filename, arch=None, subarch=None):
     return "n"
 
 
+def files_in_current_configuration(filenames, arch, subarch=None, outdir=None,
+                                   conditions=None):
+    """
+    to be run in a Linux source tree.
+
+    Batch variant of file_in_current_configuration(): instead of calling
+    make once per file, the list of compiled objects is determined with a
+    single make pass (or, if a vamos.golem.file_conditions.FileConditions
+    object is given as @conditions, by evaluating the presence conditions
+    against '.config' without calling make at all).
+
+    All @filenames are checked for @arch and @subarch, which are not
+    guessed from the filenames. If @outdir is given, the configuration of
+    this output directory (cf. make O=) is used.
+
+    Returns a dict that maps each of the given filenames to the mode
+    ("y", "m", "l" or "n") it is compiled in the current configuration.
+
+    NB: this function expects the current configuration to be already
+        applied with the apply_configuration() function
+    """
+
+    filenames = [os.path.normpath(f) for f in filenames]
+    if not filenames:
+        return {}
+
+    if conditions is not None:
+        return conditions.file_status(filenames, os.path.join(outdir or "", ".config"))
+
+    if arch == 'coreboot':
+        compiled = set(os.path.normpath(f) for f in
+                       coreboot_files_for_current_configuration(subarch))
+        return dict((f, "y" if f in compiled else "n") for f in filenames)
+
+    # locate directory for supplemental makefiles
+    scriptsdir = find_scripts_basedir()
+    assert(os.path.exists(os.path.join(scriptsdir, 'Makefile.list_recursion')))
+
+    try:
+        if arch == 'busybox':
+            (make_result, _) = call_makefile_generic('list',
+                                                     failok=False,
+                                                     extra_variables=list_makefile_args(scriptsdir))
+        else:
+            make_args = list_makefile_args(scriptsdir, outdir)
+            (make_result, _) = call_linux_makefile('list',
+                                                   arch=arch,
+                                                   subarch=subarch,
+                                                   failok=False,
+                                                   extra_variables=make_args)
+    except CommandFailed:
+        logging.error("Unable to determine which files are covered by current configuration")
+        return dict((f, "n") for f in filenames)
+
+    # map object files without extension to their mode
+    modes = {}
+    for line in make_result:
+        # these lines indicate error and warning messages
+        if '***' in line: continue
+        l = line.split()
+        if len(l) != 2: continue
+        modes[os.path.normpath(l[0]).rsplit(".", 1)[0]] = l[1]
+
+    return dict((f, modes.get(f.rsplit(".", 1)[0], "n")) for f in filenames)
+
+
 def determine_buildsystem_variables(arch=None):
     """
     returns a list of kconfig variables that are mentioned in Linux Makefiles
+
+    If @arch is given, makefiles in 'arch/' are only considered for this
+    architecture. The results are cached, cf. MakefileScanner.
     """
+    scanner = get_scanner()
+    prune = None
     if arch == 'coreboot':
-        cmd = r"find . \( -name Makefile.inc -o -name Makefile \) " + \
-              r"-exec sed -n '/CONFIG_/p' {} \+"
-    elif arch:
-        cmd = r"find . \( -name Kbuild -o -name Makefile \) " + \
-              r"\( ! -path './arch/*' -o -path './arch/%(arch)s/*' \) " + \
-              r"-exec sed -n '/CONFIG_/p' {} \+"
-        cmd = cmd % {'arch': arch}
+        names = ("Makefile.inc", "Makefile")
     else:
-        cmd = r"find . \( -name Kbuild -o -name Makefile \) -exec sed -n '/CONFIG_/p' {} \+"
-    find_result = execute(cmd, failok=False)
-
-    ret = set()
-    for line in find_result[0]:
-        for m in re.finditer(BUILDSYSTEM_VARIABLE_REGEX, line):
-            config_variable = m.group('feature')
-            ret.add(config_variable)
+        names = ("Kbuild", "Makefile")
+        if arch:
+            own = "arch/" + arch
+            prune = lambda d: d.startswith("arch/") and \
+                not (d == own or d.startswith(own + "/"))
+
+    files = scanner.collect(".", names, prune)
+    if arch and arch != 'coreboot':
+        files = [f for f in files if not f.startswith("arch/") or
+                 f.startswith("arch/%s/" % arch)]
+
+    ret = scanner.variables(files)
+    scanner.save()
     return ret
 
 
@@ -406,14 +539,7 @@ def determine_buildsystem_variables_in_directory(directory, arch=''):
         filenames.append(kbuild + ".platforms")
         filenames += glob(directory + "/*/Platform")
 
-    ret = set()
-    for filename in filenames:
-        with open(filename) as fd:
-            for line in fd:
-                for m in re.finditer(BUILDSYSTEM_VARIABLE_REGEX, line):
-                    config_variable = m.group('feature')
-                    ret.add("CONFIG_" + config_variable)
-    return ret
+    return set("CONFIG_" + x for x in get_scanner().variables(filenames))
 
 
 def guess_subarch_from_arch(arch):
@@ -491,33 +617,66 @@ def call_makefile_generic(target, failok=False, dryrun=False, **kwargs):
     If dryrun is True, then the command line is returned instead of the
     command's execution output. This is mainly useful for testing.
 
+    Unless the keyword argument 'njobs' is given, the number of jobs is
+    chosen by vamos.golem.make_jobs.tuner, or left to the jobserver if
+    one is active (cf. make_jobs.enable_jobserver()).
+
+    If the keyword argument 'outdir' is given, all generated files are
+    placed in this directory (make O=), which allows to use several
+    configurations of one source tree at the same time.
+
     returns a tuple with
      1. the command's standard output as list of lines
      2. the exitcode
     """
 
     njobs = kwargs.get('njobs', None)
-
-    if njobs is None:
-        njobs = int(os.sysconf('SC_NPROCESSORS_ONLN') * 1.20 + 0.5)
-
-    cmd = "env %(extra_env)s make -j%(njobs)s %(target)s %(extra_variables)s " %\
+    extra_variables = kwargs.get('extra_variables', "")
+    if kwargs.get('outdir', None):
+        extra_variables += " O=%s" % kwargs['outdir']
+
+    # with a jobserver, the job slots are shared with all other make
+    # processes, and an explicit -j would disable it
+    jobserver = make_jobs.active_jobserver() if njobs is None else None
+    tuned = njobs is None and not jobserver
+    if tuned:
+        njobs = make_jobs.tuner.choose(target)
+
+    cmd = "env %(extra_env)s make %(jobs)s %(target)s %(extra_variables)s " %\
         {
         'target': target,
-        'njobs': njobs,
+        'jobs': "" if jobserver else "-j%s" % njobs,
         'extra_env': kwargs.get('extra_env', ""),
-        'extra_variables': kwargs.get('extra_variables', ""),
+        'extra_variables': extra_variables,
         }
 
     if dryrun:
+        if tuned:
+            make_jobs.tuner.finished(njobs)
         return (cmd, 0)
-    else:
+
+    if jobserver:
+        # the implicit slot of make
+        token = jobserver.acquire()
+        try:
+            return execute(cmd, failok=failok)
+        finally:
+            jobserver.release(token)
+
+    if not tuned:
+        return execute(cmd, failok=failok)
+
+    start = time.time()
+    try:
         return execute(cmd, failok=failok)
+    finally:
+        make_jobs.tuner.finished(njobs)
+        make_jobs.tuner.record(target, njobs, time.time() - start)
 
 
 def call_linux_makefile(target, extra_env="", extra_variables="",
                         filename=None, arch=None, subarch=None,
-                        failok=True, dryrun=False, njobs=None):
+                        failok=True, dryrun=False, njobs=None, outdir=None):
     # pylint: disable=R0912
     """
     Invokes 'make' in a Linux Buildtree.
@@ -583,42 +742,72 @@ def call_linux_makefile(target, extra_env="", extra_variables="",
     return call_makefile_generic(target, failok=failok, njobs=njobs,
                                  dryrun=dryrun,
                                  extra_env=extra_env,
-                                 extra_variables=extra_variables)
+                                 extra_variables=extra_variables,
+                                 outdir=outdir)
+
+def get_buildsystem():
+    """
+    Determines the kind of the current tree: 'linux', 'busybox',
+    'coreboot' or None. The result is cached, cf. get_tree_state().
+    """
+    def detect():
+        if os.path.isfile("arch/x86/Kconfig") or os.path.isfile("arch/i386/Kconfig"):
+            return "linux"
+        if os.path.isfile("scripts/gen_build_files.sh"):
+            return "busybox"
+        if os.access("Makefile", os.R_OK):
+            with open("Makefile", "r") as fd:
+                if fd.read().find('This file is part of the coreboot project.') != -1:
+                    return "coreboot"
+        return None
+
+    return get_tree_state().get("buildsystem", detect)
 
 def is_linux():
     """
     Check if we are inside a Linux tree.
     """
-    if os.path.isfile("arch/x86/Kconfig") or os.path.isfile("arch/i386/Kconfig"):
-        return True
-    return False
+    return get_buildsystem() == "linux"
 
 def is_busybox():
     """
     Check if we are inside a Busybox tree.
     """
-    if os.path.isfile("scripts/gen_build_files.sh"):
-        return True
-    return False
+    return get_buildsystem() == "busybox"
 
 def is_coreboot():
     """
     Check if we are inside a Coreboot tree.
     """
-    if os.access("Makefile", os.R_OK):
-        with open("Makefile", "r") as fd:
-            if fd.read().find('This file is part of the coreboot project.') != -1:
-                return True
-    return False
+    return get_buildsystem() == "coreboot"
+
+def get_architectures():
+    """
+    Returns the sorted list of architectures of the current Linux tree,
+    i.e., the directories in 'arch/' that contain a Kconfig file.
+    """
+    def find():
+        if not os.path.isdir("arch"):
+            return []
+        return sorted(d for d in os.listdir("arch")
+                      if os.path.isfile(os.path.join("arch", d, "Kconfig")))
+
+    return get_tree_state().get("architectures", find)
 
 def find_scripts_basedir():
     executable = os.path.realpath(sys.argv[0])
-    base_dir   = os.path.dirname(executable)
-    for d in [ '../lib', '../scripts', '../../scripts', '../../../scripts']:
-        f = os.path.join(base_dir, d, 'Makefile.list')
-        if os.path.exists(f):
-            return os.path.realpath(os.path.join(base_dir, d))
-    raise RuntimeError("Failed to locate Makefile.list")
+
+    def find():
+        base_dir   = os.path.dirname(executable)
+        for d in [ '../lib', '../scripts', '../../scripts', '../../../scripts']:
+            f = os.path.join(base_dir, d, 'Makefile.list')
+            if os.path.exists(f):
+                return os.path.realpath(os.path.join(base_dir, d))
+        raise RuntimeError("Failed to locate Makefile.list")
+
+    # the location depends on the installation, not on the tree
+    return get_tree_state().get("scripts_basedir:" + executable, find,
+                                lambda d: os.path.exists(os.path.join(d, 'Makefile.list')))
 
 
 def files_for_selected_features(features, arch, subarch=None):
@@ -646,29 +835,28 @@ def files_for_selected_features_coreboot(features):
     to be run in a coreboot source tree.
     """
 
-    fd = NamedTemporaryFile()
-    logging.debug("dumping partial configuration with %d items to %s", len(features.items()), fd.name)
-    for (key, value) in features.items():
-        fd.write("%s=%s\n" % (key, value))
-        logging.debug("%s=%s", key, value)
-    fd.flush()
+    config = "".join("%s=%s\n" % (key, value) for (key, value) in sorted(features.items()))
 
-    # this is a pretty crude hack that runs make and examines the collected database
-    (output, _) = call_makefile_generic('DOTCONFIG=%s --print-data-base --dry-run printall' % fd.name,
-                                        failok=False, njobs=1)
-    files = set()
-    dirs = set()
-    for line in output:
-        try:
-            if line.startswith("MAKEFILE_LIST := "):
-                line = line[len("MAKEFILE_LIST := "):]
-                dirs = set([x for x in line.split() if ".inc" in x])
-            if '-objs := ' in line:                             # obj files
-                for f in line[line.find('=')+1:].split():       # skip description
-                    files.add(f)
-        except IndexError:
-            raise RuntimeError("Failed to parse line '%s'" % line)
+    # the objects and makefiles of the make database are cached per
+    # configuration and tree revision
+    db_key = coreboot_cache.cache_key("database-objects", config)
+    cached = coreboot_cache.cache.get(db_key)
+    if cached is None:
+        fd = NamedTemporaryFile()
+        logging.debug("dumping partial configuration with %d items to %s", len(features.items()), fd.name)
+        fd.write(config)
+        fd.flush()
+
+        # this is a pretty crude hack that runs make and examines the collected database
+        (output, _) = call_makefile_generic('DOTCONFIG=%s --print-data-base --dry-run printall' % fd.name,
+                                            failok=False, njobs=1)
+        db = coreboot_cache.MakeDatabase(output)
+        cached = (db.objects(), db.makefiles())
+        if cached[0]:
+            coreboot_cache.cache.put(db_key, cached)
 
+    files = set(cached[0])
+    dirs = set([x for x in cached[1] if ".inc" in x])
 
     if len(dirs) == 0 or len(files) == 0:
         sys.exit("Couldn't parse output of printall")
@@ -698,12 +886,15 @@ def files_for_selected_features_generic(features, arch, subarch):
            {'tempfile': tempfile }
 
     try:
+        # many of these run concurrently during the inference, so each
+        # uses a single job, unless a jobserver shares the processors
+        njobs = None if make_jobs.inherited_jobserver() else 1
         (make_result, _) = call_linux_makefile('list',
                                                arch=arch,
                                                subarch=subarch,
                                                failok=False,
                                                extra_variables=make_args,
-                                               njobs=1)
+                                               njobs=njobs)
     except:
         os.unlink(tempfile)
         raise
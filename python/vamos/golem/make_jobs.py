@@ -0,0 +1,252 @@
+"""golem - chooses the number of parallel jobs for make invocations"""
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import errno
+import fcntl
+import logging
+import os
+import re
+import threading
+
+
+class MakeJobTuner(object):
+    """
+    Chooses the job count (make -j) per type of make invocation
+
+    For each call type (e.g., the 'list' target or compiling a single
+    object), the tuner first tries a few job counts that fit the
+    currently idle processors, and then keeps using the one with the
+    lowest average duration. Every 'explore_interval' calls, the
+    candidates are measured again, as the load of the machine changes.
+
+    The jobs of the make processes that are still running count as busy
+    processors, so that concurrent callers do not oversubscribe the
+    machine. Every choose() must be followed by a finished().
+    """
+
+    # weight of a new measurement in the moving average
+    alpha = 0.3
+
+    def __init__(self, processors=None, explore_interval=50):
+        if processors is None:
+            processors = os.sysconf('SC_NPROCESSORS_ONLN')
+        self.processors = processors
+        self.explore_interval = explore_interval
+        self.lock = threading.Lock()
+        # call type -> {njobs: average duration}
+        self.durations = {}
+        self.calls = {}
+        # job slots used by make processes started by us
+        self.running = 0
+
+    @staticmethod
+    def call_type(target):
+        """ returns the call type for the make @target """
+        targets = target.split()
+        if not targets:
+            return "default"
+        if all(t.endswith(".o") or t.endswith(".i") or t.endswith(".s")
+               for t in targets):
+            return "object"
+        return targets[0]
+
+    @staticmethod
+    def load_average():
+        try:
+            return os.getloadavg()[0]
+        except OSError:
+            return 0.0
+
+    def idle_processors(self):
+        """ returns the number of processors neither busy with other work
+        nor with the make jobs started by us """
+        foreign = max(0.0, self.load_average() - self.running)
+        return max(1, int(self.processors - foreign - self.running + 0.5))
+
+    def candidates(self):
+        """ returns the job counts to consider, largest first """
+        idle = self.idle_processors()
+        full = int(idle * 1.20 + 0.5)
+        return sorted(set([full, max(1, idle / 2), 1]), reverse=True)
+
+    def choose(self, target):
+        """ returns the job count for the make @target, which counts as
+        running until finished() is called """
+        key = self.call_type(target)
+        with self.lock:
+            njobs = self.__choose(key, self.candidates())
+            self.running += njobs
+            return njobs
+
+    def __choose(self, key, candidates):
+        calls = self.calls.get(key, 0)
+        self.calls[key] = calls + 1
+        measured = self.durations.setdefault(key, {})
+        if calls % self.explore_interval == 0:
+            # forget old measurements that do not fit the current load
+            for njobs in measured.keys():
+                if njobs not in candidates:
+                    del measured[njobs]
+        untried = [n for n in candidates if n not in measured]
+        if untried:
+            return untried[0]
+        return min(candidates, key=lambda n: measured[n])
+
+    def record(self, target, njobs, duration):
+        """ records that make @target with @njobs jobs took @duration """
+        key = self.call_type(target)
+        with self.lock:
+            measured = self.durations.setdefault(key, {})
+            if njobs in measured:
+                measured[njobs] = (1 - self.alpha) * measured[njobs] + \
+                    self.alpha * duration
+            else:
+                measured[njobs] = duration
+        logging.debug("make %s: %d jobs took %.2fs", key, njobs, duration)
+
+    def finished(self, njobs):
+        with self.lock:
+            self.running -= njobs
+
+
+class Jobserver(object):
+    """
+    A GNU make jobserver that limits the total number of make jobs
+
+    All make processes started while the jobserver is active (including
+    those of child processes that inherit the environment and the pipe,
+    such as concurrent golem or vampyr workers) share @slots job slots.
+    make must not be called with an explicit -jN in this mode.
+
+    Each make process runs one job in its implicit slot, which is not
+    taken from the pipe. Therefore, callers acquire() a token before they
+    start make and release() it when make has finished, so that the pipe
+    accounts for the implicit slots, too.
+    """
+
+    def __init__(self, slots, fds=None):
+        """ creates a new jobserver with @slots slots, or uses the
+        (read, write) file descriptors @fds of an existing one """
+        self.slots = slots
+        self.own = fds is None
+        if fds is None:
+            (self.rfd, self.wfd) = os.pipe()
+            os.write(self.wfd, "+" * slots)
+        else:
+            (self.rfd, self.wfd) = fds
+
+    def makeflags(self):
+        """ returns the MAKEFLAGS to pass to make """
+        fds = "%d,%d" % (self.rfd, self.wfd)
+        return "-j --jobserver-fds=%s --jobserver-auth=%s" % (fds, fds)
+
+    def acquire(self):
+        """ waits for a free slot and returns its token """
+        while True:
+            try:
+                token = os.read(self.rfd, 1)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if token:
+                return token
+
+    def release(self, token):
+        os.write(self.wfd, token)
+
+    def close(self):
+        if self.own:
+            os.close(self.rfd)
+            os.close(self.wfd)
+
+
+JOBSERVER_REGEX = re.compile(r'--jobserver-(?:fds|auth)=(\S+)')
+
+tuner = MakeJobTuner()
+jobserver = None
+# MAKEFLAGS -> Jobserver of the environment, or None if it is unusable
+inherited = {}
+
+
+def enable_jobserver(slots=None):
+    """
+    starts a jobserver with @slots slots (defaults to the number of online
+    processors) and exports it in MAKEFLAGS, so that child processes
+    share it. Returns the active Jobserver.
+
+    The jobserver is also started if the environment variable
+    VAMOS_JOBSERVER is set to the number of slots.
+    """
+    global jobserver
+    if jobserver is None:
+        if slots is None:
+            slots = tuner.processors
+        jobserver = Jobserver(slots)
+        os.environ['MAKEFLAGS'] = jobserver.makeflags()
+        logging.info("Started jobserver with %d slots", slots)
+    return jobserver
+
+
+def open_jobserver(auth):
+    """ returns the file descriptors of the jobserver @auth (as given in
+    --jobserver-auth), or None if they are not open in this process """
+    if auth.startswith("fifo:"):
+        try:
+            fd = os.open(auth[len("fifo:"):], os.O_RDWR)
+        except OSError:
+            return None
+        return (fd, fd)
+    try:
+        fds = tuple(int(x) for x in auth.split(","))
+    except ValueError:
+        return None
+    if len(fds) != 2:
+        return None
+    try:
+        for fd in fds:
+            fcntl.fcntl(fd, fcntl.F_GETFD)
+    except (IOError, OSError):
+        return None
+    return fds
+
+
+def active_jobserver():
+    """ returns the Jobserver to use for make calls, or None
+
+    This is either the one of enable_jobserver(), or the one we inherited
+    from MAKEFLAGS, i.e., when running under a 'make -jN'. MAKEFLAGS may
+    be inherited without the file descriptors, which are checked. """
+    if jobserver is not None:
+        return jobserver
+    makeflags = os.environ.get('MAKEFLAGS', '')
+    if makeflags not in inherited:
+        matches = JOBSERVER_REGEX.findall(makeflags)
+        fds = open_jobserver(matches[-1]) if matches else None
+        if matches and not fds:
+            logging.debug("Ignoring jobserver %s, it is not inherited", matches[-1])
+        inherited[makeflags] = Jobserver(None, fds) if fds else None
+    return inherited[makeflags]
+
+
+def inherited_jobserver():
+    """ returns True if a usable jobserver is available, i.e., we run under
+    a 'make -jN' or enable_jobserver() was called """
+    return active_jobserver() is not None
+
+
+if os.environ.get("VAMOS_JOBSERVER") and not inherited_jobserver():
+    enable_jobserver(int(os.environ["VAMOS_JOBSERVER"]))
@@ -0,0 +1,204 @@
+"""golem - scans Kbuild makefiles for referenced Kconfig variables"""
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import atexit
+import cPickle
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+
+import vamos.golem
+from vamos.tools import get_online_processors
+
+# matches lines like:
+# obj-$(CONFIG_MODULES)           += microblaze_ksyms.o module.o
+# must not match lines like:
+# foo_CFLAGS += -DCONFIG=foo.h
+
+BUILDSYSTEM_VARIABLE_REGEX = \
+    r'(^CONFIG_|[^A-Za-z0-9_]CONFIG_)(?P<feature>[A-Za-z0-9_]+)'
+
+# names of files that the scanner considers to be makefiles
+MAKEFILE_NAMES = frozenset(["Kbuild", "Makefile", "Makefile.inc",
+                            "Kbuild.platforms", "Platform"])
+
+# below this number of modified files, scanning is done sequentially
+PARALLEL_THRESHOLD = 64
+
+
+def scan_file(path):
+    """ returns the set of Kconfig variables (without 'CONFIG_' prefix)
+    that are mentioned in the file @path """
+    features = set()
+    regex = re.compile(BUILDSYSTEM_VARIABLE_REGEX)
+    with open(path) as fd:
+        for line in fd:
+            if 'CONFIG_' not in line:
+                continue
+            for m in regex.finditer(line):
+                features.add(m.group('feature'))
+    return frozenset(features)
+
+
+class MakefileScanner(object):
+    """
+    Finds makefiles and the Kconfig variables they mention
+
+    Results are cached per file, keyed by its modification time and
+    size, and per directory, keyed by its modification time. Unchanged
+    parts of the tree are therefore neither read nor listed again; only
+    modified files are rescanned, in parallel if there are many of
+    them. If vamos.golem.cache_dir is set, the cache is kept on disk
+    across runs.
+    """
+
+    def __init__(self, basedir=".", jobs=None):
+        self.basedir = os.path.abspath(basedir)
+        self.jobs = jobs
+        # path -> (mtime, size, frozenset of variables)
+        self.files = {}
+        # path -> (mtime, subdirectories, makefiles)
+        self.dirs = {}
+        self.dirty = False
+        self.cachefile = None
+
+        if vamos.golem.cache_dir:
+            key = hashlib.sha1(self.basedir).hexdigest()[:16]
+            self.cachefile = os.path.join(vamos.golem.cache_dir,
+                                          "makefiles-%s.pickle" % key)
+            self.load()
+
+    def load(self):
+        """ reads the cache file, if present """
+        try:
+            with open(self.cachefile, "rb") as fd:
+                (self.files, self.dirs) = cPickle.load(fd)
+            logging.debug("Loaded %d cached makefiles from %s",
+                          len(self.files), self.cachefile)
+        except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+            pass
+
+    def save(self):
+        """ writes the cache file, if anything changed """
+        if not self.cachefile or not self.dirty:
+            return
+        cachedir = os.path.dirname(self.cachefile)
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        tmp = "%s.%d" % (self.cachefile, os.getpid())
+        with open(tmp, "wb") as fd:
+            cPickle.dump((self.files, self.dirs), fd, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.cachefile)
+        self.dirty = False
+
+    def path(self, path):
+        """ returns the cache key of @path """
+        return os.path.normpath(os.path.relpath(os.path.join(self.basedir, path),
+                                                self.basedir))
+
+    def list_directory(self, directory):
+        """ returns (subdirectories, makefiles) of @directory """
+        mtime = os.stat(os.path.join(self.basedir, directory)).st_mtime
+        cached = self.dirs.get(directory)
+        if cached and cached[0] == mtime:
+            return cached[1:]
+
+        subdirs = []
+        makefiles = []
+        for entry in sorted(os.listdir(os.path.join(self.basedir, directory))):
+            path = os.path.normpath(os.path.join(directory, entry))
+            fullpath = os.path.join(self.basedir, path)
+            if os.path.isdir(fullpath) and not os.path.islink(fullpath):
+                subdirs.append(path)
+            elif entry in MAKEFILE_NAMES:
+                makefiles.append(path)
+        self.dirs[directory] = (mtime, subdirs, makefiles)
+        self.dirty = True
+        return (subdirs, makefiles)
+
+    def collect(self, directory=".", names=MAKEFILE_NAMES, prune=None):
+        """
+        returns all makefiles below @directory whose name is in @names
+
+        Directories for which the function @prune returns True are not
+        descended into.
+        """
+        result = []
+        todo = [self.path(directory)]
+        while todo:
+            current = todo.pop()
+            try:
+                (subdirs, makefiles) = self.list_directory(current)
+            except OSError:
+                continue
+            result.extend(f for f in makefiles if os.path.basename(f) in names)
+            todo.extend(d for d in subdirs if not (prune and prune(d)))
+        return result
+
+    def variables(self, filenames):
+        """ returns the union of the Kconfig variables (without 'CONFIG_'
+        prefix) mentioned in @filenames """
+        ret = set()
+        modified = []
+        for filename in filenames:
+            path = self.path(filename)
+            try:
+                st = os.stat(os.path.join(self.basedir, path))
+            except OSError:
+                continue
+            cached = self.files.get(path)
+            if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+                ret |= cached[2]
+            else:
+                modified.append((path, st.st_mtime, st.st_size))
+
+        if not modified:
+            return ret
+
+        logging.debug("Scanning %d modified makefiles", len(modified))
+        paths = [os.path.join(self.basedir, path) for (path, _, _) in modified]
+        jobs = self.jobs or get_online_processors()
+        if jobs > 1 and len(modified) >= PARALLEL_THRESHOLD:
+            pool = multiprocessing.Pool(jobs)
+            try:
+                results = pool.map(scan_file, paths, max(1, len(paths) / (4 * jobs)))
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            results = [scan_file(path) for path in paths]
+
+        for ((path, mtime, size), features) in zip(modified, results):
+            self.files[path] = (mtime, size, features)
+            ret |= features
+        self.dirty = True
+        return ret
+
+
+# one scanner per source tree, shared by all callers of this process
+scanners = {}
+
+
+def get_scanner(basedir="."):
+    """ returns the MakefileScanner for the tree in @basedir, its cache is
+    saved when the process exits """
+    basedir = os.path.abspath(basedir)
+    if basedir not in scanners:
+        scanners[basedir] = MakefileScanner(basedir)
+        atexit.register(scanners[basedir].save)
+    return scanners[basedir]
@@ -0,0 +1,144 @@
+"""golem - snapshots of applied Kbuild configurations"""
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Applying a configuration with 'make silentoldconfig' regenerates
+# 'include/config/auto.conf', 'autoconf.h' and friends. The functions in
+# this module store these files in a content addressed store, keyed by
+# the hash of the '.config' file that was applied and the revision of the
+# tree, so that switching back to a known configuration only needs to
+# copy a few files.
+#
+# The files in 'include/config/' that represent single symbols only carry
+# a timestamp, which kbuild uses to decide which objects need to be
+# rebuilt. Instead of storing them, restore_snapshot() touches the files
+# of all symbols whose value differs from the previous 'auto.conf', just
+# like kconfig does.
+
+import hashlib
+import logging
+import os
+import shutil
+
+import vamos.golem
+from vamos.golem.tree_state import tree_revision
+
+AUTO_CONF = "include/config/auto.conf"
+
+
+def snapshot_key(arch, subarch, config=".config"):
+    """ returns the key for the configuration in @config, applied for
+    @arch and @subarch in the current revision of the current tree """
+    h = hashlib.sha1()
+    h.update("%s\0%s\0%s\0%s\0" % (os.getcwd(), tree_revision(), arch, subarch))
+    with open(config) as fd:
+        h.update(fd.read())
+    return h.hexdigest()
+
+
+def snapshot_path(key):
+    """ returns the directory of the snapshot @key, or None if snapshots
+    are disabled (cf. vamos.golem.snapshot_dir) """
+    if not vamos.golem.snapshot_dir:
+        return None
+    return os.path.join(vamos.golem.snapshot_dir, key[:2], key)
+
+
+def snapshot_files(autoconf_h):
+    """ returns the files that make up an applied configuration """
+    files = [".config", autoconf_h]
+    if os.path.isdir("include/config"):
+        for f in sorted(os.listdir("include/config")):
+            path = os.path.join("include/config", f)
+            if os.path.isfile(path):
+                files.append(path)
+    return files
+
+
+def save_snapshot(key, autoconf_h):
+    """ stores the currently applied configuration as snapshot @key """
+    path = snapshot_path(key)
+    if not path or os.path.isdir(path):
+        return
+
+    tmp = path + ".%d" % os.getpid()
+    for f in snapshot_files(autoconf_h):
+        target = os.path.join(tmp, f)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        shutil.copy2(f, target)
+    try:
+        os.rename(tmp, path)
+        logging.debug("Saved configuration snapshot %s", key)
+    except OSError:
+        # a concurrent process stored the same snapshot
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def read_auto_conf(path):
+    """ returns a dict that maps symbols to their values in @path """
+    symbols = {}
+    if os.path.exists(path):
+        with open(path) as fd:
+            for line in fd:
+                if line.startswith("CONFIG_") and "=" in line:
+                    (key, value) = line.rstrip("\n").split("=", 1)
+                    symbols[key] = value
+    return symbols
+
+
+def touch_changed_symbols(old, new):
+    """ touches the dependency files in 'include/config/' of all symbols
+    with different values in the dicts @old and @new """
+    for symbol in set(old.keys()) | set(new.keys()):
+        if old.get(symbol) == new.get(symbol):
+            continue
+        path = os.path.join("include/config",
+                            symbol[len("CONFIG_"):].lower().replace("_", "/") + ".h")
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "a"):
+            os.utime(path, None)
+
+
+def restore_snapshot(key):
+    """
+    restores the configuration snapshot @key into the current tree
+
+    returns False if there is no such snapshot
+    """
+    path = snapshot_path(key)
+    if not path or not os.path.isdir(path):
+        return False
+
+    old = read_auto_conf(AUTO_CONF)
+
+    # '.config' is copied first, so that the generated files are newer and
+    # kbuild does not rerun silentoldconfig
+    files = [".config"]
+    for (dirpath, _, filenames) in os.walk(path):
+        for f in filenames:
+            rel = os.path.relpath(os.path.join(dirpath, f), path)
+            if rel != ".config":
+                files.append(rel)
+
+    for f in files:
+        if os.path.dirname(f) and not os.path.isdir(os.path.dirname(f)):
+            os.makedirs(os.path.dirname(f))
+        shutil.copyfile(os.path.join(path, f), f)
+
+    touch_changed_symbols(old, read_auto_conf(AUTO_CONF))
+    logging.debug("Restored configuration snapshot %s", key)
+    return True
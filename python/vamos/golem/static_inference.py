@@ -0,0 +1,224 @@
+"""golem - infers the selections that enable files from minigolem conditions"""
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import logging
+import os
+
+from vamos.selection import Selection
+from vamos.golem.file_conditions import FileConditions
+from vamos.golem.inference import cleanup_selections
+from vamos.golem.inference_atoms import kconfig_expression
+from vamos.golem.kbuild import normalize_filename
+
+# conditions with more terms in disjunctive normal form are left to the
+# make-driven inference
+MAX_TERMS = 4096
+
+
+class ConditionTooComplex(ValueError):
+    """ raised if a condition has too many terms in disjunctive normal form """
+    pass
+
+
+def parse_condition(condition):
+    """
+    parses a minigolem @condition into a tree of tuples:
+
+        ("symbol", NAME), ("not", node), ("and", [nodes]), ("or", [nodes])
+
+    An empty condition is parsed as ("and", []), i.e., true.
+    """
+    tokens = []
+    pos = 0
+    condition = condition.strip()
+    while pos < len(condition):
+        m = FileConditions.token_re.match(condition, pos)
+        if not m:
+            raise ValueError("cannot parse condition '%s'" % condition)
+        tokens.append(m.group(1))
+        pos = m.end()
+
+    def expression(i, operator, operand):
+        (node, i) = operand(i)
+        nodes = [node]
+        while i < len(tokens) and tokens[i] == operator:
+            (node, i) = operand(i + 1)
+            nodes.append(node)
+        if len(nodes) == 1:
+            return (nodes[0], i)
+        return (("or" if operator == "||" else "and", nodes), i)
+
+    def disjunction(i):
+        return expression(i, "||", conjunction)
+
+    def conjunction(i):
+        return expression(i, "&&", factor)
+
+    def factor(i):
+        if i >= len(tokens):
+            raise ValueError("unexpected end of condition '%s'" % condition)
+        token = tokens[i]
+        if token == "!":
+            (node, i) = factor(i + 1)
+            return (("not", node), i)
+        if token == "(":
+            (node, i) = disjunction(i + 1)
+            if i >= len(tokens) or tokens[i] != ")":
+                raise ValueError("missing ')' in condition '%s'" % condition)
+            return (node, i + 1)
+        if token in ("&&", "||", ")"):
+            raise ValueError("unexpected '%s' in condition '%s'" % (token, condition))
+        return (("symbol", token), i + 1)
+
+    if not tokens:
+        return ("and", [])
+    (node, i) = disjunction(0)
+    if i != len(tokens):
+        raise ValueError("trailing tokens in condition '%s'" % condition)
+    return node
+
+
+def to_dnf(node, max_terms=MAX_TERMS, negated=False):
+    """
+    returns the disjunctive normal form of the parsed condition @node as a
+    set of (positive symbols, negative symbols) tuples of frozensets
+
+    Contradicting terms are left out, so an unsatisfiable condition
+    results in the empty set. Raises ConditionTooComplex if there are
+    more than @max_terms terms.
+    """
+    kind = node[0]
+    if kind == "symbol":
+        if negated:
+            return set([(frozenset(), frozenset([node[1]]))])
+        return set([(frozenset([node[1]]), frozenset())])
+    if kind == "not":
+        return to_dnf(node[1], max_terms, not negated)
+
+    children = [to_dnf(child, max_terms, negated) for child in node[1]]
+    if (kind == "or") != negated:
+        terms = set()
+        for child in children:
+            terms |= child
+    else:
+        terms = set([(frozenset(), frozenset())])
+        for child in children:
+            terms = set((p1 | p2, n1 | n2) for (p1, n1) in terms for (p2, n2) in child
+                        if not (p1 & n2 or p2 & n1))
+            if len(terms) > max_terms:
+                raise ConditionTooComplex("more than %d terms" % max_terms)
+    if len(terms) > max_terms:
+        raise ConditionTooComplex("more than %d terms" % max_terms)
+    return terms
+
+
+def literal(symbol):
+    """ returns the (symbol, value) tuple for a minigolem @symbol """
+    if symbol.endswith("_MODULE"):
+        return (symbol[:-len("_MODULE")], "m")
+    return (symbol, "y")
+
+
+class StaticInference(object):
+    """
+    Derives the minimal selections that enable each file from the presence
+    conditions that minigolem (i.e., kbuildparse) determines statically
+
+    Like the make-driven inference (cf. Inferencer), a selection sets
+    some symbols to 'y' or 'm' and leaves all others unset, i.e., the
+    baseline is the empty selection, regardless of the defaults that
+    allnoconfig applies to the tree. A selection enables a file if its
+    condition is true when all other symbols are false. Therefore, the
+    minimal enabling selections are exactly the minimal positive parts
+    of the consistent terms of the condition in disjunctive normal form.
+    Dropping the terms that contain another term's positive part is an
+    exact minimality check, so no SAT solver is needed.
+
+    If the tristate symbols of the model are given (cf.
+    LinuxInferenceAtoms.load_tristates), only they may be set to 'm',
+    just like in OP_domain_of_variability_intention.
+
+    Files whose condition cannot be parsed or expanded are collected in
+    'incomplete', they are left to the make-driven inference.
+    """
+
+    def __init__(self, conditions, max_terms=MAX_TERMS, directory="", tristates=None):
+        """ @conditions is a FileConditions object, only FILE_ variables
+        of files below @directory are considered """
+        self.conditions = conditions
+        self.max_terms = max_terms
+        self.tristates = tristates
+        self.prefix = "FILE_"
+        directory = os.path.normpath(directory or ".")
+        if directory != ".":
+            self.prefix += normalize_filename(directory + "/")
+        # FILE_ variable -> list of minimal selections
+        self.selections = {}
+        self.incomplete = set()
+        self.unsatisfiable = set()
+
+    def possible(self, symbol, positive):
+        """ returns False if @symbol cannot be set together with the other
+        symbols of the term @positive """
+        (name, value) = literal(symbol)
+        if value != "m":
+            return True
+        # a tristate symbol cannot be 'y' and 'm' at the same time
+        if name in positive:
+            return False
+        return self.tristates is None or name in self.tristates
+
+    def enabling_selections(self, condition):
+        """ returns the minimal selections that fulfill @condition, the
+        empty list if it is fulfilled without selecting anything, and
+        None if it cannot be fulfilled """
+        positives = set()
+        for (positive, _) in to_dnf(parse_condition(condition), self.max_terms):
+            if all(self.possible(x, positive) for x in positive):
+                positives.add(positive)
+        if not positives:
+            return None
+        if frozenset() in positives:
+            return []
+        selections = [Selection([[literal(x)] for x in positive])
+                      for positive in positives]
+        return cleanup_selections(selections)[0]
+
+    def calculate(self):
+        for (var, condition) in self.conditions.conditions.items():
+            if not var.startswith(self.prefix):
+                continue
+            try:
+                selections = self.enabling_selections(condition)
+            except ValueError as e:
+                logging.info("Leaving %s to make: %s", var, e)
+                self.incomplete.add(var)
+                continue
+            if selections is None:
+                logging.debug("%s is never compiled", var)
+                self.unsatisfiable.add(var)
+            else:
+                self.selections[var] = selections
+        logging.info("Static inference: %d files, %d left to make, %d never compiled",
+                     len(self.selections), len(self.incomplete), len(self.unsatisfiable))
+
+    def print_results(self):
+        """ prints the results like 'golem -i' does """
+        for var in sorted(self.selections):
+            if self.selections[var]:
+                print '%s "%s"' % (var, kconfig_expression(self.selections[var]))
+            else:
+                print var
@@ -0,0 +1,271 @@
+"""golem - cached metadata of a source tree"""
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import cPickle
+import collections
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+import vamos.golem
+from vamos.tools import execute
+
+# files whose changes invalidate results cached per tree_revision()
+BUILDSYSTEM_FILES = ("Makefile", "Kbuild", "Kconfig")
+
+# the state is discarded if one of these top-level entries changes
+VALIDATED_FILES = ("Makefile", "Kbuild", "Makefile.inc", "arch")
+
+
+def from_json(value):
+    """ converts the unicode strings returned by json.load() to str """
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, list):
+        return [from_json(x) for x in value]
+    if isinstance(value, dict):
+        return dict((from_json(k), from_json(v)) for (k, v) in value.items())
+    return value
+
+
+class TreeState(object):
+    """
+    Small key/value store for metadata of a source tree (buildsystem
+    type, location of autoconf.h, list of architectures, ...)
+
+    The values are kept in a state file in the 'trees' subdirectory of
+    vamos.golem.cache_dir (named after the absolute path of the tree),
+    together with the modification times of the top-level makefiles and
+    directories. If any of them changed, the state is discarded. Without
+    a cache directory, the state is not kept across runs.
+    """
+
+    def __init__(self, basedir="."):
+        self.basedir = os.path.abspath(basedir)
+        self.path = None
+        if vamos.golem.cache_dir:
+            self.path = os.path.join(vamos.golem.cache_dir, "trees",
+                                     hashlib.sha1(self.basedir).hexdigest() + ".json")
+        self.stamp = self.current_stamp()
+        self.values = {}
+        self.load()
+
+    def current_stamp(self):
+        """ returns the modification times of VALIDATED_FILES """
+        stamp = {}
+        for f in VALIDATED_FILES:
+            try:
+                stamp[f] = os.stat(os.path.join(self.basedir, f)).st_mtime
+            except OSError:
+                stamp[f] = None
+        return stamp
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path) as fd:
+                state = from_json(json.load(fd))
+        except (IOError, ValueError):
+            return
+        if isinstance(state, dict) and state.get("stamp") == self.stamp:
+            self.values = state.get("values", {})
+        else:
+            logging.debug("Discarding outdated tree state %s", self.path)
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = "%s.%d" % (self.path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(tmp, "w") as fd:
+                json.dump({"stamp": self.stamp, "values": self.values}, fd)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            logging.debug("Failed to write tree state %s: %s", self.path, e)
+
+    def get(self, key, compute, valid=None):
+        """
+        returns the cached value for @key, or calls @compute() to
+        determine and store it
+
+        The optional function @valid is called with a cached value and
+        may return False to force recomputation.
+        """
+        if key in self.values:
+            value = self.values[key]
+            if valid is None or valid(value):
+                return value
+        value = compute()
+        self.values[key] = value
+        self.save()
+        return value
+
+    def invalidate(self, key=None):
+        """ drops the value for @key, or all values if @key is None """
+        if key is None:
+            self.values = {}
+        else:
+            self.values.pop(key, None)
+        self.save()
+
+
+# absolute path of a tree -> its tree_revision()
+revisions = {}
+
+
+def is_buildsystem_file(name):
+    """ tests if @name is a makefile or a Kconfig file """
+    return name.startswith(BUILDSYSTEM_FILES)
+
+
+def buildsystem_stamp(paths):
+    """ returns a hash of the names, sizes and modification times of the
+    buildsystem files in @paths """
+    h = hashlib.sha1()
+    for path in sorted(paths):
+        if not is_buildsystem_file(os.path.basename(path)):
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        h.update("%s\0%d\0%s\0" % (path, st.st_size, st.st_mtime))
+    return h.hexdigest()
+
+
+def tree_revision():
+    """
+    returns an identifier for the revision of the current tree, which
+    changes whenever a makefile or Kconfig file changes
+
+    In a git checkout, it is the commit, together with a hash of the diff
+    against HEAD, the status and the untracked buildsystem files. Otherwise,
+    it is a hash of all buildsystem files in the tree. The revision is
+    determined once per process and working directory.
+    """
+    cwd = os.getcwd()
+    revision = revisions.get(cwd)
+    if revision is None:
+        (output, rc) = execute("git rev-parse HEAD", echo=False, failok=True)
+        if rc == 0 and output and re.match("^[0-9a-f]{40}$", output[0]):
+            revision = output[0]
+            (diff, rc) = execute("git diff HEAD", echo=False, failok=True)
+            (status, rc2) = execute("git status --porcelain --untracked-files=all",
+                                    echo=False, failok=True)
+            if rc == 0 and rc2 == 0 and (diff != [""] or status != [""]):
+                untracked = [x[3:] for x in status if x.startswith("?? ")]
+                h = hashlib.sha1("\n".join(diff + status))
+                h.update(buildsystem_stamp(untracked))
+                revision += "-" + h.hexdigest()
+        else:
+            paths = []
+            for (root, dirs, files) in os.walk("."):
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                paths.extend(os.path.join(root, f) for f in files
+                             if is_buildsystem_file(f))
+            revision = "stamp-" + buildsystem_stamp(paths)
+        revisions[cwd] = revision
+    return revision
+
+
+def cache_key(*parts):
+    """ returns a key for @parts and the current tree revision """
+    h = hashlib.sha1()
+    for part in parts + (os.getcwd(), tree_revision()):
+        h.update(str(part) + "\0")
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Caches results per key, usually made with cache_key()
+
+    The @size most recently used results are kept in memory and, if
+    vamos.golem.cache_dir is set, all results in its subdirectory @name.
+    Failures to write the cache directory are logged, but not fatal.
+    """
+
+    def __init__(self, name, size=1000):
+        self.name = name
+        self.size = size
+        self.lock = threading.Lock()
+        # key -> result, the least recently used first
+        self.results = collections.OrderedDict()
+
+    def directory(self):
+        if not vamos.golem.cache_dir:
+            return None
+        return os.path.join(vamos.golem.cache_dir, self.name)
+
+    def __remember(self, key, result):
+        """ keeps @result in memory, drops the least recently used ones """
+        with self.lock:
+            self.results.pop(key, None)
+            self.results[key] = result
+            while len(self.results) > self.size:
+                self.results.popitem(last=False)
+
+    def get(self, key):
+        """ returns the cached result for @key, or None """
+        with self.lock:
+            if key in self.results:
+                result = self.results.pop(key)
+                self.results[key] = result
+                return result
+        directory = self.directory()
+        if directory:
+            try:
+                with open(os.path.join(directory, key + ".pickle"), "rb") as fd:
+                    result = cPickle.load(fd)
+            except (IOError, OSError, EOFError, ValueError, cPickle.UnpicklingError):
+                return None
+            self.__remember(key, result)
+            return result
+        return None
+
+    def put(self, key, result):
+        self.__remember(key, result)
+        directory = self.directory()
+        if not directory:
+            return
+        path = os.path.join(directory, key + ".pickle")
+        tmp = "%s.%d" % (path, os.getpid())
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(tmp, "wb") as fd:
+                cPickle.dump(result, fd, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+        except (IOError, OSError) as e:
+            logging.warning("Failed to write %s to the cache: %s", path, e)
+
+
+# one TreeState per source tree
+states = {}
+
+
+def get_tree_state(basedir="."):
+    """ returns the TreeState for the tree in @basedir """
+    basedir = os.path.abspath(basedir)
+    if basedir not in states:
+        states[basedir] = TreeState(basedir)
+    return states[basedir]
@@ -16,11 +16,15 @@
 # You should have received a copy of the GNU General Public License along with
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import glob
 import logging as log
+import multiprocessing
+import os
 import re
 import subprocess
 
 from vamos.rsf2model import tools as rsftools
+from vamos.rsf2model.RsfReader import RsfReader
 
 
 def logically_equivalent(formula_a, formula_b):
@@ -32,6 +36,9 @@ def logically_equivalent(formula_a, formula_b):
     if not formula_a or not formula_b:
         # If one formula is empty return False
         return False
+    if formula_a == formula_b:
+        # Identical formulas do not need to be checked by limboole
+        return True
 
     # Substitute all "CHOICE_*" symbols with "__CHOICE"
     regex = re.compile(r"\bCHOICE_[\d]+\b")
@@ -66,6 +73,44 @@ def get_symbols(formula):
     return set(symbols)
 
 
+def get_symbol_signature(rsf, symbol):
+    """ Return a hashable signature of all attributes of @symbol in @rsf that
+    are considered by RsfDiff.diff_symbol(). """
+    return (rsf.get_type(symbol),
+            rsf.get_prompts(symbol),
+            rsf.get_depends(symbol),
+            tuple([tuple(x) for x in rsf.get_selects(symbol)]),
+            tuple([tuple(x) for x in rsf.get_defaults(symbol)]))
+
+
+def partition_symbols(symbols, count):
+    """ Partition the sorted list @symbols into at most @count shards.  Symbols
+    are dealt round-robin, so that shards of neighbouring (and often similarly
+    complex) symbols are spread evenly across all shards. """
+    count = max(1, min(count, len(symbols)))
+    return [symbols[i::count] for i in range(count)]
+
+
+# RSF readers of the parent process, inherited by the worker processes of a
+# sharded diff (see RsfDiff.diff())
+_SHARD_MODELS = None
+
+
+def _init_shard_worker(rsf_a, rsf_b):
+    """ Initializer of the worker processes of a sharded diff. """
+    global _SHARD_MODELS
+    _SHARD_MODELS = (rsf_a, rsf_b)
+
+
+def _diff_shard(symbols):
+    """ Diff the @symbols that are defined in both models of the current worker
+    process and return the resulting changes. """
+    diff = RsfDiff(_SHARD_MODELS[0], _SHARD_MODELS[1])
+    for symbol in symbols:
+        diff.diff_symbol(symbol)
+    return diff.changes
+
+
 class RsfDiff(object):
     """ Diff two RSF models. """
 
@@ -79,55 +124,73 @@ class RsfDiff(object):
         if debug:
             log.basicConfig(level=log.DEBUG)
 
-    def diff(self):
-        """ Diff the models. """
+    def diff(self, jobs=1, shards=None):
+        """ Diff the models.  If @jobs is greater than 1, the symbols defined in
+        both models are partitioned into @shards shards (default: 4 * @jobs),
+        which are diffed in a pool of @jobs processes.  The results of all
+        shards are merged in shard order, so the resulting changes do not
+        depend on the number of jobs. """
         # First collect a set of symbols of both rsf files
-        symbols_a = self.rsf_a.database.get('Item')
-        symbols_a.extend(self.rsf_a.database.get('ChoiceItem'))
-        symbols_a = set([x[0] for x in symbols_a])
+        symbols_a = set(self.rsf_a.get_defined_symbols())
+        symbols_b = set(self.rsf_b.get_defined_symbols())
+
+        # Symbols removed?
+        for symbol in sorted(symbols_a - symbols_b):
+            log.debug("Symbol removed: %s", symbol)
+            self.changes["REM_" + symbol] = None
 
-        symbols_b = self.rsf_b.database.get('Item')
-        symbols_b.extend(self.rsf_b.database.get('ChoiceItem'))
-        symbols_b = set([x[0] for x in symbols_b])
+        # Symbols added?
+        for symbol in sorted(symbols_b - symbols_a):
+            log.debug("Symbol added: %s", symbol)
+            self.changes["ADD_" + symbol] = None
 
-        all_symbols = sorted(symbols_a | symbols_b)
+        common_symbols = sorted(symbols_a & symbols_b)
 
         # Diff both rsf models symbol-wise
-        for symbol in all_symbols:
-            in_a, in_b = False, False
-            if symbol in symbols_a:
-                in_a = True
-            if symbol in symbols_b:
-                in_b = True
-
-            # Symbol removed?
-            if in_a and not in_b:
-                log.debug("Symbol removed: %s", symbol)
-                self.changes["REM_" + symbol] = None
-                continue
-            # Symbol added?
-            elif not in_a and in_b:
-                log.debug("Symbol added: %s", symbol)
-                self.changes["ADD_" + symbol] = None
-                continue
+        if jobs <= 1:
+            for symbol in common_symbols:
+                self.diff_symbol(symbol)
+            return
+
+        if not shards:
+            shards = 4 * jobs
+        shards = partition_symbols(common_symbols, shards)
+        log.debug("Diffing %d symbols in %d shards with %d jobs",
+                  len(common_symbols), len(shards), jobs)
+
+        pool = multiprocessing.Pool(jobs, _init_shard_worker,
+                                    (self.rsf_a, self.rsf_b))
+        try:
+            results = pool.map(_diff_shard, shards)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
 
-            self.changes["MOD_" + symbol] = {}
+        for changes in results:
+            self.changes.update(changes)
 
-            # Attribute changed?
-            self.diff_attribute(symbol)
+    def diff_symbol(self, symbol):
+        """ Diff @symbol, which must be defined in both models. """
+        self.changes["MOD_" + symbol] = {}
 
-            # Dependency changed?
-            self.diff_depends(symbol)
+        # Attribute changed?
+        self.diff_attribute(symbol)
 
-            # Default changed?
-            self.diff_defaults(symbol)
+        # Dependency changed?
+        self.diff_depends(symbol)
 
-            # Select changed?
-            self.diff_selects(symbol)
+        # Default changed?
+        self.diff_defaults(symbol)
 
-            # Delete the "MOD_*" entry if nothing has been modified
-            if not self.changes["MOD_" + symbol]:
-                del self.changes["MOD_" + symbol]
+        # Select changed?
+        self.diff_selects(symbol)
+
+        # Delete the "MOD_*" entry if nothing has been modified
+        if not self.changes["MOD_" + symbol]:
+            del self.changes["MOD_" + symbol]
 
     @rsftools.memoized
     def get_added_features(self):
@@ -394,3 +457,100 @@ class RsfDiff(object):
             del mod["MOD_DEFAULTS"]
         if mod:
             self.changes["MOD_" + symbol].update(mod)
+
+
+class MultiArchRsfDiff(object):
+    """ Diff the RSF models of several architectures at once.  Most symbols
+    are defined identically across architectures, so each distinct change is
+    computed only once and shared by all architectures it affects. """
+
+    def __init__(self, rsfs, debug=False):
+        """ Diff the models in @rsfs, a dictionary {arch: (rsf_a, rsf_b)}.  Set
+        @debug to True to get (verbose) logging output. """
+        self.rsfs = rsfs
+        self.changes = {}  # {arch: changes as in RsfDiff.changes}
+        # {(symbol, signature_a, signature_b): "MOD_*" entry or None}
+        self.symbol_table = {}
+        self.reused = 0
+
+        if debug:
+            log.basicConfig(level=log.DEBUG)
+
+    @classmethod
+    def from_directories(cls, dir_a, dir_b, archs=None, debug=False):
+        """ Load "$arch.rsf" files (as written by undertaker-kconfigdump) of all
+        @archs from @dir_a and @dir_b.  If @archs is not specified, all
+        architectures with an RSF file in both directories are loaded. """
+        if archs is None:
+            archs = set(os.path.basename(x)[:-len(".rsf")]
+                        for x in glob.glob(os.path.join(dir_a, "*.rsf")))
+            archs = [x for x in sorted(archs)
+                     if os.path.exists(os.path.join(dir_b, x + ".rsf"))]
+
+        rsfs = {}
+        for arch in archs:
+            with open(os.path.join(dir_a, arch + ".rsf")) as fd_a:
+                with open(os.path.join(dir_b, arch + ".rsf")) as fd_b:
+                    rsfs[arch] = (RsfReader(fd_a), RsfReader(fd_b))
+        return cls(rsfs, debug)
+
+    def diff(self):
+        """ Diff the models of all architectures. """
+        for arch in sorted(self.rsfs):
+            (rsf_a, rsf_b) = self.rsfs[arch]
+            diff = RsfDiff(rsf_a, rsf_b)
+            changes = {}
+
+            symbols_a = set(rsf_a.get_defined_symbols())
+            symbols_b = set(rsf_b.get_defined_symbols())
+
+            for symbol in symbols_a - symbols_b:
+                changes["REM_" + symbol] = None
+            for symbol in symbols_b - symbols_a:
+                changes["ADD_" + symbol] = None
+
+            for symbol in sorted(symbols_a & symbols_b):
+                key = (symbol,
+                       get_symbol_signature(rsf_a, symbol),
+                       get_symbol_signature(rsf_b, symbol))
+                if key in self.symbol_table:
+                    self.reused += 1
+                else:
+                    diff.changes = {}
+                    diff.diff_symbol(symbol)
+                    self.symbol_table[key] = diff.changes.get("MOD_" + symbol)
+
+                if self.symbol_table[key]:
+                    changes["MOD_" + symbol] = self.symbol_table[key]
+
+            log.debug("%s: %d changes", arch, len(changes))
+            self.changes[arch] = changes
+
+        log.debug("Diffed %d distinct symbol definitions, reused %d results",
+                  len(self.symbol_table), self.reused)
+
+    def get_affected_archs(self, key):
+        """ Return a sorted list of architectures whose diff contains the
+        change @key (e.g., "MOD_FOO").  Must be called after diff(). """
+        return sorted([x for x in self.changes if key in self.changes[x]])
+
+    def get_distinct_changes(self):
+        """ Return a sorted list of (key, change, archs) tuples, one for each
+        distinct change, with @archs being the sorted list of architectures the
+        change affects.  Must be called after diff(). """
+        distinct = {}
+        for arch in sorted(self.changes):
+            for (key, change) in self.changes[arch].items():
+                entries = distinct.setdefault(key, [])
+                for (other, archs) in entries:
+                    if other == change:
+                        archs.append(arch)
+                        break
+                else:
+                    entries.append((change, [arch]))
+
+        ret = []
+        for key in sorted(distinct):
+            for (change, archs) in distinct[key]:
+                ret.append((key, change, archs))
+        return ret
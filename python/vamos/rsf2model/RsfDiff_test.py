@@ -19,7 +19,7 @@
 import unittest2 as t
 import StringIO
 
-from vamos.rsf2model.RsfDiff import RsfDiff
+from vamos.rsf2model.RsfDiff import RsfDiff, MultiArchRsfDiff, partition_symbols
 from vamos.rsf2model.RsfReader import RsfReader
 
 class TestDiff(t.TestCase):
@@ -365,5 +365,124 @@ Depends MOD_ME_1    "BAR || FOO"
         self.assertEqual(["ABC_1", "BAR_2", "FOO_1", "FOO_2", "MOD_ME_1"], diff.get_changed_features())
 
 
+    def test_sharded_diff(self):
+        """ Diff in a pool of processes.  The symbols defined in both models are
+        partitioned into shards, whose results are merged into the same
+        diff.changes a sequential diff computes. """
+
+        rsf_a = \
+"""
+Item        64BIT   tristate
+HasPrompts  64BIT   1
+Item        X86_64  boolean
+Depends     X86_64  "64BIT"
+Item        FOO     boolean
+HasPrompts  FOO     0
+Item        BAR     boolean
+Item        OLD     boolean
+"""
+        rsf_b = \
+"""
+Item        64BIT   boolean
+HasPrompts  64BIT   1
+Item        X86_64  boolean
+Depends     X86_64  "!32BIT && HURZ"
+Item        FOO     boolean
+HasPrompts  FOO     1
+Item        BAR     boolean
+Item        NEW     boolean
+"""
+
+        sequential = RsfDiff(RsfReader(StringIO.StringIO(rsf_a)),
+                             RsfReader(StringIO.StringIO(rsf_b)))
+        sequential.diff()
+
+        for jobs, shards in [(2, None), (3, 2), (2, 100)]:
+            sharded = RsfDiff(RsfReader(StringIO.StringIO(rsf_a)),
+                              RsfReader(StringIO.StringIO(rsf_b)))
+            sharded.diff(jobs=jobs, shards=shards)
+            self.assertEqual(sequential.changes, sharded.changes)
+
+        self.assertEqual(["NEW"], sharded.get_added_features())
+        self.assertEqual(["OLD"], sharded.get_removed_features())
+        self.assertEqual(["64BIT", "FOO", "X86_64"], sharded.get_modified_features())
+
+
+    def test_partition_symbols(self):
+        """ Symbols are dealt round-robin into at most as many shards as there
+        are symbols. """
+        symbols = ["A", "B", "C", "D", "E"]
+        self.assertEqual([["A", "C", "E"], ["B", "D"]],
+                         partition_symbols(symbols, 2))
+        self.assertEqual([["A"], ["B"], ["C"], ["D"], ["E"]],
+                         partition_symbols(symbols, 10))
+        self.assertEqual([symbols], partition_symbols(symbols, 0))
+
+
+    def test_multi_arch_diff(self):
+        """ Diff the models of several architectures at once.  Identical changes
+        are computed only once and reported with all affected architectures. """
+
+        rsf_a = \
+"""
+Item        FOO     boolean
+HasPrompts  FOO     0
+Item        BAR     boolean
+Depends     BAR     "X86"
+Item        OLD     boolean
+"""
+        rsf_b = \
+"""
+Item        FOO     boolean
+HasPrompts  FOO     1
+Item        BAR     boolean
+Depends     BAR     "X86 && PCI"
+"""
+        rsf_arm_a = \
+"""
+Item        FOO     boolean
+HasPrompts  FOO     0
+Item        BAR     boolean
+Depends     BAR     "ARM"
+"""
+        rsf_arm_b = \
+"""
+Item        FOO     boolean
+HasPrompts  FOO     1
+Item        BAR     boolean
+Depends     BAR     "ARM"
+"""
+
+        rsfs = {}
+        for arch in ["x86", "mips"]:
+            rsfs[arch] = (RsfReader(StringIO.StringIO(rsf_a)),
+                          RsfReader(StringIO.StringIO(rsf_b)))
+        rsfs["arm"] = (RsfReader(StringIO.StringIO(rsf_arm_a)),
+                       RsfReader(StringIO.StringIO(rsf_arm_b)))
+
+        diff = MultiArchRsfDiff(rsfs)
+        diff.diff()
+
+# FOO is identical on all architectures, BAR differs on arm
+        self.assertEqual(3, len(diff.symbol_table))
+        self.assertEqual(3, diff.reused)
+
+        for arch in ["arm", "mips", "x86"]:
+            single = RsfDiff(rsfs[arch][0], rsfs[arch][1])
+            single.diff()
+            self.assertEqual(single.changes, diff.changes[arch])
+
+        self.assertEqual(["arm", "mips", "x86"], diff.get_affected_archs("MOD_FOO"))
+        self.assertEqual(["mips", "x86"], diff.get_affected_archs("MOD_BAR"))
+        self.assertEqual(["mips", "x86"], diff.get_affected_archs("REM_OLD"))
+
+        self.assertEqual([("MOD_BAR", {"MOD_DEPENDS": {"ADD_REFERENCES": ["PCI"]}},
+                           ["mips", "x86"]),
+                          ("MOD_FOO", {"ADD_PROMPT": ["0", "1"]},
+                           ["arm", "mips", "x86"]),
+                          ("REM_OLD", None, ["mips", "x86"])],
+                         diff.get_distinct_changes())
+
+
 if __name__ == '__main__':
     t.main()
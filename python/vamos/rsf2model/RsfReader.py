@@ -128,8 +128,7 @@ class RsfReader:
     def get_defined_symbols(self):
         """ Return all defined symbols as a list.  Note that the list may
         include duplicates. """
-        symbols = self.database.get('Item')
-        symbols.extend(self.database.get('ChoiceItem'))
+        symbols = self.database.get('Item') + self.database.get('ChoiceItem')
         return [x[0] for x in symbols]
 
     def is_defined(self, symbol):
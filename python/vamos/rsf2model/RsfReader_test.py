@@ -53,6 +53,12 @@ CRAP CARASDD"""
                 opts.add("S")
                 self.assertEqual(opt.string(), True, "Item state wrong")
 
+    def test_defined_symbols(self):
+        symbols = self.rsf.get_defined_symbols()
+        self.assertEqual(sorted(symbols), ["A", "B", "C", "H", "S"])
+        # the database is not modified
+        self.assertEqual(self.rsf.get_defined_symbols(), symbols)
+
     def test_symbol_generation(self):
         self.assertEqual(self.rsf.options()["A"].symbol(), "CONFIG_A")
         self.assertRaises(RsfReader.OptionNotTristate, self.rsf.options()["A"].symbol_module)
@@ -19,56 +19,69 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import copy
-
 
 def unique(seq):
-    # order preserving
+    # order preserving, the items must be hashable
+    seen = set()
     noDupes = []
-    _ = [noDupes.append(i) for i in seq if not noDupes.count(i)]
+    for i in seq:
+        if i not in seen:
+            seen.add(i)
+            noDupes.append(i)
     return noDupes
 
-class Selection:
-    """A selection is a selection of symbols (derived from kconfig features). """
+class Selection(object):
+    """A selection is a selection of symbols (derived from kconfig features).
+
+    Selections are immutable: the expression is a frozenset of
+    or-expressions, each a frozenset of (symbol, value) tuples. Hence,
+    selections can be compared and hashed cheaply, and are shared
+    instead of copied."""
+
+    __slots__ = ("expr", "symbols", "hash", "string")
 
     def __init__(self, other_selection = None):
-        """A selection can be empty, or can be copied from another
-        selection. So this is somewhat like a copy constructor in c++.
+        """A selection can be empty, or can be created from another
+        selection or expression.
 
         other_selection == None: empty selection
-        other_selection == [{},{}]: selection from tuple
-        other_selection == Selection(..): copy selection from other selection"""
+        other_selection == [[],[]]: selection from a list of or_expressions,
+                                    each a list of (symbol, value) tuples
+        other_selection == Selection(..): same selection as the other one"""
 
         # expr == (SYMBOL || SYMBOL) && (SYMBOL || SYMBOL)
         # inner sets: alternatives
-        # outer list: conjugations
+        # outer set: conjugations
 
-        self.expr = []
+        if other_selection is None:
+            expr = frozenset()
+        elif isinstance(other_selection, Selection):
+            expr = other_selection.expr
+        else:
+            expr = frozenset(frozenset(or_expr) for or_expr in other_selection
+                             if or_expr)
+        object.__setattr__(self, "expr", expr)
 
         # All mentioned symbols in this selection
-        self.symbols = set([])
-
-        if other_selection:
-            # Copy the other expression
-            if type(other_selection) == list:
-                self.expr = copy.deepcopy(other_selection)
-            else:
-                self.expr = copy.deepcopy(other_selection.expr)
-
-        for or_expr in self.expr:
-            for symbol in or_expr:
-                self.symbols.add(symbol[0])
+        object.__setattr__(self, "symbols",
+                           frozenset(symbol for or_expr in expr for (symbol, _) in or_expr))
+        object.__setattr__(self, "hash", hash(expr))
+        object.__setattr__(self, "string", None)
 
-    def push_down(self):
-        """Add a new level of or_expressions to the conjugation"""
-        self.expr.append([])
+    def __setattr__(self, name, value):
+        raise AttributeError("Selection objects are immutable")
 
+    def __getstate__(self):
+        return [list(or_expr) for or_expr in self.expr]
 
-    def add_alternative(self, alternative, value):
-        """Add an alternative to the current "top of stack" or expression"""
-        self.expr[-1].append((alternative, value))
-        self.symbols.add(alternative)
+    def __setstate__(self, state):
+        Selection.__init__(self, state)
 
+    def extend(self, *or_exprs):
+        """Returns a new selection with the additional or_expressions,
+        each an iterable of (symbol, value) tuples"""
+        return Selection(self.expr.union(frozenset(or_expr) for or_expr in or_exprs
+                                         if or_expr))
 
     def feature_in_selection(self, feature):
         """ Tests if feature ({,_MODULE}) is already in this selection"""
@@ -80,28 +93,32 @@ class Selection:
     def __str__(self):
         """Format the selection to a (normalized) propositional formula
         (return-type: string)"""
+        if self.string is not None:
+            return self.string
         or_exprs = []
         for or_expr in self.expr:
-            if len(or_expr) == 0:
-                continue
             features = sorted(["%s=%s" % x for x in or_expr])
             if len(or_expr) == 1:
                 or_exprs.append(features[0])
             else:
                 or_exprs.append("(" + " || ".join(features) + ")")
 
-        if len(or_exprs) > 0:
-            return " && ".join(sorted(or_exprs))
-        else:
-            return ""
+        string = " && ".join(sorted(or_exprs))
+        object.__setattr__(self, "string", string)
+        return string
 
     __repr__ = __str__
 
     def __hash__(self):
-        return hash(str(self))
+        return self.hash
 
     def __eq__(self, other):
-        return str(self) == str(other)
+        if not isinstance(other, Selection):
+            return False
+        return self.hash == other.hash and self.expr == other.expr
+
+    def __ne__(self, other):
+        return not self == other
 
     def to_dict(self):
         ret = {}
@@ -113,23 +130,8 @@ class Selection:
     def better_than(self, other_selection):
         """One Selection is better than another if it is a subset of
         the other (and if it is shorter)"""
-        if len(self.expr) < len(other_selection.expr):
-            # When our expression is shorter we can test if our
-            # expression is a subset of the other expression
-
-            # This means all our expressions are within the other
-            # expression
-            for or_expr in self.expr:
-                within = False
-                for or_expr_1 in other_selection.expr:
-                    if set(or_expr_1) == set(or_expr):
-                        within = True
-                if within == False:
-                    return False
-            return True
-        else:
-            return False
-
+        return len(self.expr) < len(other_selection.expr) \
+            and self.expr < other_selection.expr
 
     def merge(self, other):
         """Expressions can be merged into one selection if they differ
@@ -137,31 +139,106 @@ class Selection:
         if len(self.expr) != len(other.expr):
             return None
 
-        new_expr = []
-        differences = 0
-        different_or_expr = []
+        different = self.expr ^ other.expr
+        if not different:
+            return self
+        # both have the same length, so each has one of the differences
+        if len(different) > 2:
+            return None
+
+        return Selection((self.expr & other.expr)
+                         | frozenset([frozenset().union(*different)]))
 
-        for or_expr in self.expr:
-            within = False
-            for or_expr_1 in other.expr:
-                if set(or_expr_1) == set(or_expr):
-                    new_expr.append(or_expr)
-                    within = True
-            if not within:
-                differences += 1
-                different_or_expr = unique(different_or_expr + or_expr)
-            if differences > 1:
-                return None
-
-
-        for or_expr in other.expr:
-            within = False
-            for or_expr_1 in self.expr:
-                if set(or_expr_1) == set(or_expr):
-                    within = True
-            if not within:
-                different_or_expr = unique(different_or_expr + or_expr)
-
-        new_expr.append(different_or_expr)
-
-        return Selection(new_expr)
+
+class SelectionIndex(object):
+    """Finds better and mergeable selections without comparing all pairs
+
+    Each selection is indexed by its or_expressions, to find the
+    selections that contain all or_expressions of another one, and by its
+    expression without each of its or_expressions, to find selections
+    that differ in exactly one or_expression (cf. merge()).
+
+    'comparisons' counts the selections that were looked at."""
+
+    EMPTY = Selection()
+
+    def __init__(self, selections=()):
+        self.selections = set()
+        # or_expr -> selections that contain it
+        self.by_or_expr = {}
+        # expr without one or_expr -> selections
+        self.by_rest = {}
+        self.comparisons = 0
+        for selection in selections:
+            self.add(selection)
+
+    def __contains__(self, selection):
+        return selection in self.selections
+
+    def __len__(self):
+        return len(self.selections)
+
+    def __iter__(self):
+        return iter(self.selections)
+
+    def add(self, selection):
+        if selection in self.selections:
+            return
+        self.selections.add(selection)
+        for or_expr in selection.expr:
+            self.by_or_expr.setdefault(or_expr, set()).add(selection)
+            rest = selection.expr - frozenset([or_expr])
+            self.by_rest.setdefault(rest, set()).add(selection)
+
+    def remove(self, selection):
+        if selection not in self.selections:
+            return
+        self.selections.remove(selection)
+        for or_expr in selection.expr:
+            self.__discard(self.by_or_expr, or_expr, selection)
+            self.__discard(self.by_rest, selection.expr - frozenset([or_expr]), selection)
+
+    @staticmethod
+    def __discard(index, key, selection):
+        entries = index[key]
+        entries.discard(selection)
+        if not entries:
+            del index[key]
+
+    def worse_than(self, selection):
+        """Returns the indexed selections that selection is better_than"""
+        if not selection.expr:
+            self.comparisons += len(self.selections)
+            return set([x for x in self.selections if x.expr])
+        postings = sorted([self.by_or_expr.get(or_expr, set()) for or_expr in selection.expr],
+                          key=len)
+        candidates = set(postings[0])
+        self.comparisons += len(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates &= posting
+            self.comparisons += len(candidates)
+        return set([x for x in candidates if len(x) > len(selection)])
+
+    def has_better(self, selection):
+        """Tests if any indexed selection is better_than selection"""
+        if selection.expr and self.EMPTY in self.selections:
+            return True
+        matches = {}
+        for or_expr in selection.expr:
+            for x in self.by_or_expr.get(or_expr, ()):
+                matches[x] = matches.get(x, 0) + 1
+        self.comparisons += len(matches)
+        return any([n == len(x) and n < len(selection) for (x, n) in matches.items()])
+
+    def mergeable(self, selection):
+        """Returns the other indexed selections that can be merged with
+        selection"""
+        ret = set()
+        for or_expr in selection.expr:
+            for x in self.by_rest.get(selection.expr - frozenset([or_expr]), ()):
+                self.comparisons += 1
+                if x != selection:
+                    ret.add(x)
+        return ret
@@ -20,10 +20,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import atexit
+import errno
+import json
 import re
 import os
 import logging
+import Queue
+import select
 import shutil
+import sys
+import threading
+import time
+from collections import deque
 from subprocess import *
 
 
@@ -47,6 +56,168 @@ class CommandFailed(RuntimeError):
         return self.repr
 
 
+class CommandTimedOut(CommandFailed):
+    """ Indicates that some command was killed after exceeding its timeout
+
+    Attributes:
+        timeout    -- the timeout in seconds
+    """
+    def __init__(self, command, returncode, stdout, timeout):
+        CommandFailed.__init__(self, command, returncode, stdout)
+        self.timeout = timeout
+        self.repr = "Command %s timed out after %.1f seconds" % \
+            (command, timeout)
+
+
+class CommandAccounting(object):
+    """ Records the resource usage of all commands run by this module
+
+    For each command, the command class (i.e., the name of the executed
+    program), wall time, CPU time (as reported by os.wait4()), bytes of
+    output and the exitcode are recorded. Enabled with
+    enable_accounting().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.epoch = time.time()
+        self.records = []
+
+    @staticmethod
+    def command_class(command):
+        """ Returns the name of the program executed by 'command', skipping
+        'env' and leading variable assignments. """
+        if isinstance(command, basestring):
+            command = command.split()
+        for token in command:
+            if token == 'env' or '=' in token:
+                continue
+            return os.path.basename(token)
+        return "<empty>"
+
+    def record(self, command, start, duration, rusage, output_size, returncode):
+        """ Records a finished command """
+        entry = {
+            'class': self.command_class(command),
+            'command': command if isinstance(command, basestring) else " ".join(command),
+            'start': start,
+            'duration': duration,
+            'utime': rusage.ru_utime if rusage else 0.0,
+            'stime': rusage.ru_stime if rusage else 0.0,
+            'output_size': output_size,
+            'returncode': returncode,
+            'thread': threading.current_thread().ident,
+            }
+        with self.lock:
+            self.records.append(entry)
+
+    def summary(self):
+        """ Returns a table (list of lines) that sums up the usage per
+        command class, sorted by wall time """
+        classes = {}
+        for entry in self.records:
+            c = classes.setdefault(entry['class'], [0, 0.0, 0.0, 0, 0])
+            c[0] += 1
+            c[1] += entry['duration']
+            c[2] += entry['utime'] + entry['stime']
+            c[3] += entry['output_size']
+            if entry['returncode'] != 0:
+                c[4] += 1
+
+        lines = ["%-20s %8s %12s %12s %14s %8s" % \
+                     ("command", "calls", "wall [s]", "cpu [s]", "output [B]", "failed")]
+        for (name, c) in sorted(classes.items(), key=lambda x: -x[1][1]):
+            lines.append("%-20s %8d %12.3f %12.3f %14d %8d" % \
+                             (name, c[0], c[1], c[2], c[3], c[4]))
+        return lines
+
+    def write_trace(self, path):
+        """ Writes all records as Chrome trace events (JSON) to 'path' """
+        events = []
+        for entry in self.records:
+            events.append({
+                'name': entry['class'],
+                'cat': 'command',
+                'ph': 'X',
+                'ts': int((entry['start'] - self.epoch) * 1e6),
+                'dur': int(entry['duration'] * 1e6),
+                'pid': os.getpid(),
+                'tid': entry['thread'],
+                'args': {
+                    'command': entry['command'],
+                    'returncode': entry['returncode'],
+                    'utime': entry['utime'],
+                    'stime': entry['stime'],
+                    'output_size': entry['output_size'],
+                    },
+                })
+        with open(path, 'w') as fd:
+            json.dump({'traceEvents': events}, fd)
+
+    def dump(self, trace_file=None):
+        """ Prints the summary to stderr and optionally writes the trace """
+        if not self.records:
+            return
+        sys.stderr.write("\n".join(self.summary()) + "\n")
+        if trace_file:
+            self.write_trace(trace_file)
+
+
+# the active CommandAccounting object, see enable_accounting()
+accounting = None
+
+
+def enable_accounting(trace_file=None):
+    """
+    enables the accounting of all commands run by this module
+
+    At exit, a summary table is printed to stderr, and if 'trace_file'
+    is given, a Chrome trace-event JSON file (chrome://tracing) is
+    written. Accounting is also enabled by setting the environment
+    variable VAMOS_TRACE, e.g., to the path of the trace file.
+
+    returns the CommandAccounting object
+    """
+    global accounting
+    if not accounting:
+        accounting = CommandAccounting()
+        atexit.register(accounting.dump, trace_file)
+    return accounting
+
+
+def wait_for_process(p, command, start, output_size):
+    """
+    waits for the Popen object 'p' to terminate, sets its returncode and
+    records the resource usage of 'command' if accounting is enabled
+
+    returns the exitcode
+    """
+    while True:
+        try:
+            (_, status, rusage) = os.wait4(p.pid, 0)
+            break
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno != errno.ECHILD:
+                raise
+            # already reaped elsewhere
+            (status, rusage) = (None, None)
+            break
+
+    if status is None:
+        p.wait()
+    elif os.WIFSIGNALED(status):
+        p.returncode = -os.WTERMSIG(status)
+    else:
+        p.returncode = os.WEXITSTATUS(status)
+
+    if accounting:
+        accounting.record(command, start, time.time() - start, rusage,
+                          output_size, p.returncode)
+    return p.returncode
+
+
 def setup_logging(log_level):
     """ setup the logging module with the given log_level """
 
@@ -79,10 +250,13 @@ def execute(command, echo=True, failok=True):
 
     if echo:
         logging.debug("executing: " + command)
+    start = time.time()
 #   stderr is merged into STDOUT
     p = Popen(command, stdout=PIPE, stderr=STDOUT, shell=True)
-#   communicate() waits for the process to terminate and sets p.returncode
-    (stdout, _)  = p.communicate()
+    stdout = p.stdout.read()
+    p.stdout.close()
+#   wait_for_process() waits for the process to terminate and sets p.returncode
+    wait_for_process(p, command, start, len(stdout))
     if not failok and p.returncode != 0:
         raise CommandFailed(command, p.returncode, stdout.__str__().rsplit('\n'))
     if len(stdout) > 0 and stdout[-1] == '\n':
@@ -90,6 +264,419 @@ def execute(command, echo=True, failok=True):
     return (stdout.__str__().rsplit('\n'), p.returncode)
 
 
+def command_environment(env=None):
+    """
+    returns a copy of the current environment for running helper tools
+
+    The locale is forced to 'C' so that the output of the tools can be
+    parsed reliably. Entries of the optional dict 'env' are added on top.
+    """
+    ret = dict(os.environ)
+    ret["LC_ALL"] = "C"
+    ret["LC_MESSAGES"] = "C"
+    if env:
+        ret.update(env)
+    return ret
+
+
+class StreamingExecution(object):
+    """
+    runs a command and yields its output line by line as it arrives
+
+    Unlike execute(), the output is never buffered as a whole, the
+    environment of this process is not modified, and 'argv' may be a
+    list of arguments that is executed without a shell. If 'argv' is a
+    string, it is executed in a shell.
+
+    Iterating over the object runs the command to completion. Afterwards,
+    the following attributes are set:
+     - returncode: the exitcode
+     - duration: the wall time in seconds
+     - output_size: the number of bytes the command has written
+     - peak_output_size: the largest number of bytes that was buffered at
+       once while waiting for a complete line
+
+    If 'timeout' (in seconds) is exceeded, the command is killed and
+    CommandTimedOut is raised. If failok is set to false, CommandFailed
+    is raised for a non-zero exitcode. Both exceptions carry the last
+    lines of output in their 'stdout' attribute.
+    """
+
+    # lines of output kept for error reporting
+    tail_length = 50
+
+    def __init__(self, argv, env=None, cwd=None, timeout=None, echo=True,
+                 failok=True):
+        self.argv = argv
+        self.env = command_environment(env)
+        self.cwd = cwd
+        self.timeout = timeout
+        self.echo = echo
+        self.failok = failok
+        self.returncode = None
+        self.duration = None
+        self.output_size = 0
+        self.peak_output_size = 0
+
+    def command(self):
+        """ returns the command as a string, e.g., for logging """
+        if isinstance(self.argv, basestring):
+            return self.argv
+        return " ".join(self.argv)
+
+    def __iter__(self):
+        if self.echo:
+            logging.debug("executing: " + self.command())
+
+        start = time.time()
+        tail = deque(maxlen=self.tail_length)
+#       stderr is merged into STDOUT
+        p = Popen(self.argv, stdout=PIPE, stderr=STDOUT, env=self.env,
+                  cwd=self.cwd, shell=isinstance(self.argv, basestring))
+        fd = p.stdout.fileno()
+        pending = ""
+        try:
+            while True:
+                if self.timeout is not None:
+                    remaining = start + self.timeout - time.time()
+                    if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                        p.kill()
+                        wait_for_process(p, self.argv, start, self.output_size)
+                        self.duration = time.time() - start
+                        self.returncode = p.returncode
+                        raise CommandTimedOut(self.command(), p.returncode,
+                                              list(tail), self.timeout)
+                data = os.read(fd, 65536)
+                if not data:
+                    break
+                self.output_size += len(data)
+                pending += data
+                self.peak_output_size = max(self.peak_output_size, len(pending))
+                lines = pending.split('\n')
+                pending = lines.pop()
+                for line in lines:
+                    tail.append(line)
+                    yield line
+            if pending:
+                tail.append(pending)
+                yield pending
+            wait_for_process(p, self.argv, start, self.output_size)
+        finally:
+            if p.returncode is None:
+                if p.poll() is None:
+                    p.kill()
+                wait_for_process(p, self.argv, start, self.output_size)
+            p.stdout.close()
+
+        self.duration = time.time() - start
+        self.returncode = p.returncode
+        if not self.failok and p.returncode != 0:
+            raise CommandFailed(self.command(), p.returncode, list(tail))
+
+
+def execute_streaming(argv, env=None, cwd=None, timeout=None, echo=True,
+                      failok=True):
+    """
+    executes 'argv' and returns a StreamingExecution object, which yields
+    the command's output line by line when iterated over.
+
+    See StreamingExecution for the meaning of the parameters.
+    """
+    return StreamingExecution(argv, env=env, cwd=cwd, timeout=timeout,
+                              echo=echo, failok=failok)
+
+
+class Job(object):
+    """ A command run by JobRunner together with its result
+
+    Attributes:
+        command    -- the command, executed in a shell
+        output     -- the command's standard output as list of lines
+        returncode -- the exitcode, None if the job has not been run
+        start      -- the time.time() the job has been started at
+        duration   -- the wall time of the job in seconds
+        cancelled  -- True if the job was cancelled before or while running
+    """
+    def __init__(self, command):
+        self.command = command
+        self.output = []
+        self.returncode = None
+        self.start = None
+        self.duration = None
+        self.cancelled = False
+
+    def __repr__(self):
+        return "<Job '%s' (returncode: %s)>" % (self.command, self.returncode)
+
+
+class JobRunner(object):
+    """
+    runs batches of independent commands concurrently
+
+    At most 'jobs' commands are run at the same time (default: the number
+    of online processors). Each command is run like execute() does,
+    i.e., in a shell with stderr merged into stdout.
+
+    cancel() may be called from any thread to kill all running commands
+    and skip the ones that have not been started yet.
+    """
+
+    def __init__(self, jobs=None, echo=True):
+        if not jobs:
+            jobs = get_online_processors()
+        self.jobs = max(1, jobs)
+        self.echo = echo
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.processes = set()
+
+    def cancel(self):
+        """ cancels all running and pending jobs of the current batch """
+        self.cancelled.set()
+        with self.lock:
+            for p in self.processes:
+                # the pid of a reaped process may have been reused
+                if p.returncode is not None:
+                    continue
+                try:
+                    p.kill()
+                except OSError:
+                    pass
+
+    def run(self, commands, failok=True):
+        """
+        runs all 'commands' and returns a list of Job objects in the
+        order of 'commands'
+
+        if failok is set to false, the batch is cancelled as soon as a
+        command fails, and CommandFailed is raised for the first failed
+        command.
+        """
+        self.cancelled.clear()
+        jobs = [Job(command) for command in commands]
+        queue = Queue.Queue()
+        for job in jobs:
+            queue.put(job)
+
+        threads = []
+        for _ in range(min(self.jobs, len(jobs))):
+            thread = threading.Thread(target=self.__worker, args=(queue, failok))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for thread in threads:
+                # join with a timeout, otherwise Ctrl-C is not delivered
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+
+        for job in jobs:
+            if job.start is None:
+                job.cancelled = True
+
+        if not failok:
+            for job in jobs:
+                if job.returncode and not job.cancelled:
+                    raise CommandFailed(job.command, job.returncode, job.output)
+        return jobs
+
+    def __worker(self, queue, failok):
+        while not self.cancelled.is_set():
+            try:
+                job = queue.get_nowait()
+            except Queue.Empty:
+                return
+            self.__run_job(job)
+            if not failok and job.returncode != 0:
+                self.cancel()
+
+    def __run_job(self, job):
+        if self.echo:
+            logging.debug("executing: " + job.command)
+        job.start = time.time()
+        p = Popen(job.command, stdout=PIPE, stderr=STDOUT, shell=True,
+                  env=command_environment())
+        with self.lock:
+            self.processes.add(p)
+        if self.cancelled.is_set():
+            p.kill()
+        stdout = p.stdout.read()
+        p.stdout.close()
+        # not reaped yet, so cancel() cannot signal a reused pid
+        with self.lock:
+            self.processes.discard(p)
+        wait_for_process(p, job.command, job.start, len(stdout))
+
+        job.duration = time.time() - job.start
+        job.returncode = p.returncode
+        job.cancelled = self.cancelled.is_set() and p.returncode < 0
+        if len(stdout) > 0 and stdout[-1] == '\n':
+            stdout = stdout[:-1]
+        job.output = stdout.rsplit('\n')
+
+
+def execute_parallel(commands, jobs=None, echo=True, failok=True):
+    """
+    executes all 'commands' concurrently with a JobRunner, running at
+    most 'jobs' at the same time (default: number of online processors).
+
+    returns a list with one tuple per command (in order) like execute():
+     1. the command's standard output as list of lines
+     2. the exitcode (None if the command was cancelled before it ran)
+    """
+    if not commands:
+        return []
+    results = JobRunner(jobs, echo=echo).run(commands, failok=failok)
+    return [(job.output, job.returncode) for job in results]
+
+
+class Future(object):
+    """
+    The result of a function submitted to a ThreadPool
+
+    Callbacks added with add_done_callback() are called with the future
+    as soon as the function has returned or raised, in the thread that
+    ran it (or immediately, if the future is already done).
+    """
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.done_event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+        self.value = None
+        self.exc_info = None
+        self.cancelled = False
+
+    def done(self):
+        return self.done_event.is_set()
+
+    def add_done_callback(self, callback):
+        with self.lock:
+            if not self.done():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def cancel(self):
+        """ marks the future as cancelled, if it has not run yet """
+        with self.lock:
+            if self.done():
+                return False
+            self.cancelled = True
+        self.__finish(None, None)
+        return True
+
+    def run(self):
+        with self.lock:
+            if self.cancelled:
+                return
+        try:
+            self.__finish(self.fn(*self.args), None)
+        except Exception:
+            self.__finish(None, sys.exc_info())
+
+    def __finish(self, value, exc_info):
+        with self.lock:
+            self.value = value
+            self.exc_info = exc_info
+            self.done_event.set()
+            callbacks = self.callbacks
+            self.callbacks = []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logging.error("Callback of %s failed: %s", self.fn, e)
+
+    def exception(self):
+        """ returns the exception raised by the function, or None """
+        self.wait()
+        return self.exc_info[1] if self.exc_info else None
+
+    def result(self):
+        """ returns the result of the function, reraises its exception """
+        self.wait()
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+
+    def wait(self):
+        # wait with a timeout, otherwise Ctrl-C is not delivered
+        while not self.done_event.wait(1):
+            pass
+
+
+class ThreadPool(object):
+    """
+    runs python functions on a fixed number of worker threads
+
+    submit() returns a Future for each function. The worker threads are
+    started on the first submit() and stopped by shutdown(); they are
+    daemon threads, so an interrupted main thread does not hang at exit.
+    """
+
+    def __init__(self, workers=None):
+        if not workers:
+            workers = get_online_processors()
+        self.workers = max(1, workers)
+        self.queue = Queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        """ schedules fn(*args) and returns its Future """
+        future = Future(fn, args)
+        with self.lock:
+            if not self.threads:
+                for _ in range(self.workers):
+                    thread = threading.Thread(target=self.__worker)
+                    thread.daemon = True
+                    thread.start()
+                    self.threads.append(thread)
+        self.queue.put(future)
+        return future
+
+    def __worker(self):
+        while True:
+            future = self.queue.get()
+            if future is None:
+                return
+            future.run()
+
+    def shutdown(self, cancel=False):
+        """ stops the workers after all submitted functions have run; if
+        @cancel is set, functions that have not been started are skipped """
+        if cancel:
+            while True:
+                try:
+                    future = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if future:
+                    future.cancel()
+        with self.lock:
+            threads = self.threads
+            self.threads = []
+        for _ in threads:
+            self.queue.put(None)
+        if not cancel:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(cancel=exc_type is not None)
+
+
 def calculate_worklist(args, batch_mode=False):
     """
     Calculates a sanitizes worklist from a list of given arguments
@@ -167,6 +754,106 @@ def get_online_processors():
     return threads
 
 
+class DirectoryCache(object):
+    """
+    Caches directory listings to answer existence queries without a stat
+    call per file
+
+    Each directory is read with a single os.listdir() on first use. Only
+    if it is asked whether an existing entry is a directory (or a file),
+    that entry is stat'ed once. Paths are used as given (normalized, but
+    not made absolute), so the cache has to be invalidated after changing
+    the working directory or modifying the tree, see invalidate().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # normalized path of a directory -> set of entries, or None if it
+        # is not a (readable) directory
+        self.listings = {}
+        # normalized path of an existing entry -> is a directory
+        self.kinds = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __listing(self, path):
+        try:
+            listing = self.listings[path]
+            self.hits += 1
+            return listing
+        except KeyError:
+            pass
+
+        self.misses += 1
+        try:
+            listing = frozenset(os.listdir(path))
+        except OSError:
+            listing = None
+        with self.lock:
+            self.listings[path] = listing
+        return listing
+
+    def listdir(self, path):
+        """ returns the set of entries in @path, None if @path is not a
+        (readable) directory """
+        return self.__listing(os.path.normpath(path))
+
+    def __exists(self, path):
+        """ tests if the normalized @path exists """
+        (dirname, basename) = os.path.split(path)
+        if not basename or basename in ('.', '..'):
+            return self.__listing(path) is not None
+        listing = self.__listing(dirname or '.')
+        return listing is not None and basename in listing
+
+    def __isdir(self, path):
+        """ tests if the normalized, existing @path is a directory """
+        if self.listings.get(path) is not None:
+            return True
+        try:
+            return self.kinds[path]
+        except KeyError:
+            pass
+        isdir = os.path.isdir(path)
+        with self.lock:
+            self.kinds[path] = isdir
+        return isdir
+
+    def exists(self, path):
+        """ cached variant of os.path.exists() """
+        return self.__exists(os.path.normpath(path))
+
+    def isdir(self, path):
+        """ cached variant of os.path.isdir() """
+        path = os.path.normpath(path)
+        return self.__exists(path) and self.__isdir(path)
+
+    def isfile(self, path):
+        """ cached variant of os.path.isfile(), i.e., an existing entry
+        that is not a directory """
+        path = os.path.normpath(path)
+        return self.__exists(path) and not self.__isdir(path)
+
+    def invalidate(self, path=None):
+        """ drops the cached listing of the directory @path (and its
+        subdirectories), or all listings if @path is None """
+        with self.lock:
+            if path is None:
+                self.listings = {}
+                self.kinds = {}
+                return
+            path = os.path.normpath(path)
+            prefix = path + os.sep
+            for cache in (self.listings, self.kinds):
+                for p in cache.keys():
+                    if p == path or p.startswith(prefix) or path == '.':
+                        del cache[p]
+
+
+# the DirectoryCache that is shared by golem and kbuildparse
+dircache = DirectoryCache()
+
+
 def get_architecture(rpath):
     """Return the architecture of the given relative path (Linux tree).
     If the path does not contain 'arch', return None."""
@@ -240,3 +927,7 @@ def get_config_string(item, model):
     if model.get_type(item) == "tristate":
         return "(CONFIG_" + item + " || CONFIG_" + item + "_MODULE)"
     return "CONFIG_" + item
+
+
+if os.environ.get("VAMOS_TRACE"):
+    enable_accounting(os.environ["VAMOS_TRACE"])
@@ -51,6 +51,9 @@ class BuildFramework:
 
         loglevel: sets the loglevel, see the logging package.
 
+        outdir: output directory (make O=) for the configurations, only
+        supported by the Linux build framework.
+
         Note: in the args dictionary, the 'undertaker' key can be used
         to pass extra arguments to undertaker when calculating the
         configurations. For instance, pass "-C simple" to select the
@@ -198,8 +201,10 @@ class BuildFramework:
                     cfgfile = config_obj.kconfig
                     return_dict['all_configs'].append(cfgfile)
                     config_obj.switch_to()
-                    if kbuild.file_in_current_configuration(filename, config_obj.arch,
-                                                           config_obj.subarch) != "n":
+                    mode = kbuild.file_in_current_configuration(filename, config_obj.arch,
+                                                                config_obj.subarch,
+                                                                self.options.get('outdir'))
+                    if mode != "n":
                         logging.info("Configuration '%s' is actually compiled", cfgfile)
                         configs.append(config_obj)
                     else:
@@ -316,7 +321,16 @@ class KbuildBuildFramework(BuildFramework):
         raise NotImplementedError
 
     def file_in_current_configuration(self, filename):
-        return kbuild.file_in_current_configuration(filename, arch=self.options['arch'])
+        return kbuild.file_in_current_configuration(filename, arch=self.options['arch'],
+                                                    subarch=self.options.get('subarch'),
+                                                    outdir=self.options.get('outdir'))
+
+    def config_file(self):
+        """
+        returns the path to the '.config' file, which is placed in the
+        output directory if the option 'outdir' (make O=) is set
+        """
+        return os.path.join(self.options.get('outdir') or '', '.config')
 
     def apply_configuration(self):
         """
@@ -329,10 +343,14 @@ class KbuildBuildFramework(BuildFramework):
         deletes various autoconf.h files
         returns a list of deleted files
         """
-        (files, _) = tools.execute("find include -name autoconf.h -print -delete",
+        include = os.path.join(self.options.get('outdir') or '', 'include')
+        (files, _) = tools.execute("find '%s' -name autoconf.h -print -delete" % include,
                              failok=False)
         return files
 
+    def find_autoconf(self):
+        return kbuild.find_autoconf(self.options.get('outdir'))
+
     def verify_configurations(self, filename):
         logging.info("Testing which configurations are actually being compiled for '%s'",
                      filename)
@@ -491,7 +509,8 @@ class LinuxBuildFramework(KbuildBuildFramework):
         """
         try:
             kbuild.apply_configuration(arch=self.options['arch'],
-                                subarch=self.options['subarch'])
+                                subarch=self.options['subarch'],
+                                outdir=self.options.get('outdir'))
         except RuntimeError as e:
             logging.error("Expanding configuration failed: %s", e.message)
 
@@ -502,7 +521,8 @@ class LinuxBuildFramework(KbuildBuildFramework):
         return kbuild.call_linux_makefile(target, extra_env=extra_env, failok=failok,
                                           extra_variables=extra_variables,
                                           arch=self.options['arch'],
-                                          subarch=self.options['subarch'])
+                                          subarch=self.options['subarch'],
+                                          outdir=self.options.get('outdir'))
 
 
 class BusyboxBuildFramework(KbuildBuildFramework):
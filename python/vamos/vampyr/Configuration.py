@@ -219,7 +219,7 @@ class KbuildConfiguration(Configuration):
         self.call_makefile(self.expansion_strategy, extra_env=extra_env)
         self.framework.apply_configuration()
 
-        self.expanded = self.save_expanded('.config')
+        self.expanded = self.save_expanded(self.framework.config_file())
 
         if verify:
             modelf = Model.get_model_for_arch(self.arch)
@@ -259,22 +259,23 @@ class KbuildConfiguration(Configuration):
         expanded = self.get_expanded()
 
         if expanded:
-            shutil.copy(expanded, '.config')
+            shutil.copy(expanded, self.framework.config_file())
         else:
             stdconfig = self.framework.options['stdconfig']
             self.call_makefile(stdconfig, failok=False)
 
             # mark this configuration as already expanded, now that we have saved it
-            self.expanded = self.save_expanded('.config')
+            self.expanded = self.save_expanded(self.framework.config_file())
             shutil.copy(self.expanded, self.kconfig)
 
         self.framework.apply_configuration()
 
         if not self.framework.options.has_key('stdconfig_files'):
             self.framework.options['stdconfig_files'] \
-                = set(kbuild.files_for_current_configuration(self.arch, self.subarch))
+                = set(kbuild.files_for_current_configuration(self.arch, self.subarch,
+                        outdir=self.framework.options.get('outdir')))
 
-    def verify(self, expanded_config='.config'):
+    def verify(self, expanded_config=None):
         """
         verifies that the given expanded configuration satisfies the
         constraints of the given partial configuration.
@@ -284,6 +285,8 @@ class KbuildConfiguration(Configuration):
           violators: list of items that violate the partial selection
         """
 
+        if expanded_config is None:
+            expanded_config = self.framework.config_file()
         partial_config = Config(self.kconfig)
         config = Config(expanded_config)
         conflicts = config.getConflicts(partial_config)
@@ -293,19 +296,21 @@ class KbuildConfiguration(Configuration):
     def switch_to(self):
         logging.info("Switching to configuration %s", self)
 
+        config_file = self.framework.config_file()
+
         # sanity check: remove existing configuration to ensure consistent behavior
-        if os.path.exists(".config"):
-            os.unlink(".config")
+        if os.path.exists(config_file):
+            os.unlink(config_file)
 
         if self.expanded is None:
             logging.debug("Expanding partial configuration %s", self.kconfig)
             self.expand()
         else:
             # now replace the old .config with our 'expanded' one
-            shutil.copyfile(self.expanded, '.config')
+            shutil.copyfile(self.expanded, config_file)
             self.framework.apply_configuration()
 
-        assert os.path.exists('.config')
+        assert os.path.exists(config_file)
 
 
     def call_make(self, on_file, extra_args):
@@ -316,8 +321,9 @@ class KbuildConfiguration(Configuration):
         if not 'CHECK=' in extra_args:
             self.call_makefile(on_object, failok=True, extra_variables=extra_args)
 
-        if os.path.exists(on_object):
-            os.unlink(on_object)
+        built_object = os.path.join(self.framework.options.get('outdir') or '', on_object)
+        if os.path.exists(built_object):
+            os.unlink(built_object)
 
         try:
             cmd = None
@@ -491,7 +497,8 @@ class LinuxPartialConfiguration(LinuxConfiguration):
         # overriden one from the configuration. (i.e., handle subarch changes gracefully)
         return kbuild.call_linux_makefile(target, extra_variables=extra_variables,
                                           arch=self.arch, subarch=self.subarch,
-                                          failok=failok)
+                                          failok=failok,
+                                          outdir=self.framework.options.get('outdir'))
 
 
 class LinuxStdConfiguration(LinuxConfiguration):